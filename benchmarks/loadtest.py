@@ -0,0 +1,417 @@
+"""Нагрузочный тест бота: сотни мерчендайзеров против заглушки веб-сервиса.
+
+Синтетические обновления Telegram подаются в Dispatcher из main.py и
+проходят весь сценарий UserState: контакт → магазин → геолокация → тип →
+фото, а часть раундов (--competitor-share) — ветку ДМП конкурента: тип →
+бренд → количество. Веб-сервис и Bot API заменены aiohttp-заглушкой в том же процессе
+(benchmarks/stub_server.py), Redis — локальный или fakeredis (--fake-redis).
+
+    python -m benchmarks.loadtest --users 200 --latency-ms 50
+    python -m benchmarks.loadtest --users 50 --rounds 3 --fake-redis --json out.json
+
+Отчет: пропускная способность, p50/p95/p99 по шагам, доставка очереди
+отправки и пиковый RSS процесса.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+from datetime import datetime
+
+STEPS = (
+    "start",
+    "contact",
+    "market",
+    "store",
+    "location",
+    "type",
+    "photo",
+    "brand",
+    "count",
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100, help="число агентов")
+    parser.add_argument(
+        "--rounds", type=int, default=1, help="раундов на агента (повтор с типа фото)"
+    )
+    parser.add_argument(
+        "--competitor-share",
+        type=float,
+        default=0.2,
+        help="доля раундов с ДМП конкурента (количество без фото)",
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=5, help="за сколько секунд стартуют все агенты"
+    )
+    parser.add_argument(
+        "--think-ms", type=float, default=0, help="пауза агента между шагами"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=50, help="задержка ответа веб-сервиса"
+    )
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument(
+        "--telegram-latency-ms", type=float, default=0, help="задержка Bot API"
+    )
+    parser.add_argument("--stores", type=int, default=3, help="магазинов у агента")
+    parser.add_argument(
+        "--image-size", default="1600x1200", help="размер синтетических фото"
+    )
+    parser.add_argument(
+        "--image-pool", type=int, default=16, help="число разных фото в пуле"
+    )
+    parser.add_argument(
+        "--fake-redis", action="store_true", help="fakeredis вместо REDIS_HOST"
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=60,
+        help="сколько ждать доставки очереди отправки после сценария",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="записать результаты в файл")
+    return parser.parse_args()
+
+
+def configure_environment() -> None:
+    """Значения по умолчанию до импорта config: load_config читает окружение."""
+    defaults = {
+        "SECRET_KEY": "123456:LOADTEST",
+        "REDIS_HOST": "localhost",
+        "REDIS_PORT": "6379",
+        "REDIS_DB": "0",
+        "REDIS_PASSWORD": "",
+        "LOG_LEVEL": "ERROR",
+        "METRICS_ENABLED": "0",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def install_fake_redis() -> None:
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit(
+            "Для --fake-redis нужен fakeredis: pip install -r requirements-dev.txt"
+        )
+
+    import config.redis_connect as redis_connect
+
+    class FakeRedis(fakeredis.FakeAsyncRedis):
+        # Блокирующие команды fakeredis ждут внутри event loop и
+        # останавливают весь процесс, поэтому BLMOVE заменен опросом.
+        async def blmove(self, first, second, timeout, src="LEFT", dest="RIGHT"):
+            deadline = time.monotonic() + timeout
+            while True:
+                value = await self.lmove(first, second, src, dest)
+                if value is not None or time.monotonic() >= deadline:
+                    return value
+                await asyncio.sleep(0.02)
+
+    client = FakeRedis()
+    redis_connect.redis_client = client
+    redis_connect.fsm_storage.redis = client
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class Merchandiser:
+    """Один виртуальный агент: шлет обновления по сценарию и замеряет шаги."""
+
+    def __init__(self, harness: "Harness", agent: int, think: float):
+        self.harness = harness
+        self.agent = agent
+        self.user_id = 10_000_000 + agent
+        self.phone = f"99670{agent:07d}"
+        self.think = think
+
+    def _message(self, **fields):
+        from aiogram.types import Chat, Message, User
+
+        return Message(
+            message_id=self.harness.next_update_id(),
+            date=datetime.now(),
+            chat=Chat(id=self.user_id, type="private"),
+            from_user=User(id=self.user_id, is_bot=False, first_name="Load"),
+            **fields,
+        )
+
+    async def _step(self, step: str, **fields) -> None:
+        from aiogram.types import Update
+
+        update = Update(
+            update_id=self.harness.next_update_id(), message=self._message(**fields)
+        )
+        started = time.perf_counter()
+        try:
+            await self.harness.dp.feed_update(self.harness.bot, update)
+        except Exception as e:
+            self.harness.errors[step] = self.harness.errors.get(step, 0) + 1
+            print(f"{step}: {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            self.harness.timings[step].append(time.perf_counter() - started)
+        if self.think:
+            await asyncio.sleep(self.think)
+
+    async def _photo_round(self, number: int) -> None:
+        from aiogram.types import Document
+
+        await self._step("type", text="РМП_чай_ДО")
+        file_id = f"{self.agent}-{number}"
+        await self._step(
+            "photo",
+            document=Document(
+                file_id=file_id,
+                file_unique_id=f"{file_id}-{self.harness.run_id}",
+                file_name=f"{file_id}.jpg",
+                mime_type="image/jpeg",
+            ),
+        )
+
+    async def _competitor_round(self) -> None:
+        from handlers.constants import COMPETITOR_BRANDS
+
+        await self._step("type", text="ДМП_конкурент")
+        await self._step("brand", text=random.choice(COMPETITOR_BRANDS))
+        await self._step("count", text=str(random.randint(1, 30)))
+
+    async def run(self, rounds: int, competitor_share: float) -> None:
+        from aiogram.types import Contact, Location
+
+        from benchmarks.stub_server import agent_stores
+
+        store = agent_stores(self.agent, 1)[0]
+
+        await self._step("start", text="/start")
+        await self._step(
+            "contact",
+            contact=Contact(
+                phone_number=self.phone, first_name="Load", user_id=self.user_id
+            ),
+        )
+        await self._step("market", text="🏪 Выбрать маркет")
+        await self._step("store", text=store["name"])
+        await self._step(
+            "location",
+            location=Location(latitude=store["latitude"], longitude=store["longitude"]),
+        )
+        for number in range(rounds):
+            if number:
+                await self._step("continue", text="📷 Продолжить в этом магазине")
+            if random.random() < competitor_share:
+                await self._competitor_round()
+            else:
+                await self._photo_round(number)
+
+
+class Harness:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.run_id = random.randrange(10**6)
+        self.timings: dict[str, list[float]] = {
+            step: [] for step in (*STEPS, "continue")
+        }
+        self.errors: dict[str, int] = {}
+        self._update_id = 0
+        self.dp = None
+        self.bot = None
+
+    def next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    async def _drain(self, outbox) -> dict:
+        deadline = time.monotonic() + self.args.drain_timeout
+        while True:
+            stats = await outbox.stats()
+            pending = stats["queued"] + stats["processing"] + stats["delayed"]
+            if not pending or time.monotonic() >= deadline:
+                return stats
+            await asyncio.sleep(0.2)
+
+    async def run(self) -> dict:
+        from aiogram import Bot
+        from aiogram.client.default import DefaultBotProperties
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        from aiogram.enums import ParseMode
+
+        from benchmarks.stub_server import StubServer, make_photo
+        from config.redis_connect import fsm_storage
+        from main import create_dispatcher
+        from services.backend import backend_client
+        from services.imaging import image_executor
+        from services.outbox import outbox
+
+        args = self.args
+        width, height = map(int, args.image_size.lower().split("x"))
+        started = time.perf_counter()
+        photos = [make_photo(width, height) for _ in range(args.image_pool)]
+        print(
+            f"Пул фото: {len(photos)} x ~{sum(map(len, photos)) // len(photos) // 1024} КБ "
+            f"за {time.perf_counter() - started:.1f}с",
+            file=sys.stderr,
+        )
+
+        stub = StubServer(
+            photos,
+            stores_per_agent=args.stores,
+            latency=args.latency_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+            telegram_latency=args.telegram_latency_ms / 1000,
+        )
+        url = await stub.start()
+
+        backend_client.config.base_url = url
+        self.bot = Bot(
+            token=os.environ["SECRET_KEY"],
+            session=AiohttpSession(api=TelegramAPIServer.from_base(url)),
+            default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        )
+        self.dp = create_dispatcher()
+        await backend_client.start()
+        image_executor.start()
+        await image_executor.warm_up()
+        outbox.start(self.bot)
+
+        base = self.run_id % 9000 * 1000
+        agents = [
+            Merchandiser(self, base + n, args.think_ms / 1000)
+            for n in range(args.users)
+        ]
+        delay = args.ramp / max(1, args.users)
+
+        async def launch(index: int, agent: Merchandiser) -> None:
+            await asyncio.sleep(index * delay)
+            await agent.run(args.rounds, args.competitor_share)
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(launch(i, a) for i, a in enumerate(agents)))
+            scenario_time = time.perf_counter() - started
+            outbox_stats = await self._drain(outbox)
+            total_time = time.perf_counter() - started
+        finally:
+            await outbox.stop()
+            image_executor.shutdown()
+            await backend_client.close()
+            await self.bot.session.close()
+            await stub.stop()
+            await fsm_storage.close()
+
+        updates = sum(len(values) for values in self.timings.values())
+        photo_posts = stub.stats.posts - stub.stats.json_posts
+        return {
+            "users": args.users,
+            "rounds": args.rounds,
+            "backend_latency_ms": args.latency_ms,
+            "updates": updates,
+            "scenario_seconds": round(scenario_time, 3),
+            "total_seconds": round(total_time, 3),
+            "updates_per_second": round(updates / scenario_time, 1),
+            "photos_per_second": round(photo_posts / total_time, 2),
+            "steps": {
+                step: {
+                    "count": len(values),
+                    "errors": self.errors.get(step, 0),
+                    "p50_ms": round(percentile(values, 50) * 1000, 1),
+                    "p95_ms": round(percentile(values, 95) * 1000, 1),
+                    "p99_ms": round(percentile(values, 99) * 1000, 1),
+                    "max_ms": round(max(values) * 1000, 1),
+                }
+                for step, values in self.timings.items()
+                if values
+            },
+            "outbox": outbox_stats,
+            "photos_sent": len(self.timings["photo"]),
+            "counts_sent": len(self.timings["count"]),
+            "posts_received": stub.stats.posts,
+            "photo_posts_received": photo_posts,
+            "error_replies": stub.stats.replies,
+            "uploaded_mb": round(stub.stats.uploaded_bytes / 1024 / 1024, 1),
+            "backend_requests": stub.stats.requests,
+            "backend_coalescing": backend_client.coalescing_stats(),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "peak_rss_workers_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        }
+
+
+def print_report(result: dict) -> None:
+    print(
+        f"\nАгентов: {result['users']}, раундов на агента: {result['rounds']}, "
+        f"задержка веб-сервиса: {result['backend_latency_ms']} мс"
+    )
+    print(
+        f"Обновлений: {result['updates']} за {result['scenario_seconds']}с "
+        f"({result['updates_per_second']}/с), фото доставлено: "
+        f"{result['photo_posts_received']} из {result['photos_sent']} "
+        f"({result['photos_per_second']}/с), количества ДМП: "
+        f"{result['posts_received'] - result['photo_posts_received']} "
+        f"из {result['counts_sent']}"
+    )
+    print(f"\n{'шаг':<10}{'n':>6}{'ошибки':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for step, row in result["steps"].items():
+        print(
+            f"{step:<10}{row['count']:>6}{row['errors']:>8}"
+            f"{row['p50_ms']:>8.1f}мс{row['p95_ms']:>8.1f}мс{row['p99_ms']:>8.1f}мс"
+        )
+    if result["error_replies"]:
+        print("\nОтветы бота с ошибками:")
+        for text, count in result["error_replies"].items():
+            print(f"{count:>6}  {text}")
+    outbox = result["outbox"]
+    print(
+        f"\nОчередь отправки: доставлено {outbox['delivered']}, в очереди "
+        f"{outbox['queued'] + outbox['processing'] + outbox['delayed']}, "
+        f"dead {outbox['dead']}, задержка p50/p95 "
+        f"{outbox['latency_p50']}/{outbox['latency_p95']}с"
+    )
+    for endpoint, row in result["backend_coalescing"].items():
+        print(
+            f"Запросы {endpoint}: отправлено {row['requests']}, "
+            f"объединено {row['coalesced']} ({row['ratio']:.0%})"
+        )
+    print(
+        f"Пиковый RSS: {result['peak_rss_mb']} МБ, "
+        f"воркеры изображений: {result['peak_rss_workers_mb']} МБ"
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    configure_environment()
+    if args.fake_redis:
+        install_fake_redis()
+
+    result = asyncio.run(Harness(args).run())
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(result, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""Микробенчмарки обработки фото на сгенерированном корпусе.
+
+Корпус создается в памяти при запуске (время в EXIF — текущее, поэтому
+проверка проходит по тому же пути, что и у свежих фото): JPEG с
+DateTimeOriginal, только DateTimeDigitized, только 0th DateTime и без EXIF,
+HEIC с EXIF и без, PNG без EXIF — в нескольких разрешениях. Для каждого
+файла замеряются этапы services.imaging: время (wall), CPU-время и пиковая
+память в отдельном процессе.
+
+    python -m benchmarks.photo_pipeline
+    python -m benchmarks.photo_pipeline --save-baseline photo_baseline.json
+    python -m benchmarks.photo_pipeline --json result.json --baseline photo_baseline.json
+
+С `--baseline` этапы, у которых медиана wall или CPU выросла больше допуска
+и больше минимальной разницы, печатаются как регрессии, а процесс
+завершается с кодом 1. Эталон годится только для машины, на которой он
+записан, поэтому в репозитории его нет: сохраните свой перед изменениями.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+
+from benchmarks.loadtest import configure_environment
+
+JPEG_VARIANTS = ("original", "digitized", "datetime", "noexif")
+COMMON_STAGES = ("check_time", "dhash", "normalize", "process_photo")
+HEIC_STAGES = ("heic_metadata", "heic_convert")
+
+
+@dataclass
+class Case:
+    name: str
+    filename: str
+    data: bytes
+
+    @property
+    def stages(self) -> tuple[str, ...]:
+        if self.filename.endswith(".heic"):
+            return HEIC_STAGES + COMMON_STAGES
+        return COMMON_STAGES
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="1280x960,4032x3024",
+        help="разрешения корпуса через запятую",
+    )
+    parser.add_argument("--repeat", type=int, default=7, help="замеров на этап")
+    parser.add_argument(
+        "--warmup", type=int, default=2, help="прогревочных запусков на этап"
+    )
+    parser.add_argument(
+        "--only", help="только кейсы, в имени которых есть эта подстрока"
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="не замерять пиковую память"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="записать результаты в файл")
+    parser.add_argument("--baseline", help="сравнить с сохраненными результатами")
+    parser.add_argument("--save-baseline", help="сохранить результаты как эталон")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="допустимое замедление медианы относительно эталона (доля)",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=10,
+        help="разница медиан меньше этой не считается регрессией",
+    )
+    return parser.parse_args()
+
+
+def _photo_image(width: int, height: int, rng: random.Random):
+    """Гладкий «сюжет» плюс зерно: по размеру файла похоже на фото с камеры."""
+    from PIL import Image
+
+    channels = []
+    for _ in range(3):
+        base = Image.frombytes("L", (16, 12), rng.randbytes(16 * 12))
+        base = base.resize((width, height), Image.Resampling.BICUBIC)
+        grain = Image.effect_noise((width, height), 24)
+        channels.append(Image.blend(base, grain, 0.15))
+    return Image.merge("RGB", channels)
+
+
+def _exif(variant: str) -> bytes | None:
+    import piexif
+
+    from benchmarks.stub_server import USER_TIMEZONE
+
+    stamp = datetime.now(USER_TIMEZONE).strftime("%Y:%m:%d %H:%M:%S").encode()
+    if variant == "original":
+        return piexif.dump({"Exif": {piexif.ExifIFD.DateTimeOriginal: stamp}})
+    if variant == "digitized":
+        return piexif.dump({"Exif": {piexif.ExifIFD.DateTimeDigitized: stamp}})
+    if variant == "datetime":
+        return piexif.dump({"0th": {piexif.ImageIFD.DateTime: stamp}})
+    return None
+
+
+def _encode(image, image_format: str, exif: bytes | None, **kwargs) -> bytes:
+    output = io.BytesIO()
+    if exif:
+        kwargs["exif"] = exif
+    image.save(output, image_format, **kwargs)
+    return output.getvalue()
+
+
+def build_corpus(sizes: list[tuple[int, int]], seed: int) -> list[Case]:
+    from services.imaging import load_imaging
+
+    load_imaging()  # регистрирует HEIF opener для сохранения HEIC
+    rng = random.Random(seed)
+    cases = []
+    for width, height in sizes:
+        size = f"{width}x{height}"
+        image = _photo_image(width, height, rng)
+        for variant in JPEG_VARIANTS:
+            data = _encode(image, "JPEG", _exif(variant), quality=92)
+            cases.append(Case(f"jpeg_{variant}_{size}", f"{variant}.jpg", data))
+        for variant in ("original", "noexif"):
+            # preset ultrafast: иначе кодирование 12 Мп в x265 занимает минуту
+            data = _encode(
+                image,
+                "HEIF",
+                _exif(variant),
+                quality=80,
+                enc_params={"preset": "ultrafast"},
+            )
+            cases.append(Case(f"heic_{variant}_{size}", f"{variant}.heic", data))
+        cases.append(Case(f"png_{size}", "photo.png", _encode(image, "PNG", None)))
+    return cases
+
+
+def stage_functions() -> dict:
+    from config.config import load_config
+    from services import imaging
+
+    options = load_config().imaging
+    options.normalize = True
+    return {
+        "check_time": lambda data, name: imaging.check_photo_creation_time(data, name),
+        "heic_metadata": imaging.get_heic_metadata,
+        "heic_convert": imaging.convert_heic_to_jpeg,
+        "dhash": lambda data, name: imaging.compute_dhash(data),
+        "normalize": lambda data, name: imaging.normalize_image(data, name, options),
+        "process_photo": lambda data, name: imaging.process_photo(
+            data, name, None, options
+        ),
+    }
+
+
+def time_stage(function, case: Case) -> tuple[float, float]:
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    function(case.data, case.filename)
+    return time.perf_counter() - wall_started, time.process_time() - cpu_started
+
+
+def summarize(wall: list[float], cpu: list[float]) -> dict:
+    return {
+        "wall_ms": round(statistics.median(wall) * 1000, 2),
+        "wall_min_ms": round(min(wall) * 1000, 2),
+        "cpu_ms": round(statistics.median(cpu) * 1000, 2),
+        "cpu_min_ms": round(min(cpu) * 1000, 2),
+    }
+
+
+def _status_kb(field: str) -> int | None:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    # Запись "5" в clear_refs сбрасывает VmHWM (Linux 4.0+)
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure_memory(stage: str, data: bytes, filename: str) -> float:
+    """Прирост пикового RSS за этап в МБ. Выполняется в отдельном свежем процессе.
+
+    RSS учитывает и буферы Pillow/libheif, которые не видит tracemalloc. Пик
+    сбрасывается перед этапом; без /proc берется ru_maxrss, который может
+    занижать результат из-за пика при импортах.
+    """
+    configure_environment()
+    functions = stage_functions()
+    from services.imaging import load_imaging
+
+    load_imaging()
+    before = _status_kb("VmRSS")
+    if before is not None and _reset_peak_rss():
+        functions[stage](data, filename)
+        after = _status_kb("VmHWM")
+    else:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        functions[stage](data, filename)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(max(0, after - before) / 1024, 1)
+
+
+def run(args: argparse.Namespace) -> dict:
+    sizes = [tuple(map(int, size.split("x"))) for size in args.sizes.split(",")]
+    started = time.perf_counter()
+    cases = build_corpus(sizes, args.seed)
+    if args.only:
+        cases = [case for case in cases if args.only in case.name]
+    print(
+        f"Корпус: {len(cases)} файлов за {time.perf_counter() - started:.1f}с",
+        file=sys.stderr,
+    )
+
+    functions = stage_functions()
+    stages = {
+        f"{case.name}/{stage}": (functions[stage], case)
+        for case in cases
+        for stage in case.stages
+    }
+    for _ in range(args.warmup):
+        for function, case in stages.values():
+            function(case.data, case.filename)
+    # Повторы идут проходами по всему корпусу, а не подряд для одного этапа:
+    # замедление машины на несколько секунд задевает один замер этапа, а не все
+    samples = {key: ([], []) for key in stages}
+    for _ in range(args.repeat):
+        for key, (function, case) in stages.items():
+            wall, cpu = time_stage(function, case)
+            samples[key][0].append(wall)
+            samples[key][1].append(cpu)
+    results = {
+        key: {"bytes": len(case.data), **summarize(*samples[key])}
+        for key, (_, case) in stages.items()
+    }
+
+    if not args.no_memory:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(mp_context=context, max_tasks_per_child=1) as pool:
+            futures = {
+                f"{case.name}/{stage}": pool.submit(
+                    measure_memory, stage, case.data, case.filename
+                )
+                for case in cases
+                for stage in case.stages
+            }
+            for key, future in futures.items():
+                results[key]["peak_mem_mb"] = future.result()
+
+    from PIL import __version__ as pillow_version
+
+    return {
+        "meta": {
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "pillow": pillow_version,
+            "machine": platform.machine(),
+            "processor": platform.processor() or platform.machine(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "sizes": args.sizes,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float, min_delta_ms: float
+) -> list[str]:
+    regressions = []
+    for key, row in results["results"].items():
+        reference = baseline["results"].get(key)
+        if reference is None:
+            continue
+        # Медиана по --repeat замерам: минимум на общей машине прыгает
+        # вместе с единичными удачными запусками
+        for metric in ("wall_ms", "cpu_ms"):
+            if metric not in reference:
+                continue
+            delta = row[metric] - reference[metric]
+            if delta > min_delta_ms and row[metric] > reference[metric] * (
+                1 + tolerance
+            ):
+                regressions.append(
+                    f"{key} {metric}: {reference[metric]} -> {row[metric]} "
+                    f"(+{delta / reference[metric]:.0%})"
+                )
+        if "peak_mem_mb" in row and "peak_mem_mb" in reference:
+            delta = row["peak_mem_mb"] - reference["peak_mem_mb"]
+            if delta > 5 and row["peak_mem_mb"] > reference["peak_mem_mb"] * (
+                1 + tolerance
+            ):
+                regressions.append(
+                    f"{key} peak_mem_mb: {reference['peak_mem_mb']} -> "
+                    f"{row['peak_mem_mb']}"
+                )
+    return regressions
+
+
+def print_report(results: dict, baseline: dict | None) -> None:
+    print(
+        f"\n{'кейс/этап':<42}{'КБ':>8}{'wall':>10}{'cpu':>10}{'память':>9}"
+        f"{'эталон':>10}"
+    )
+    for key, row in results["results"].items():
+        memory = row.get("peak_mem_mb")
+        reference = (baseline or {}).get("results", {}).get(key)
+        change = ""
+        if reference and reference["wall_ms"]:
+            change = f"{row['wall_ms'] / reference['wall_ms'] - 1:+.0%}"
+        print(
+            f"{key:<42}{row['bytes'] // 1024:>8}{row['wall_ms']:>8.1f}мс"
+            f"{row['cpu_ms']:>8.1f}мс"
+            f"{'' if memory is None else f'{memory:.1f}МБ':>9}{change:>10}"
+        )
+
+
+def main() -> None:
+    args = parse_args()
+    configure_environment()
+
+    results = run(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        host = baseline["meta"].get("host")
+        if host != platform.node():
+            print(
+                f"Эталон записан на другой машине ({host}), сравнение неточно",
+                file=sys.stderr,
+            )
+    print_report(results, baseline)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\nРегрессии относительно эталона:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nРегрессий относительно эталона нет")
+
+
+if __name__ == "__main__":
+    main()
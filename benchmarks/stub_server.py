@@ -0,0 +1,215 @@
+"""Заглушка веб-сервиса и Telegram Bot API для нагрузочного теста.
+
+Один aiohttp-сервер отвечает на `/api/*` веб-сервиса, методы Bot API
+(`/bot{token}/{method}`) и скачивание файлов (`/file/bot{token}/{path}`).
+Задержка ответов веб-сервиса задается параметрами, чтобы измерять бота
+при медленном бэкенде.
+"""
+
+import asyncio
+import io
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import piexif
+import pytz
+from aiohttp import web
+from PIL import Image
+
+USER_TIMEZONE = pytz.timezone("Asia/Bishkek")
+
+# Центр «города» для координат магазинов; каждый агент получает свои
+# магазины со сдвигом, чтобы они не пересекались геозонами.
+BASE_LATITUDE = 42.87
+BASE_LONGITUDE = 74.59
+
+ERROR_PREFIXES = ("❌", "⚠️", "❗", "Ошибка", "⏳ Сейчас много")
+
+
+def make_photo(width: int, height: int) -> bytes:
+    """JPEG со случайным содержимым и EXIF DateTimeOriginal = сейчас.
+
+    Содержимое — растянутый шум 16x12, поэтому перцептивные хэши разных
+    фото не совпадают и проверка дубликатов их не отклоняет.
+    """
+    noise = Image.frombytes("L", (16, 12), os.urandom(16 * 12))
+    image = noise.resize((width, height), Image.Resampling.BICUBIC).convert("RGB")
+    stamp = datetime.now(USER_TIMEZONE).strftime("%Y:%m:%d %H:%M:%S").encode()
+    exif = piexif.dump(
+        {
+            "0th": {piexif.ImageIFD.DateTime: stamp},
+            "Exif": {
+                piexif.ExifIFD.DateTimeOriginal: stamp,
+                piexif.ExifIFD.DateTimeDigitized: stamp,
+            },
+        }
+    )
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90, exif=exif)
+    return output.getvalue()
+
+
+def agent_stores(agent: int, count: int) -> list[dict]:
+    stores = []
+    for n in range(count):
+        stores.append(
+            {
+                "id": agent * 100 + n,
+                "name": f"Магазин {agent}-{n}",
+                "latitude": BASE_LATITUDE + (agent % 1000) * 0.01,
+                "longitude": BASE_LONGITUDE + n * 0.01,
+                "radius": 150,
+            }
+        )
+    return stores
+
+
+@dataclass
+class StubStats:
+    requests: dict[str, int] = field(default_factory=dict)
+    replies: dict[str, int] = field(default_factory=dict)
+    posts: int = 0
+    json_posts: int = 0
+    uploaded_bytes: int = 0
+
+    def hit(self, name: str) -> None:
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+    def reply(self, text: str) -> None:
+        """Считает сообщения бота об ошибках, чтобы отказы были видны в отчете."""
+        if text.startswith(ERROR_PREFIXES):
+            text = text.splitlines()[0][:80]
+            self.replies[text] = self.replies.get(text, 0) + 1
+
+
+class StubServer:
+    def __init__(
+        self,
+        photos: list[bytes],
+        stores_per_agent: int = 3,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        telegram_latency: float = 0.0,
+    ):
+        self.photos = photos
+        self.stores_per_agent = stores_per_agent
+        self.latency = latency
+        self.jitter = jitter
+        self.telegram_latency = telegram_latency
+        self.stats = StubStats()
+        self._message_id = 0
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def _delay(self, base: float) -> None:
+        delay = base + random.uniform(-self.jitter, self.jitter) if base else 0
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _agent_number(phone: str) -> int:
+        return int(phone.lstrip("+")[-7:])
+
+    async def agent(self, request: web.Request) -> web.Response:
+        self.stats.hit("agent")
+        await self._delay(self.latency)
+        phone = request.match_info["phone"]
+        return web.json_response({"id": self._agent_number(phone), "phone": phone})
+
+    async def agent_schedule(self, request: web.Request) -> web.Response:
+        self.stats.hit("agent_schedule")
+        await self._delay(self.latency)
+        agent = self._agent_number(request.match_info["phone"])
+        return web.json_response(agent_stores(agent, self.stores_per_agent))
+
+    async def store_id(self, request: web.Request) -> web.Response:
+        self.stats.hit("store_id")
+        await self._delay(self.latency)
+        name = request.match_info["name"]
+        agent, _, n = name.removeprefix("Магазин ").partition("-")
+        return web.json_response({"id": int(agent) * 100 + int(n), "name": name})
+
+    async def check_address(self, request: web.Request) -> web.Response:
+        self.stats.hit("check_address")
+        await self._delay(self.latency)
+        return web.json_response({"success": True, "distance": 10})
+
+    async def photo_posts(self, request: web.Request) -> web.Response:
+        self.stats.hit("photo_posts")
+        await self._delay(self.latency)
+        if request.content_type == "application/json":
+            await request.json()
+            self.stats.json_posts += 1
+        else:
+            async for part in await request.multipart():
+                self.stats.uploaded_bytes += len(await part.read())
+        self.stats.posts += 1
+        return web.json_response({"id": self.stats.posts}, status=201)
+
+    async def daily_plans(self, request: web.Request) -> web.Response:
+        self.stats.hit("daily_plans")
+        return web.json_response({})
+
+    async def bot_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.stats.hit(f"tg:{method}")
+        await self._delay(self.telegram_latency)
+        payload = dict(await request.post())
+        if method in ("sendmessage", "editmessagetext"):
+            self.stats.reply(payload.get("text", ""))
+
+        if method == "sendmessage":
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(payload.get("chat_id", 0)), "type": "private"},
+                "text": payload.get("text", ""),
+            }
+        elif method == "getfile":
+            file_id = payload["file_id"]
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_path": f"documents/{file_id}.jpg",
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def bot_file(self, request: web.Request) -> web.Response:
+        self.stats.hit("tg:file")
+        await self._delay(self.telegram_latency)
+        # file_id вида `{user}-{round}` выбирает фото из пула
+        name = os.path.splitext(os.path.basename(request.match_info["path"]))[0]
+        user, _, round_ = name.partition("-")
+        photo = self.photos[(int(user) + int(round_ or 0)) % len(self.photos)]
+        return web.Response(body=photo, content_type="image/jpeg")
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/api/agent/{phone}", self.agent)
+        app.router.add_get("/api/agent-schedule/{phone}", self.agent_schedule)
+        app.router.add_get("/api/store-id/{name}", self.store_id)
+        app.router.add_get("/api/check-address/{lon}/{lat}/{name}/", self.check_address)
+        app.router.add_post("/api/photo-posts/create/", self.photo_posts)
+        app.router.add_post("/api/record-daily-plans/", self.daily_plans)
+        app.router.add_post("/bot{token}/{method}", self.bot_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.bot_file)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets
+        self.url = f"http://{host}:{sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -19,10 +19,118 @@ class RedisConfig:
     redis_password: str
 
 
+@dataclass
+class BackendConfig:
+    base_url: str
+    pool_limit: int
+    pool_limit_per_host: int
+    keepalive_timeout: float
+    dns_cache_ttl: int
+    connect_timeout: float
+    default_timeout: float
+    upload_timeout: float
+
+
+@dataclass
+class CacheConfig:
+    agent_cache_size: int
+    agent_ttl: int
+    agent_negative_ttl: int
+    profile_ttl: int
+
+
+@dataclass
+class FsmConfig:
+    key_prefix: str
+    state_ttl: int
+    data_ttl: int
+
+
+@dataclass
+class StoreIndexConfig:
+    refresh_minutes: int
+
+
+@dataclass
+class PhotoConfig:
+    max_file_size: int
+    chunk_size: int
+    batch_concurrency: int
+    album_wait: float
+    duplicate_distance: int
+
+
+@dataclass
+class ImagingConfig:
+    workers: int
+    queue_limit: int
+    convert_concurrency: int
+    normalize: bool
+    max_edge: int
+    output_format: str
+    quality: int
+
+
+@dataclass
+class WebhookConfig:
+    mode: str
+    base_url: str
+    path: str
+    secret: str
+    host: str
+    port: int
+    drain_delay: float
+    drain_timeout: float
+
+
+@dataclass
+class OutboxConfig:
+    workers: int
+    max_attempts: int
+    backoff_base: float
+    backoff_max: float
+    lease_timeout: int
+    blob_ttl: int
+    upload_chunk_size: int
+    progress_min_size: int
+
+
+@dataclass
+class GeofenceConfig:
+    local: bool
+
+
+@dataclass
+class LoggingConfig:
+    level: str
+    levels: str
+    format: str
+    sample_rate: int
+    sample_window: float
+
+
+@dataclass
+class MetricsConfig:
+    enabled: bool
+    host: str
+    port: int
+
+
 @dataclass
 class Config:
     tg_bot: TgBot
     redis: RedisConfig
+    backend: BackendConfig
+    cache: CacheConfig
+    fsm: FsmConfig
+    store_index: StoreIndexConfig
+    photo: PhotoConfig
+    imaging: ImagingConfig
+    webhook: WebhookConfig
+    outbox: OutboxConfig
+    geofence: GeofenceConfig
+    logging: LoggingConfig
+    metrics: MetricsConfig
 
 
 def load_config() -> Config:
@@ -34,4 +142,81 @@ def load_config() -> Config:
             redis_db=int(os.getenv("REDIS_DB")),
             redis_password=os.getenv("REDIS_PASSWORD"),
         ),
+        backend=BackendConfig(
+            base_url=os.getenv("WEB_SERVICE_URL", "").rstrip("/"),
+            pool_limit=int(os.getenv("BACKEND_POOL_LIMIT", "100")),
+            pool_limit_per_host=int(os.getenv("BACKEND_POOL_LIMIT_PER_HOST", "30")),
+            keepalive_timeout=float(os.getenv("BACKEND_KEEPALIVE_TIMEOUT", "30")),
+            dns_cache_ttl=int(os.getenv("BACKEND_DNS_CACHE_TTL", "300")),
+            connect_timeout=float(os.getenv("BACKEND_CONNECT_TIMEOUT", "5")),
+            default_timeout=float(os.getenv("BACKEND_TIMEOUT", "10")),
+            upload_timeout=float(os.getenv("BACKEND_UPLOAD_TIMEOUT", "60")),
+        ),
+        cache=CacheConfig(
+            agent_cache_size=int(os.getenv("AGENT_CACHE_SIZE", "10000")),
+            agent_ttl=int(os.getenv("AGENT_CACHE_TTL", "600")),
+            agent_negative_ttl=int(os.getenv("AGENT_CACHE_NEGATIVE_TTL", "60")),
+            profile_ttl=int(os.getenv("PROFILE_CACHE_TTL", "60")),
+        ),
+        fsm=FsmConfig(
+            key_prefix=os.getenv("FSM_KEY_PREFIX", "fsm"),
+            state_ttl=int(os.getenv("FSM_STATE_TTL", str(24 * 3600))),
+            data_ttl=int(os.getenv("FSM_DATA_TTL", str(24 * 3600))),
+        ),
+        store_index=StoreIndexConfig(
+            refresh_minutes=int(os.getenv("STORE_INDEX_REFRESH_MINUTES", "60")),
+        ),
+        photo=PhotoConfig(
+            max_file_size=int(os.getenv("PHOTO_MAX_FILE_SIZE_MB", "20")) * 1024 * 1024,
+            chunk_size=int(os.getenv("PHOTO_CHUNK_SIZE_KB", "64")) * 1024,
+            batch_concurrency=int(os.getenv("PHOTO_BATCH_CONCURRENCY", "3")),
+            album_wait=float(os.getenv("PHOTO_ALBUM_WAIT", "1")),
+            duplicate_distance=int(os.getenv("PHOTO_DUPLICATE_DISTANCE", "3")),
+        ),
+        imaging=ImagingConfig(
+            workers=int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1)))),
+            queue_limit=int(os.getenv("IMAGE_QUEUE_LIMIT", "16")),
+            convert_concurrency=int(os.getenv("IMAGE_CONVERT_CONCURRENCY", "2")),
+            normalize=os.getenv("IMAGE_NORMALIZE", "1") == "1",
+            max_edge=int(os.getenv("IMAGE_MAX_EDGE", "2048")),
+            output_format=os.getenv("IMAGE_OUTPUT_FORMAT", "jpeg").lower(),
+            quality=int(os.getenv("IMAGE_QUALITY", "82")),
+        ),
+        webhook=WebhookConfig(
+            mode=os.getenv("BOT_MODE", "polling"),
+            base_url=os.getenv("WEBHOOK_URL", "").rstrip("/"),
+            path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            secret=os.getenv("WEBHOOK_SECRET", ""),
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8000")),
+            drain_delay=float(os.getenv("WEBHOOK_DRAIN_DELAY", "5")),
+            drain_timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "60")),
+        ),
+        outbox=OutboxConfig(
+            workers=int(os.getenv("OUTBOX_WORKERS", "4")),
+            max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10")),
+            backoff_base=float(os.getenv("OUTBOX_BACKOFF_BASE", "2")),
+            backoff_max=float(os.getenv("OUTBOX_BACKOFF_MAX", "600")),
+            lease_timeout=int(os.getenv("OUTBOX_LEASE_TIMEOUT", "300")),
+            blob_ttl=int(os.getenv("OUTBOX_BLOB_TTL_HOURS", "72")) * 3600,
+            upload_chunk_size=int(os.getenv("OUTBOX_UPLOAD_CHUNK_KB", "256")) * 1024,
+            progress_min_size=int(os.getenv("OUTBOX_PROGRESS_MIN_SIZE_MB", "2"))
+            * 1024
+            * 1024,
+        ),
+        geofence=GeofenceConfig(
+            local=os.getenv("GEOFENCE_LOCAL", "1") == "1",
+        ),
+        logging=LoggingConfig(
+            level=os.getenv("LOG_LEVEL", "INFO").upper(),
+            levels=os.getenv("LOG_LEVELS", ""),
+            format=os.getenv("LOG_FORMAT", "json").lower(),
+            sample_rate=int(os.getenv("LOG_SAMPLE_RATE", "50")),
+            sample_window=float(os.getenv("LOG_SAMPLE_WINDOW", "10")),
+        ),
+        metrics=MetricsConfig(
+            enabled=os.getenv("METRICS_ENABLED", "1") == "1",
+            host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            port=int(os.getenv("METRICS_PORT", "9100")),
+        ),
     )
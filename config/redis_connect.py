@@ -1,4 +1,8 @@
+import json
+from functools import partial
+
 import redis.asyncio as redis_async
+from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
 
 from config.config import load_config
 
@@ -10,3 +14,11 @@ redis_client = redis_async.Redis(
     db=config.redis.redis_db,
     password=config.redis.redis_password,
 )
+
+fsm_storage = RedisStorage(
+    redis=redis_client,
+    key_builder=DefaultKeyBuilder(prefix=config.fsm.key_prefix),
+    state_ttl=config.fsm.state_ttl or None,
+    data_ttl=config.fsm.data_ttl or None,
+    json_dumps=partial(json.dumps, ensure_ascii=False, separators=(",", ":")),
+)
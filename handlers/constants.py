@@ -17,6 +17,11 @@ COMPETITOR_BRANDS = [
     "Nestle",
 ]
 
+NEARBY_STORE_BUTTON = "📍 Найти магазин по геолокации"
+
+# Сколько секунд список магазинов рядом годится для выбора без проверки геолокации
+NEARBY_STORES_TTL = 120
+
 
 def validate_post_type(post_type: str) -> bool:
     return post_type in POST_TYPE_CHOICES
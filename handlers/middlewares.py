@@ -0,0 +1,61 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import TelegramObject
+
+from services.metrics import (
+    FSM_TRANSITIONS,
+    HANDLER_ERRORS,
+    HANDLER_IN_FLIGHT,
+    HANDLER_SECONDS,
+)
+
+UNSET = object()
+
+
+class TrackedFSMContext(FSMContext):
+    """FSMContext, запоминающий последнее установленное состояние.
+
+    Переход считается без повторного чтения состояния из Redis.
+    """
+
+    def __init__(self, storage, key):
+        super().__init__(storage, key)
+        self.new_state = UNSET
+
+    async def set_state(self, state=None) -> None:
+        await super().set_state(state)
+        self.new_state = state.state if isinstance(state, State) else state
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время, ошибки и число сообщений в обработке по хендлерам, переходы FSM."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        from_state = data.get("raw_state") or "none"
+
+        context = data.get("state")
+        if isinstance(context, FSMContext):
+            context = data["state"] = TrackedFSMContext(context.storage, context.key)
+
+        started = time.perf_counter()
+        try:
+            with HANDLER_IN_FLIGHT.track(name):
+                return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name, from_state)
+            if context is not None and context.new_state is not UNSET:
+                FSM_TRANSITIONS.inc(from_state, context.new_state or "none")
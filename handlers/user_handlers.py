@@ -1,25 +1,40 @@
+import asyncio
+import logging
 import os
+import time
 import uuid
 
-import aiohttp
 from aiogram import Bot, F, Router
 from aiogram.enums import ContentType
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 
+from config.config import load_config
 from fsms.fsm import UserState
-from handlers.constants import COMPETITOR_BRANDS, ORIMI_BRANDS, POST_TYPE_CHOICES
+from handlers.constants import (
+    COMPETITOR_BRANDS,
+    NEARBY_STORES_TTL,
+    ORIMI_BRANDS,
+    POST_TYPE_CHOICES,
+)
+from handlers.middlewares import MetricsMiddleware
 from handlers.utils import (
+    album_started,
     check_coordinates,
+    collect_media_group,
     download_file,
     get_agent_by_phone,
-    get_store_id_by_name,
+    get_agent_schedule,
     get_user_profile,
+    normalize_phone,
+    resolve_store,
     save_file_to_post,
+    save_files_to_post,
     save_post_data,
     save_user_profile,
     schedule,
+    warm_store_index,
 )
 from keyboards.keyboards import (
     get_back_keyboard,
@@ -30,19 +45,30 @@ from keyboards.keyboards import (
     get_main_keyboard,
     get_photo_keyboard,
     get_photo_type_keyboard,
+    get_stores_keyboard,
 )
-from services.logger import logger
+from services.imaging import ImagePoolBusyError, PhotoRejectedError
+from services.logger import get_logger
+from services.photo_buffer import PhotoBuffer
+from services.photo_hashes import photo_hashes
+
+logger = get_logger(__name__)
+
+config = load_config()
 
 router = Router()
+router.message.middleware(MetricsMiddleware())
+
+DUPLICATE_PHOTO_TEXT = "Это фото уже загружено сегодня для этого магазина."
 
 
 async def check_auth(message: Message, state: FSMContext) -> bool:
     user_id = message.from_user.id
-    logger.info(f"Проверка авторизации для пользователя: {user_id}")
+    logger.info("Проверка авторизации для пользователя: %s", user_id)
 
     user = await get_user_profile(user_id)
     if not user:
-        logger.warning(f"Пользователь {user_id} не найден в системе")
+        logger.warning("Пользователь %s не найден в системе", user_id)
         await message.answer(
             "Для начала работы необходимо авторизоваться. Поделитесь контактом.",
             reply_markup=get_contact_keyboard(),
@@ -54,7 +80,9 @@ async def check_auth(message: Message, state: FSMContext) -> bool:
         agent = await get_agent_by_phone(user["agent_number"])
         if not agent:
             logger.warning(
-                f"Агент с номером {user['agent_number']} не найден для пользователя {user_id}"
+                "Агент с номером %s не найден для пользователя %s",
+                user["agent_number"],
+                user_id,
             )
             await message.answer(
                 "❌ Ваш номер не найден в системе. Обратитесь к администратору.",
@@ -64,10 +92,12 @@ async def check_auth(message: Message, state: FSMContext) -> bool:
             return False
 
         logger.info(
-            f"Авторизация успешна для пользователя {user_id}, агент: {agent.get('id', 'unknown')}"
+            "Авторизация успешна для пользователя %s, агент: %s",
+            user_id,
+            agent.get("id", "unknown"),
         )
     except Exception as e:
-        logger.error(f"Ошибка при проверке агента для пользователя {user_id}: {e}")
+        logger.error("Ошибка при проверке агента для пользователя %s: %s", user_id, e)
         await state.set_state(UserState.unauthorized)
         return False
 
@@ -79,7 +109,10 @@ async def reset_to_main(
 ):
     user_id = message.from_user.id
     logger.info(
-        f"Сброс состояния в главное меню для пользователя {user_id}: {error_msg}, keep_shop={keep_shop}"
+        "Сброс состояния в главное меню для пользователя %s: %s, keep_shop=%s",
+        user_id,
+        error_msg,
+        keep_shop,
     )
 
     if await check_auth(message, state):
@@ -95,10 +128,13 @@ async def reset_to_main(
             shop_name=current_shop,
             dmp_brand=None,
             competitor_brand=None,
+            nearby_stores=None,
         )
         msg = error_msg or "Возвращаемся в главное меню."
         logger.info(
-            f"Состояние сброшено для пользователя {user_id}, магазин сохранен: {current_shop}"
+            "Состояние сброшено для пользователя %s, магазин сохранен: %s",
+            user_id,
+            current_shop,
         )
         await message.answer(msg, reply_markup=get_main_keyboard())
 
@@ -107,10 +143,10 @@ async def reset_to_main(
 async def cmd_start(message: Message, state: FSMContext):
     user_id = message.from_user.id
     user_name = message.from_user.full_name
-    logger.info(f"Команда /start от пользователя {user_id} ({user_name})")
+    logger.info("Команда /start от пользователя %s (%s)", user_id, user_name)
 
     await state.clear()
-    logger.info(f"Состояние очищено для пользователя {user_id}")
+    logger.info("Состояние очищено для пользователя %s", user_id)
 
     await message.answer(
         "👋 Привет! Я бот для загрузки фотографий магазинов.\n\n"
@@ -119,14 +155,14 @@ async def cmd_start(message: Message, state: FSMContext):
         reply_markup=get_contact_keyboard(),
     )
     await state.set_state(UserState.unauthorized)
-    logger.info(f"Пользователь {user_id} переведен в состояние unauthorized")
+    logger.info("Пользователь %s переведен в состояние unauthorized", user_id)
 
 
 @router.message(Command("help"))
 @router.message(F.text == "❓ Помощь")
 async def cmd_help(message: Message):
     user_id = message.from_user.id
-    logger.info(f"Команда помощи от пользователя {user_id}")
+    logger.info("Команда помощи от пользователя %s", user_id)
 
     await message.answer(
         "📋 <b>Инструкция по использованию бота:</b>\n\n"
@@ -146,14 +182,14 @@ async def cmd_help(message: Message):
 @router.message(F.text == "👤 Мой профиль")
 async def cmd_profile(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Запрос профиля от пользователя {user_id}")
+    logger.info("Запрос профиля от пользователя %s", user_id)
 
     if not await check_auth(message, state):
         return
 
     user = await get_user_profile(user_id)
     logger.info(
-        f"Отображение профиля для пользователя {user_id}: {user['agent_number']}"
+        "Отображение профиля для пользователя %s: %s", user_id, user["agent_number"]
     )
 
     await message.answer(
@@ -165,50 +201,50 @@ async def cmd_profile(message: Message, state: FSMContext):
 @router.message(F.content_type == ContentType.CONTACT)
 async def handle_contact(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Получен контакт от пользователя {user_id}")
+    logger.info("Получен контакт от пользователя %s", user_id)
 
     current_state = await state.get_state()
-    logger.info(f"Текущее состояние пользователя {user_id}: {current_state}")
+    logger.info("Текущее состояние пользователя %s: %s", user_id, current_state)
 
     if current_state != UserState.unauthorized:
         logger.warning(
-            f"Пользователь {user_id} уже авторизован, контакт проигнорирован"
+            "Пользователь %s уже авторизован, контакт проигнорирован", user_id
         )
         await message.answer("Вы уже авторизованы.", reply_markup=get_main_keyboard())
         return
 
     contact = message.contact
     phone_number = contact.phone_number
-    logger.info(f"Номер телефона из контакта: {phone_number}")
+    logger.info("Номер телефона из контакта: %s", phone_number)
 
     if contact.user_id != user_id:
-        logger.warning(f"Пользователь {user_id} отправил чужой контакт")
+        logger.warning("Пользователь %s отправил чужой контакт", user_id)
         await message.answer("Пожалуйста, отправьте свой собственный контакт.")
         return
 
     try:
-        agent = await get_agent_by_phone(phone_number)
         await save_user_profile(user_id, phone_number)
+        agent = await get_agent_by_phone(phone_number)
         await state.update_data(phone=phone_number)
         logger.info(
-            f"Профиль сохранен для пользователя {user_id} с номером {phone_number}"
+            "Профиль сохранен для пользователя %s с номером %s", user_id, phone_number
         )
 
         if agent:
             await state.set_state(UserState.authorized)
-            logger.info(f"Пользователь {user_id} успешно авторизован")
+            logger.info("Пользователь %s успешно авторизован", user_id)
             await message.answer(
                 "✅ Успешная авторизация!\n\nТеперь вы можете загружать фотографии.",
                 reply_markup=get_main_keyboard(),
             )
         else:
-            logger.warning(f"Агент с номером {phone_number} не найден в системе")
+            logger.warning("Агент с номером %s не найден в системе", phone_number)
             await message.answer(
                 "❌ Ваш номер не найден в нашей системе.\n"
                 "Обратитесь к администратору для регистрации вашего магазина."
             )
     except Exception as e:
-        logger.error(f"Ошибка при обработке контакта пользователя {user_id}: {e}")
+        logger.error("Ошибка при обработке контакта пользователя %s: %s", user_id, e)
         await message.answer(
             "Произошла ошибка при проверке вашего номера. Пожалуйста, попробуйте позже."
         )
@@ -217,22 +253,22 @@ async def handle_contact(message: Message, state: FSMContext):
 @router.message(F.text == "🏪 Выбрать маркет")
 async def handle_upload_photo(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Запрос загрузки фото от пользователя {user_id}")
+    logger.info("Запрос загрузки фото от пользователя %s", user_id)
 
     if not await check_auth(message, state):
         return
 
     current_state = await state.get_state()
-    logger.info(f"Текущее состояние при загрузке фото: {current_state}")
+    logger.info("Текущее состояние при загрузке фото: %s", current_state)
 
     if current_state != UserState.authorized:
-        logger.warning(f"Пользователь {user_id} не в авторизованном состоянии")
+        logger.warning("Пользователь %s не в авторизованном состоянии", user_id)
         await reset_to_main(message, state, "Сначала завершите текущую операцию.")
         return
 
     await state.set_state(UserState.waiting_for_shopName)
     logger.info(
-        f"Пользователь {user_id} переведен в состояние ожидания названия магазина"
+        "Пользователь %s переведен в состояние ожидания названия магазина", user_id
     )
     await schedule(message)
 
@@ -240,7 +276,7 @@ async def handle_upload_photo(message: Message, state: FSMContext):
 @router.message(F.text == "📷 Продолжить в этом магазине")
 async def handle_continue_in_shop(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} хочет продолжить в текущем магазине")
+    logger.info("Пользователь %s хочет продолжить в текущем магазине", user_id)
 
     if not await check_auth(message, state):
         return
@@ -250,7 +286,7 @@ async def handle_continue_in_shop(message: Message, state: FSMContext):
     current_location = data.get("location")
 
     if not current_shop:
-        logger.warning(f"У пользователя {user_id} нет сохраненного магазина")
+        logger.warning("У пользователя %s нет сохраненного магазина", user_id)
         await reset_to_main(message, state, "Сначала выберите магазин.")
         return
 
@@ -260,7 +296,9 @@ async def handle_continue_in_shop(message: Message, state: FSMContext):
         and current_location.get("longitude") is not None
     ):
         logger.info(
-            f"Пользователь {user_id} продолжает работу в магазине '{current_shop}' с сохраненной геолокацией"
+            "Пользователь %s продолжает работу в магазине '%s' с сохраненной геолокацией",
+            user_id,
+            current_shop,
         )
         await state.set_state(UserState.waiting_for_type_photo)
         await message.answer(
@@ -270,7 +308,9 @@ async def handle_continue_in_shop(message: Message, state: FSMContext):
     else:
         await state.set_state(UserState.waiting_for_location)
         logger.info(
-            f"Пользователь {user_id} продолжает работу в магазине '{current_shop}', требуется геолокация"
+            "Пользователь %s продолжает работу в магазине '%s', требуется геолокация",
+            user_id,
+            current_shop,
         )
         await message.answer(
             f"Продолжаем работу в магазине '{current_shop}'.\nТеперь отправьте геолокацию.",
@@ -281,14 +321,14 @@ async def handle_continue_in_shop(message: Message, state: FSMContext):
 @router.message(F.text == "🏪 Выбрать другой магазин")
 async def handle_choose_another_shop(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} хочет выбрать другой магазин")
+    logger.info("Пользователь %s хочет выбрать другой магазин", user_id)
 
     if not await check_auth(message, state):
         return
 
     await state.set_state(UserState.waiting_for_shopName)
-    await state.update_data(shop_name=None)
-    logger.info(f"Пользователь {user_id} переведен в состояние выбора нового магазина")
+    await state.update_data(shop_name=None, location=None, nearby_stores=None)
+    logger.info("Пользователь %s переведен в состояние выбора нового магазина", user_id)
     await schedule(message)
 
 
@@ -296,62 +336,65 @@ async def handle_choose_another_shop(message: Message, state: FSMContext):
 async def handle_shop_name(message: Message, state: FSMContext):
     user_id = message.from_user.id
     shop_name = message.text
-    logger.info(f"Получено название магазина от пользователя {user_id}: {shop_name}")
+    logger.info("Получено название магазина от пользователя %s: %s", user_id, shop_name)
 
     if not await check_auth(message, state):
         return
 
     if message.text == "🔙 Назад":
-        logger.info(f"Пользователь {user_id} возвращается назад из выбора магазина")
+        logger.info("Пользователь %s возвращается назад из выбора магазина", user_id)
         await reset_to_main(message, state)
         return
 
     try:
         user = await get_user_profile(user_id)
-        phone_number = user["agent_number"]
-        if not phone_number.startswith("+"):
-            phone_number = f"+{phone_number}"
-
-        url = f"{os.getenv('WEB_SERVICE_URL')}/api/agent-schedule/{phone_number}"
-        logger.info(f"Проверка доступных магазинов для пользователя {user_id}: {url}")
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    stores = await response.json()
-                    store_names = [store["name"] for store in stores] if stores else []
-                    logger.info(
-                        f"Доступные магазины для пользователя {user_id}: {store_names}"
-                    )
+        phone_number = normalize_phone(user["agent_number"])
 
-                    if message.text not in store_names:
-                        logger.warning(
-                            f"Пользователь {user_id} выбрал недоступный магазин: {shop_name}"
-                        )
-                        await message.answer(
-                            "Пожалуйста, выберите магазин из списка кнопок ниже:",
-                            reply_markup=message.reply_markup,
-                        )
-                        return
-                else:
-                    logger.error(
-                        f"Ошибка при получении магазинов для пользователя {user_id}: статус {response.status}"
-                    )
-                    await reset_to_main(
-                        message, state, "Ошибка при получении списка магазинов."
-                    )
-                    return
+        status, day_schedule = await get_agent_schedule(phone_number)
+        if status != 200:
+            logger.error(
+                "Ошибка при получении магазинов для пользователя %s: статус %s",
+                user_id,
+                status,
+            )
+            await reset_to_main(
+                message, state, "Ошибка при получении списка магазинов."
+            )
+            return
+
+        if shop_name not in day_schedule.store_names:
+            logger.warning(
+                "Пользователь %s выбрал недоступный магазин: %s", user_id, shop_name
+            )
+            await message.answer(
+                "Пожалуйста, выберите магазин из списка кнопок ниже:",
+                reply_markup=message.reply_markup,
+            )
+            return
     except Exception as e:
         logger.error(
-            f"Ошибка при проверке списка магазинов для пользователя {user_id}: {e}"
+            "Ошибка при проверке списка магазинов для пользователя %s: %s", user_id, e
         )
         await reset_to_main(message, state, "Ошибка при проверке магазина.")
         return
 
-    await state.update_data(shop_name=shop_name)
+    warm_store_index(shop_name)
+
+    data = await state.get_data()
+    if (
+        shop_name in (data.get("nearby_stores") or ())
+        and data.get("location")
+        and time.time() - data.get("located_at", 0) <= NEARBY_STORES_TTL
+    ):
+        await select_located_shop(message, state, shop_name)
+        return
+
+    await state.update_data(shop_name=shop_name, location=None, nearby_stores=None)
     await state.set_state(UserState.waiting_for_location)
     logger.info(
-        f"Магазин '{shop_name}' сохранен для пользователя {user_id}, ожидание геолокации"
+        "Магазин '%s' сохранен для пользователя %s, ожидание геолокации",
+        shop_name,
+        user_id,
     )
 
     await message.answer(
@@ -360,13 +403,103 @@ async def handle_shop_name(message: Message, state: FSMContext):
     )
 
 
+async def select_located_shop(message: Message, state: FSMContext, shop_name: str):
+    """Магазин определен по уже проверенной геолокации: сразу к выбору типа фото."""
+    await state.update_data(shop_name=shop_name, nearby_stores=None)
+    await state.set_state(UserState.waiting_for_type_photo)
+    logger.info(
+        "Магазин '%s' выбран по геолокации для пользователя %s",
+        shop_name,
+        message.from_user.id,
+    )
+    await message.answer(
+        f"📍 Вы в магазине '{shop_name}'.\n\nВыберите тип фото.",
+        reply_markup=get_photo_type_keyboard(),
+    )
+
+
+@router.message(UserState.waiting_for_shopName, F.content_type == ContentType.LOCATION)
+async def handle_shop_location(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    latitude = message.location.latitude
+    longitude = message.location.longitude
+    logger.info(
+        "Поиск магазина по геолокации для пользователя %s: lat=%s, lng=%s",
+        user_id,
+        latitude,
+        longitude,
+    )
+
+    if not await check_auth(message, state):
+        return
+
+    try:
+        user = await get_user_profile(user_id)
+        status, day_schedule = await get_agent_schedule(user["agent_number"])
+        if status != 200 or day_schedule is None:
+            logger.error(
+                "Ошибка при получении магазинов для пользователя %s: статус %s",
+                user_id,
+                status,
+            )
+            await reset_to_main(
+                message, state, "Ошибка при получении списка магазинов."
+            )
+            return
+
+        nearby = day_schedule.geo.locate(latitude, longitude)
+    except Exception as e:
+        logger.error("Ошибка поиска магазина по геолокации для %s: %s", user_id, e)
+        await reset_to_main(message, state, "Ошибка при поиске магазина.")
+        return
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Магазины рядом с пользователем %s: %s",
+            user_id,
+            ", ".join(f"{name} ({distance:.0f}м)" for distance, name in nearby),
+        )
+
+    if not nearby:
+        await state.update_data(location=None, nearby_stores=None)
+        if day_schedule.geo.missing:
+            # У части магазинов нет координат, по геолокации их не найти
+            await message.answer(
+                "Не удалось определить магазин по геолокации, выберите его из списка."
+            )
+        else:
+            await message.answer("Рядом нет назначенных вам на сегодня магазинов.")
+        await schedule(message)
+        return
+
+    await state.update_data(
+        location={"latitude": latitude, "longitude": longitude},
+        nearby_stores=[name for _, name in nearby],
+        located_at=time.time(),
+    )
+
+    if len(nearby) == 1:
+        shop_name = nearby[0][1]
+        warm_store_index(shop_name)
+        await select_located_shop(message, state, shop_name)
+        return
+
+    await message.answer(
+        "Рядом несколько ваших магазинов, ближайший первым. Выберите магазин:",
+        reply_markup=get_stores_keyboard(tuple(name for _, name in nearby)),
+    )
+
+
 @router.message(UserState.waiting_for_location, F.content_type == ContentType.LOCATION)
 async def handle_location(message: Message, state: FSMContext):
     user_id = message.from_user.id
     latitude = message.location.latitude
     longitude = message.location.longitude
     logger.info(
-        f"Получена геолокация от пользователя {user_id}: lat={latitude}, lng={longitude}"
+        "Получена геолокация от пользователя %s: lat=%s, lng=%s",
+        user_id,
+        latitude,
+        longitude,
     )
 
     if not await check_auth(message, state):
@@ -381,35 +514,48 @@ async def handle_location(message: Message, state: FSMContext):
 
     data = await state.get_data()
     shop_name = data.get("shop_name")
-    logger.info(f"Проверка координат для пользователя {user_id}, магазин: {shop_name}")
+    logger.info(
+        "Проверка координат для пользователя %s, магазин: %s", user_id, shop_name
+    )
 
     try:
-        check = await check_coordinates(latitude, longitude, shop_name)
-        logger.info(f"Результат проверки координат для пользователя {user_id}: {check}")
+        user_profile = await get_user_profile(user_id)
+        check = await check_coordinates(
+            latitude,
+            longitude,
+            shop_name,
+            phone_number=user_profile["agent_number"] if user_profile else None,
+        )
+        logger.info(
+            "Результат проверки координат для пользователя %s: %s", user_id, check
+        )
 
         if check:
             await state.set_state(UserState.waiting_for_type_photo)
             logger.info(
-                f"Пользователь {user_id} переведен в состояние выбора типа фото"
+                "Пользователь %s переведен в состояние выбора типа фото", user_id
             )
             await message.answer(
                 "📍 Геолокация принята!\n\nТеперь выберите тип фото.",
                 reply_markup=get_photo_type_keyboard(),
             )
         else:
-            logger.warning(f"Координаты не подтверждены для пользователя {user_id}")
+            logger.warning("Координаты не подтверждены для пользователя %s", user_id)
             await reset_to_main(message, state, "Координаты не подтверждены.")
     except Exception as e:
-        logger.error(f"Ошибка при проверке координат для пользователя {user_id}: {e}")
+        logger.error(
+            "Ошибка при проверке координат для пользователя %s: %s", user_id, e
+        )
         await reset_to_main(message, state, "Ошибка при проверке координат.")
 
 
 @router.message(UserState.waiting_for_location, F.text == "🔙 Назад")
 async def back_from_location(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} возвращается назад из геолокации")
+    logger.info("Пользователь %s возвращается назад из геолокации", user_id)
 
     await state.set_state(UserState.waiting_for_shopName)
+    await state.update_data(location=None, nearby_stores=None)
     await schedule(message)
 
 
@@ -417,13 +563,13 @@ async def back_from_location(message: Message, state: FSMContext):
 async def handle_type_photo(message: Message, state: FSMContext):
     user_id = message.from_user.id
     photo_type = message.text
-    logger.info(f"Получен тип фото от пользователя {user_id}: {photo_type}")
+    logger.info("Получен тип фото от пользователя %s: %s", user_id, photo_type)
 
     if not await check_auth(message, state):
         return
 
     if message.text == "🔙 Назад":
-        logger.info(f"Пользователь {user_id} возвращается назад из выбора типа фото")
+        logger.info("Пользователь %s возвращается назад из выбора типа фото", user_id)
         await state.set_state(UserState.waiting_for_location)
         await message.answer(
             "Возвращаемся к отправке геолокации.",
@@ -432,7 +578,9 @@ async def handle_type_photo(message: Message, state: FSMContext):
         return
 
     if message.text not in POST_TYPE_CHOICES:
-        logger.warning(f"Пользователь {user_id} выбрал неверный тип фото: {photo_type}")
+        logger.warning(
+            "Пользователь %s выбрал неверный тип фото: %s", user_id, photo_type
+        )
         await message.answer(
             "❌ Неверный тип фото!\n"
             "Пожалуйста, выберите один из предложенных вариантов:",
@@ -442,20 +590,20 @@ async def handle_type_photo(message: Message, state: FSMContext):
 
     type_photo = message.text
     await state.update_data(type_photo=type_photo)
-    logger.info(f"Тип фото '{type_photo}' сохранен для пользователя {user_id}")
+    logger.info("Тип фото '%s' сохранен для пользователя %s", type_photo, user_id)
 
     if "ДМП" in type_photo:
         if "конкурент" in type_photo:
-            logger.info(f"Пользователь {user_id} выбрал ДМП конкурента")
-            brands_keyboard = await get_dmp_brands_keyboard("competitor")
+            logger.info("Пользователь %s выбрал ДМП конкурента", user_id)
+            brands_keyboard = get_dmp_brands_keyboard("competitor")
             await message.answer(
                 f"📋 Тип: {type_photo}\n\nВыберите бренд конкурента:",
                 reply_markup=brands_keyboard,
             )
             await state.set_state(UserState.waiting_for_competitor_brand)
         else:
-            logger.info(f"Пользователь {user_id} выбрал ДМП ОРИМИ")
-            brands_keyboard = await get_dmp_brands_keyboard("orimi")
+            logger.info("Пользователь %s выбрал ДМП ОРИМИ", user_id)
+            brands_keyboard = get_dmp_brands_keyboard("orimi")
             await message.answer(
                 f"📋 Тип: {type_photo}\n\nВыберите бренд ОРИМИ:",
                 reply_markup=brands_keyboard,
@@ -463,7 +611,7 @@ async def handle_type_photo(message: Message, state: FSMContext):
             await state.set_state(UserState.waiting_for_dmp_brand)
     else:
         await state.set_state(UserState.waiting_for_photo)
-        logger.info(f"Пользователь {user_id} переведен в состояние ожидания фото")
+        logger.info("Пользователь %s переведен в состояние ожидания фото", user_id)
         await message.answer(
             f"📋 Тип фото: {type_photo}\n\nТеперь отправьте фото.",
             reply_markup=get_photo_keyboard(),
@@ -474,13 +622,15 @@ async def handle_type_photo(message: Message, state: FSMContext):
 async def handle_dmp_brand(message: Message, state: FSMContext):
     user_id = message.from_user.id
     brand = message.text
-    logger.info(f"Получен бренд ОРИМИ от пользователя {user_id}: {brand}")
+    logger.info("Получен бренд ОРИМИ от пользователя %s: %s", user_id, brand)
 
     if not await check_auth(message, state):
         return
 
     if message.text == "🔙 Назад":
-        logger.info(f"Пользователь {user_id} возвращается назад из выбора бренда ОРИМИ")
+        logger.info(
+            "Пользователь %s возвращается назад из выбора бренда ОРИМИ", user_id
+        )
         await state.set_state(UserState.waiting_for_type_photo)
         await message.answer(
             "Возвращаемся к выбору типа фото.",
@@ -489,8 +639,10 @@ async def handle_dmp_brand(message: Message, state: FSMContext):
         return
 
     if message.text not in ORIMI_BRANDS:
-        logger.warning(f"Пользователь {user_id} выбрал неверный бренд ОРИМИ: {brand}")
-        brands_keyboard = await get_dmp_brands_keyboard("orimi")
+        logger.warning(
+            "Пользователь %s выбрал неверный бренд ОРИМИ: %s", user_id, brand
+        )
+        brands_keyboard = get_dmp_brands_keyboard("orimi")
         await message.answer(
             "❌ Неверный бренд!\n"
             "Пожалуйста, выберите один из предложенных брендов ОРИМИ:",
@@ -501,7 +653,7 @@ async def handle_dmp_brand(message: Message, state: FSMContext):
     dmp_brand = message.text
     await state.update_data(dmp_brand=dmp_brand)
     await state.set_state(UserState.waiting_for_photo)
-    logger.info(f"Бренд ОРИМИ '{dmp_brand}' сохранен для пользователя {user_id}")
+    logger.info("Бренд ОРИМИ '%s' сохранен для пользователя %s", dmp_brand, user_id)
 
     await message.answer(
         f"📋 Выбран бренд ОРИМИ: {dmp_brand}\n\nТеперь отправьте фото.",
@@ -513,14 +665,14 @@ async def handle_dmp_brand(message: Message, state: FSMContext):
 async def handle_competitor_brand(message: Message, state: FSMContext):
     user_id = message.from_user.id
     brand = message.text
-    logger.info(f"Получен бренд конкурента от пользователя {user_id}: {brand}")
+    logger.info("Получен бренд конкурента от пользователя %s: %s", user_id, brand)
 
     if not await check_auth(message, state):
         return
 
     if message.text == "🔙 Назад":
         logger.info(
-            f"Пользователь {user_id} возвращается назад из выбора бренда конкурента"
+            "Пользователь %s возвращается назад из выбора бренда конкурента", user_id
         )
         await state.set_state(UserState.waiting_for_type_photo)
         await message.answer(
@@ -531,9 +683,9 @@ async def handle_competitor_brand(message: Message, state: FSMContext):
 
     if message.text not in COMPETITOR_BRANDS:
         logger.warning(
-            f"Пользователь {user_id} выбрал неверный бренд конкурента: {brand}"
+            "Пользователь %s выбрал неверный бренд конкурента: %s", user_id, brand
         )
-        brands_keyboard = await get_dmp_brands_keyboard("competitor")
+        brands_keyboard = get_dmp_brands_keyboard("competitor")
         await message.answer(
             "❌ Неверный бренд!\n"
             "Пожалуйста, выберите один из предложенных брендов конкурентов:",
@@ -545,7 +697,7 @@ async def handle_competitor_brand(message: Message, state: FSMContext):
     await state.update_data(competitor_brand=competitor_brand)
     await state.set_state(UserState.waiting_for_competitor_count_after_brand)
     logger.info(
-        f"Бренд конкурента '{competitor_brand}' сохранен для пользователя {user_id}"
+        "Бренд конкурента '%s' сохранен для пользователя %s", competitor_brand, user_id
     )
 
     await message.answer(
@@ -560,16 +712,18 @@ async def handle_competitor_count_after_brand(message: Message, state: FSMContex
     user_id = message.from_user.id
     count_text = message.text
     logger.info(
-        f"Получено количество товаров конкурентов от пользователя {user_id}: {count_text}"
+        "Получено количество товаров конкурентов от пользователя %s: %s",
+        user_id,
+        count_text,
     )
 
     if not await check_auth(message, state):
         return
 
     if message.text == "🔙 Назад":
-        logger.info(f"Пользователь {user_id} возвращается назад из ввода количества")
+        logger.info("Пользователь %s возвращается назад из ввода количества", user_id)
         await state.set_state(UserState.waiting_for_competitor_brand)
-        brands_keyboard = await get_dmp_brands_keyboard("competitor")
+        brands_keyboard = get_dmp_brands_keyboard("competitor")
         await message.answer(
             "Возвращаемся к выбору бренда конкурента.",
             reply_markup=brands_keyboard,
@@ -579,7 +733,7 @@ async def handle_competitor_count_after_brand(message: Message, state: FSMContex
     cnt = message.text
 
     if not cnt.isdigit():
-        logger.warning(f"Пользователь {user_id} ввел некорректное количество: {cnt}")
+        logger.warning("Пользователь %s ввел некорректное количество: %s", user_id, cnt)
         await message.answer(
             "Введите число, а не что-то другое:",
             reply_markup=get_back_keyboard(),
@@ -590,15 +744,21 @@ async def handle_competitor_count_after_brand(message: Message, state: FSMContex
         user_profile = await get_user_profile(user_id)
         agent = await get_agent_by_phone(user_profile["agent_number"])
         state_data = await state.get_data()
-        store = await get_store_id_by_name(state_data["shop_name"])
+        store = await resolve_store(state_data["shop_name"])
 
         logger.info(
-            f"Сохранение данных конкурента для пользователя {user_id}: агент={agent.get('id')}, магазин={store.get('id') if store else None}, количество={cnt}"
+            "Сохранение данных конкурента для пользователя %s: агент=%s, магазин=%s, количество=%s",
+            user_id,
+            agent.get("id"),
+            store.get("id") if store else None,
+            cnt,
         )
 
         if not store:
             logger.error(
-                f"Магазин '{state_data['shop_name']}' не найден для пользователя {user_id}"
+                "Магазин '%s' не найден для пользователя %s",
+                state_data["shop_name"],
+                user_id,
             )
             await reset_to_main(message, state, "Магазин не зарегистрирован.")
             return
@@ -612,12 +772,21 @@ async def handle_competitor_count_after_brand(message: Message, state: FSMContex
             state_data.get("type_photo"),
             state_data.get("competitor_brand"),
             cnt,
+            chat_id=message.chat.id,
         )
 
         logger.info(
-            f"Результат сохранения данных конкурента для пользователя {user_id}: {result}"
+            "Результат сохранения данных конкурента для пользователя %s: %s",
+            user_id,
+            result,
         )
 
+        if not result["success"]:
+            await reset_to_main(
+                message, state, "Ошибка при сохранении данных.", keep_shop=True
+            )
+            return
+
         current_shop = state_data.get("shop_name")
         await reset_to_main(message, state, keep_shop=True)
 
@@ -628,119 +797,468 @@ async def handle_competitor_count_after_brand(message: Message, state: FSMContex
 
     except Exception as e:
         logger.error(
-            f"Ошибка при сохранении данных конкурента для пользователя {user_id}: {e}"
+            "Ошибка при сохранении данных конкурента для пользователя %s: %s",
+            user_id,
+            e,
         )
         await reset_to_main(message, state, "Ошибка при сохранении данных.")
 
 
-@router.message(UserState.waiting_for_photo, F.content_type == ContentType.DOCUMENT)
-async def handle_file(message: Message, bot: Bot, state: FSMContext):
+async def _timed(timings: dict[str, float], stage: str, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[stage] = time.perf_counter() - started
+
+
+async def _fetch_document(
+    bot: Bot,
+    file_id: str,
+    file_name: str | None,
+    file_size: int | None,
+    timings: dict[str, float],
+) -> PhotoBuffer:
+    file = await _timed(timings, "get_file", bot.get_file(file_id))
+    file_name = file_name or f"{uuid.uuid4().hex}{os.path.splitext(file.file_path)[1]}"
+    file_url = bot.session.api.file_url(bot.token, file.file_path)
+    return await _timed(
+        timings, "download", download_file(file_url, file_name, file_size=file_size)
+    )
+
+
+async def _is_duplicate(store_id, photo: PhotoBuffer, accepted: list[int]) -> bool:
+    """Проверяет фото по индексу магазина и по уже принятым в этой пачке."""
+    if photo.phash is None:
+        return False
+    if any(
+        (photo.phash ^ phash).bit_count() <= photo_hashes.max_distance
+        for phash in accepted
+    ):
+        return True
+    return await photo_hashes.find_duplicate(store_id, photo.phash) is not None
+
+
+def _photo_error_text(e: Exception) -> str:
+    if isinstance(e, ImagePoolBusyError):
+        return f"⏳ {e}"
+    if isinstance(e, PhotoRejectedError):
+        return f"❌ {e}"
+    return "❌ Фото сделано более 10 минут назад. Сделайте свежее фото."
+
+
+async def _discard_tasks(*tasks: asyncio.Task) -> None:
+    """Отменяет незавершенные задачи и закрывает скачанное фото, если оно есть."""
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, PhotoBuffer):
+            result.close()
+
+
+@router.message(
+    UserState.waiting_for_photo,
+    F.content_type == ContentType.DOCUMENT,
+    F.media_group_id,
+)
+@router.message(F.content_type == ContentType.DOCUMENT, F.media_group_id, album_started)
+async def handle_album(message: Message, bot: Bot, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Получен файл от пользователя {user_id}")
+    logger.info(
+        "Получен файл альбома %s от пользователя %s", message.media_group_id, user_id
+    )
 
     if not await check_auth(message, state):
         return
 
     try:
-        user_profile = await get_user_profile(user_id)
         state_data = await state.get_data()
+        collected = await collect_media_group(
+            message,
+            {
+                field: state_data.get(field)
+                for field in ("location", "type_photo", "shop_name", "dmp_brand")
+            },
+        )
+        if collected is None:
+            return
+
+        # Тип фото и магазин — на момент первого файла альбома
+        documents, state_data = collected
         location = state_data.get("location")
         type_photo = state_data.get("type_photo")
         shop_name = state_data.get("shop_name")
 
-        logger.info(
-            f"Данные для обработки файла пользователя {user_id}: магазин={shop_name}, тип={type_photo}"
-        )
-
         if not location:
-            logger.warning(f"Отсутствует геолокация для пользователя {user_id}")
+            logger.warning("Отсутствует геолокация для пользователя %s", user_id)
             await state.set_state(UserState.waiting_for_location)
             await message.answer("Сначала отправьте геолокацию.")
             return
 
-        agent = await get_agent_by_phone(user_profile["agent_number"])
-        store = await get_store_id_by_name(shop_name)
-
-        logger.info(
-            f"Найден агент {agent.get('id')} и магазин {store.get('id') if store else None} для пользователя {user_id}"
+        started = time.perf_counter()
+        timings: dict[str, float] = {}
+        semaphore = asyncio.Semaphore(config.photo.batch_concurrency)
+
+        async def fetch_agent():
+            user_profile = await get_user_profile(user_id)
+            return await get_agent_by_phone(user_profile["agent_number"])
+
+        async def fetch(document: dict) -> PhotoBuffer:
+            async with semaphore:
+                return await _fetch_document(
+                    bot,
+                    document["file_id"],
+                    document["file_name"],
+                    document["file_size"],
+                    {},
+                )
+
+        agent_task = asyncio.create_task(_timed(timings, "agent", fetch_agent()))
+        store_task = asyncio.create_task(
+            _timed(timings, "store", resolve_store(shop_name))
         )
+        photo_tasks = [asyncio.create_task(fetch(doc)) for doc in documents]
 
-        if not store:
-            logger.error(
-                f"Магазин '{shop_name}' не зарегистрирован для пользователя {user_id}"
+        try:
+            status_message = await message.answer(
+                f"⏳ Загрузка {len(documents)} файлов..."
+            )
+            agent, store = await asyncio.gather(agent_task, store_task)
+
+            if not store:
+                logger.error(
+                    "Магазин '%s' не зарегистрирован для пользователя %s",
+                    shop_name,
+                    user_id,
+                )
+                await bot.edit_message_text(
+                    "❌ Файлы не сохранены",
+                    chat_id=status_message.chat.id,
+                    message_id=status_message.message_id,
+                )
+                await reset_to_main(message, state, "Магазин не зарегистрирован.")
+                return
+
+            seen = await asyncio.gather(
+                *(
+                    photo_hashes.seen_file(store["id"], document["file_unique_id"])
+                    for document in documents
+                )
+            )
+            for task, is_seen in zip(photo_tasks, seen, strict=True):
+                if is_seen:
+                    task.cancel()
+
+            results = await _timed(
+                timings,
+                "download",
+                asyncio.gather(*photo_tasks, return_exceptions=True),
+            )
+            photos: list[PhotoBuffer] = []
+            accepted: list[tuple[PhotoBuffer, dict]] = []
+            errors = []
+            for document, is_seen, result in zip(documents, seen, results, strict=True):
+                name = document["file_name"] or "файл"
+                if isinstance(result, PhotoBuffer) and not is_seen:
+                    if await _is_duplicate(
+                        store["id"],
+                        result,
+                        [p.phash for p in photos if p.phash is not None],
+                    ):
+                        is_seen = True
+                    else:
+                        photos.append(result)
+                        accepted.append((result, document))
+                        continue
+
+                if is_seen:
+                    logger.warning(
+                        "Повторное фото %s от пользователя %s для магазина %s",
+                        name,
+                        user_id,
+                        store["id"],
+                    )
+                    errors.append(f"{name}: ❌ {DUPLICATE_PHOTO_TEXT}")
+                elif isinstance(result, Exception):
+                    logger.error(
+                        "Ошибка при обработке файла %s пользователя %s: %s",
+                        name,
+                        user_id,
+                        result,
+                    )
+                    errors.append(f"{name}: {_photo_error_text(result)}")
+
+            if photos:
+                # Как и для одного файла, статус меняется до постановки в
+                # очередь, дальше сообщение правит только воркер очереди.
+                accepted_text = f"📤 Принято {len(photos)} из {len(documents)} файлов, отправляются в систему"
+                await bot.edit_message_text(
+                    "\n".join([accepted_text, *errors]),
+                    chat_id=status_message.chat.id,
+                    message_id=status_message.message_id,
+                )
+                entries = [
+                    photo_hashes.entry(
+                        store["id"], photo.phash, document["file_unique_id"]
+                    )
+                    for photo, document in accepted
+                ]
+                await asyncio.gather(*(photo_hashes.add(e) for e in entries))
+                result = await _timed(
+                    timings,
+                    "enqueue",
+                    save_files_to_post(
+                        agent["id"],
+                        store["id"],
+                        photos,
+                        latitude=location["latitude"],
+                        longitude=location["longitude"],
+                        type_photo=type_photo,
+                        dmp_type=state_data.get("dmp_brand"),
+                        chat_id=status_message.chat.id,
+                        message_id=status_message.message_id,
+                        note="\n".join(errors) or None,
+                        dedup=entries,
+                    ),
+                )
+                if not result["success"]:
+                    await asyncio.gather(*(photo_hashes.remove(e) for e in entries))
+                    failed_text = "❌ Не удалось сохранить файлы. Отправьте их еще раз."
+                    await bot.edit_message_text(
+                        "\n".join([failed_text, *errors]),
+                        chat_id=status_message.chat.id,
+                        message_id=status_message.message_id,
+                    )
+            else:
+                await bot.edit_message_text(
+                    "\n".join(errors),
+                    chat_id=status_message.chat.id,
+                    message_id=status_message.message_id,
+                )
+
+            stages = ", ".join(f"{k}={v:.3f}с" for k, v in timings.items())
+            logger.info(
+                "Этапы обработки альбома пользователя %s (%s файлов): %s, всего=%.3fс",
+                user_id,
+                len(documents),
+                stages,
+                time.perf_counter() - started,
             )
-            await reset_to_main(message, state, "Магазин не зарегистрирован.")
-            return
 
-        document = message.document
-        file_id = document.file_id
-        file = await bot.get_file(file_id)
-        file_path = file.file_path
-        file_name = (
-            document.file_name or f"{uuid.uuid4().hex}{os.path.splitext(file_path)[1]}"
-        )
+            # Опоздавшие файлы альбома не сбивают сценарий, начатый после него
+            if await state.get_state() == UserState.waiting_for_photo:
+                await reset_to_main(message, state, keep_shop=True)
+                await message.answer(
+                    f"Хотите продолжить загрузку фото в магазине '{shop_name}' или выбрать другой?",
+                    reply_markup=get_continue_in_shop_keyboard(),
+                )
+
+        finally:
+            await _discard_tasks(agent_task, store_task, *photo_tasks)
 
-        file_url = (
-            f"https://api.telegram.org/file/bot{os.getenv('SECRET_KEY')}/{file_path}"
+    except Exception as e:
+        logger.error(
+            "Критическая ошибка при обработке альбома пользователя %s: %s", user_id, e
         )
+        await reset_to_main(message, state, "❗ Неизвестная ошибка.")
+
+
+@router.message(UserState.waiting_for_photo, F.content_type == ContentType.DOCUMENT)
+async def handle_file(message: Message, bot: Bot, state: FSMContext):
+    user_id = message.from_user.id
+    logger.info("Получен файл от пользователя %s", user_id)
+
+    if not await check_auth(message, state):
+        return
+
+    try:
+        state_data = await state.get_data()
+        location = state_data.get("location")
+        type_photo = state_data.get("type_photo")
+        shop_name = state_data.get("shop_name")
+
         logger.info(
-            f"Обработка файла для пользователя {user_id}: {file_name}, размер: {document.file_size}"
+            "Данные для обработки файла пользователя %s: магазин=%s, тип=%s",
+            user_id,
+            shop_name,
+            type_photo,
         )
 
-        status_message = await message.answer("⏳ Загрузка файла...")
+        if not location:
+            logger.warning("Отсутствует геолокация для пользователя %s", user_id)
+            await state.set_state(UserState.waiting_for_location)
+            await message.answer("Сначала отправьте геолокацию.")
+            return
 
-        try:
-            relative_path = await download_file(file_url, file_name)
-            logger.info(
-                f"Файл успешно скачан для пользователя {user_id}: {relative_path}"
-            )
+        document = message.document
+        logger.info(
+            "Обработка файла для пользователя %s: %s, размер: %s",
+            user_id,
+            document.file_name,
+            document.file_size,
+        )
 
-            result = await save_file_to_post(
-                agent["id"],
-                store["id"],
-                relative_path,
-                latitude=location["latitude"],
-                longitude=location["longitude"],
-                type_photo=type_photo,
-                dmp_type=state_data.get("dmp_brand"),
-            )
+        started = time.perf_counter()
+        timings: dict[str, float] = {}
 
-            logger.info(
-                f"Результат сохранения файла для пользователя {user_id}: {result}"
-            )
+        async def fetch_agent():
+            user_profile = await get_user_profile(user_id)
+            return await get_agent_by_phone(user_profile["agent_number"])
 
-            await bot.edit_message_text(
-                "✅ Файл успешно сохранен",
-                chat_id=status_message.chat.id,
-                message_id=status_message.message_id,
+        # Агент, магазин и файл не зависят друг от друга: скачивание и проверка
+        # EXIF идут, пока выполняются запросы к веб-сервису.
+        agent_task = asyncio.create_task(_timed(timings, "agent", fetch_agent()))
+        store_task = asyncio.create_task(
+            _timed(timings, "store", resolve_store(shop_name))
+        )
+        photo_task = asyncio.create_task(
+            _fetch_document(
+                bot, document.file_id, document.file_name, document.file_size, timings
             )
+        )
 
-            current_shop = state_data.get("shop_name")
-            await reset_to_main(message, state, keep_shop=True)
+        try:
+            status_message = await message.answer("⏳ Загрузка файла...")
+            agent, store = await asyncio.gather(agent_task, store_task)
 
-            await message.answer(
-                f"Хотите продолжить загрузку фото в магазине '{current_shop}' или выбрать другой?",
-                reply_markup=get_continue_in_shop_keyboard(),
+            logger.info(
+                "Найден агент %s и магазин %s для пользователя %s",
+                agent.get("id"),
+                store.get("id") if store else None,
+                user_id,
             )
 
-        except Exception as e:
-            error_message = str(e)
-            logger.error(
-                f"Ошибка при обработке файла пользователя {user_id}: {error_message}"
-            )
+            if not store:
+                logger.error(
+                    "Магазин '%s' не зарегистрирован для пользователя %s",
+                    shop_name,
+                    user_id,
+                )
+                await bot.edit_message_text(
+                    "❌ Файл не сохранен",
+                    chat_id=status_message.chat.id,
+                    message_id=status_message.message_id,
+                )
+                await reset_to_main(message, state, "Магазин не зарегистрирован.")
+                return
+
+            if await photo_hashes.seen_file(store["id"], document.file_unique_id):
+                logger.warning(
+                    "Повторный файл от пользователя %s для магазина %s",
+                    user_id,
+                    store["id"],
+                )
+                await bot.edit_message_text(
+                    f"❌ {DUPLICATE_PHOTO_TEXT}",
+                    chat_id=status_message.chat.id,
+                    message_id=status_message.message_id,
+                )
+                await reset_to_main(message, state, keep_shop=True)
+                return
+
+            enqueued = False
+            try:
+                photo = await photo_task
+                logger.info(
+                    "Файл успешно скачан для пользователя %s: %s",
+                    user_id,
+                    photo.filename,
+                )
+
+                if await _is_duplicate(store["id"], photo, []):
+                    logger.warning(
+                        "Похожее фото уже загружено пользователем %s для магазина %s",
+                        user_id,
+                        store["id"],
+                    )
+                    await bot.edit_message_text(
+                        f"❌ {DUPLICATE_PHOTO_TEXT}",
+                        chat_id=status_message.chat.id,
+                        message_id=status_message.message_id,
+                    )
+                    await reset_to_main(message, state, keep_shop=True)
+                    return
 
-            error_text = "❌ Фото сделано более 10 минут назад. Сделайте свежее фото."
+                # Статус меняется до постановки в очередь: после нее сообщение
+                # правит только воркер очереди, иначе "отправляется" могло бы
+                # затереть уже записанный им итог.
+                await bot.edit_message_text(
+                    "📤 Файл принят и отправляется в систему",
+                    chat_id=status_message.chat.id,
+                    message_id=status_message.message_id,
+                )
+
+                entry = photo_hashes.entry(
+                    store["id"], photo.phash, document.file_unique_id
+                )
+                await photo_hashes.add(entry)
+                result = await _timed(
+                    timings,
+                    "enqueue",
+                    save_file_to_post(
+                        agent["id"],
+                        store["id"],
+                        photo,
+                        latitude=location["latitude"],
+                        longitude=location["longitude"],
+                        type_photo=type_photo,
+                        dmp_type=state_data.get("dmp_brand"),
+                        chat_id=status_message.chat.id,
+                        message_id=status_message.message_id,
+                        dedup=entry,
+                    ),
+                )
+
+                logger.info(
+                    "Результат сохранения файла для пользователя %s: %s",
+                    user_id,
+                    result,
+                )
+
+                if not result["success"]:
+                    await photo_hashes.remove(entry)
+                    raise PhotoRejectedError(
+                        "Не удалось сохранить файл. Отправьте его еще раз."
+                    )
+                enqueued = True
+
+                stages = ", ".join(f"{k}={v:.3f}с" for k, v in timings.items())
+                logger.info(
+                    "Этапы обработки файла пользователя %s: %s, всего=%.3fс",
+                    user_id,
+                    stages,
+                    time.perf_counter() - started,
+                )
+
+                current_shop = state_data.get("shop_name")
+                await reset_to_main(message, state, keep_shop=True)
+
+                await message.answer(
+                    f"Хотите продолжить загрузку фото в магазине '{current_shop}' или выбрать другой?",
+                    reply_markup=get_continue_in_shop_keyboard(),
+                )
+
+            except Exception as e:
+                logger.error(
+                    "Ошибка при обработке файла пользователя %s: %s", user_id, e
+                )
+
+                if not enqueued:
+                    await bot.edit_message_text(
+                        _photo_error_text(e),
+                        chat_id=status_message.chat.id,
+                        message_id=status_message.message_id,
+                    )
+                await reset_to_main(message, state)
 
-            await bot.edit_message_text(
-                error_text,
-                chat_id=status_message.chat.id,
-                message_id=status_message.message_id,
-            )
-            await reset_to_main(message, state)
+        finally:
+            await _discard_tasks(agent_task, store_task, photo_task)
 
     except Exception as e:
         logger.error(
-            f"Критическая ошибка при обработке файла пользователя {user_id}: {e}"
+            "Критическая ошибка при обработке файла пользователя %s: %s", user_id, e
         )
         await reset_to_main(message, state, "❗ Неизвестная ошибка.")
 
@@ -749,7 +1267,9 @@ async def handle_file(message: Message, bot: Bot, state: FSMContext):
 async def handle_authorized_commands(message: Message, state: FSMContext):
     user_id = message.from_user.id
     logger.info(
-        f"Обработка команды в авторизованном состоянии от пользователя {user_id}: {message.text}"
+        "Обработка команды в авторизованном состоянии от пользователя %s: %s",
+        user_id,
+        message.text,
     )
 
     if not await check_auth(message, state):
@@ -766,7 +1286,10 @@ async def unknown_message(message: Message, state: FSMContext):
     user_id = message.from_user.id
     current_state = await state.get_state()
     logger.info(
-        f"Неизвестное сообщение от пользователя {user_id} в состоянии {current_state}: {message.text}"
+        "Неизвестное сообщение от пользователя %s в состоянии %s: %s",
+        user_id,
+        current_state,
+        message.text,
     )
 
     if (
@@ -776,7 +1299,7 @@ async def unknown_message(message: Message, state: FSMContext):
     ):
         if await check_auth(message, state):
             logger.info(
-                f"Операция прервана для пользователя {user_id}, возврат в главное меню"
+                "Операция прервана для пользователя %s, возврат в главное меню", user_id
             )
             await reset_to_main(
                 message, state, "Операция прервана. Используйте кнопки меню."
@@ -785,14 +1308,14 @@ async def unknown_message(message: Message, state: FSMContext):
 
     if await check_auth(message, state):
         await state.set_state(UserState.authorized)
-        logger.info(f"Пользователь {user_id} переведен в авторизованное состояние")
+        logger.info("Пользователь %s переведен в авторизованное состояние", user_id)
         await message.answer(
             "Используйте кнопки меню для навигации.",
             reply_markup=get_main_keyboard(),
         )
     else:
         logger.info(
-            f"Неавторизованный пользователь {user_id} получил запрос на контакт"
+            "Неавторизованный пользователь %s получил запрос на контакт", user_id
         )
         await message.answer(
             "Для начала работы поделитесь контактом.",
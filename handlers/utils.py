@@ -1,167 +1,231 @@
 import asyncio
 import json
 import os
-import re
-import subprocess
-import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Any
 
-import aiohttp
-import piexif
-import pillow_heif
-import pytz
-from aiogram.types import KeyboardButton, Message
-from aiogram.utils.keyboard import ReplyKeyboardBuilder
-from asgiref.sync import sync_to_async
-from PIL import Image
+from aiogram.types import Message
 
+from config.config import load_config
 from config.redis_connect import redis_client
-from services.logger import logger
+from keyboards.keyboards import get_stores_keyboard
+from services.backend import backend_client
+from services.cache import MISSING, agent_cache, profile_cache
+from services.exiftool import exiftool
+from services.imaging import (
+    PhotoRejectedError,
+    PhotoResult,
+    image_executor,
+    process_photo,
+)
+from services.logger import get_logger
+from services.metrics import observe_photo_stages, photo_stage
+from services.outbox import outbox
+from services.photo_buffer import PhotoBuffer
+from services.schedule_cache import DaySchedule, schedule_cache
+from services.store_index import store_index
+
+logger = get_logger(__name__)
+
+config = load_config()
 
 
 async def get_store_id_by_name(name: str) -> dict[str, Any] | None:
-    logger.info(f"Получение ID магазина по имени: {name}")
-    api_url = f"{os.getenv('WEB_SERVICE_URL')}/api/store-id/{name}"
-
+    logger.info("Получение ID магазина по имени: %s", name)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Успешно получен ID магазина для '{name}': {data}")
-                    return data
-                else:
-                    logger.error(
-                        f"API запрос не удался со статусом {response.status} для магазина '{name}'"
-                    )
-                    return None
+        status, data = await backend_client.get_json(
+            f"/api/store-id/{name}", endpoint="store_id"
+        )
+        if status == 200:
+            logger.debug("Успешно получен ID магазина для '%s': %s", name, data)
+            return data
+        else:
+            logger.error(
+                "API запрос не удался со статусом %s для магазина '%s'",
+                status,
+                name,
+            )
+            return None
 
     except Exception as e:
-        logger.error(f"Ошибка в get_store_id_by_name для '{name}': {e}")
+        logger.error("Ошибка в get_store_id_by_name для '%s': %s", name, e)
         return None
 
 
+async def resolve_store(name: str) -> dict[str, Any] | None:
+    store = await store_index.get(name)
+    if store is not MISSING:
+        return store
+
+    logger.info("Магазин '%s' отсутствует в индексе, запрос к API", name)
+    store = await get_store_id_by_name(name)
+    if store and store.get("id") is not None:
+        await store_index.add_many([{"id": store["id"], "name": name}])
+    return store
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+def warm_store_index(name: str) -> None:
+    """Разрешает id магазина в фоне, пока пользователь отправляет геолокацию."""
+    task = asyncio.create_task(resolve_store(name))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 async def get_user_profile(telegram_id: int) -> dict[str, Any] | None:
-    logger.info(f"Получение профиля пользователя с telegram_id: {telegram_id}")
+    logger.info("Получение профиля пользователя с telegram_id: %s", telegram_id)
     key = f"user:{telegram_id}"
 
+    profile = profile_cache.get(telegram_id)
+    if profile is not MISSING:
+        return profile
+
     try:
         data = await redis_client.get(key)
         if data:
             profile = json.loads(data)
-            logger.info(f"Профиль пользователя найден: {profile}")
+            profile_cache.set(telegram_id, profile)
+            logger.debug("Профиль пользователя найден: %s", profile)
             return profile
         else:
             logger.warning(
-                f"Профиль пользователя не найден для telegram_id: {telegram_id}"
+                "Профиль пользователя не найден для telegram_id: %s", telegram_id
             )
             return None
     except Exception as e:
-        logger.error(f"Ошибка при получении профиля пользователя {telegram_id}: {e}")
+        logger.error("Ошибка при получении профиля пользователя %s: %s", telegram_id, e)
         return None
 
 
+def normalize_phone(phone_number: str) -> str:
+    if not phone_number.startswith("+"):
+        return "+" + phone_number
+    return phone_number
+
+
 async def get_agent_by_phone(phone_number: str):
-    logger.info(f"Получение агента по номеру телефона: {phone_number}")
+    phone_number = normalize_phone(phone_number)
 
-    if not phone_number.startswith("+"):
-        phone_number = "+" + phone_number
-        logger.info(f"Добавлен префикс '+' к номеру: {phone_number}")
+    cached = await agent_cache.get(phone_number)
+    if cached is not MISSING:
+        return cached
 
-    api_url = f"{os.getenv('WEB_SERVICE_URL')}/api/agent/{phone_number}"
+    logger.info("Получение агента по номеру телефона: %s", phone_number)
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Агент найден для номера {phone_number}: {data}")
-                    return data
-                else:
-                    logger.error(
-                        f"API запрос не удался со статусом {response.status} для номера {phone_number}"
-                    )
-                    return []
+        status, data = await backend_client.get_json(
+            f"/api/agent/{phone_number}", endpoint="agent"
+        )
+        if status == 200:
+            logger.debug("Агент найден для номера %s: %s", phone_number, data)
+            await agent_cache.set(phone_number, data)
+            return data
+        else:
+            logger.error(
+                "API запрос не удался со статусом %s для номера %s",
+                status,
+                phone_number,
+            )
+            if status == 404:
+                await agent_cache.set(phone_number, [])
+            return []
     except Exception as e:
-        logger.error(f"Ошибка в get_agent_by_phone для номера {phone_number}: {e}")
+        logger.error("Ошибка в get_agent_by_phone для номера %s: %s", phone_number, e)
         return None
 
 
 async def save_user_profile(telegram_id: int, phone_number: str) -> bool:
     logger.info(
-        f"Сохранение профиля пользователя: telegram_id={telegram_id}, phone={phone_number}"
+        "Сохранение профиля пользователя: telegram_id=%s, phone=%s",
+        telegram_id,
+        phone_number,
     )
 
-    if not phone_number.startswith("+"):
-        phone_number = "+" + phone_number
-        logger.info(f"Добавлен префикс '+' к номеру: {phone_number}")
+    phone_number = normalize_phone(phone_number)
 
     key = f"user:{telegram_id}"
     user_data = {"agent_number": phone_number}
 
     try:
         await redis_client.set(key, json.dumps(user_data))
-        logger.info(f"Данные пользователя сохранены в Redis: {user_data}")
-
-        api_url = f"{os.getenv('WEB_SERVICE_URL')}/api/agent/{phone_number}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url) as response:
-                if response.status == 200:
-                    logger.info(f"Агент успешно подтвержден для номера {phone_number}")
-                    return True
-                else:
-                    logger.error(
-                        f"API запрос не удался со статусом {response.status} для номера {phone_number}"
-                    )
-                    return False
+        profile_cache.set(telegram_id, user_data)
+        logger.info("Данные пользователя сохранены в Redis: %s", user_data)
+
+        await agent_cache.invalidate(phone_number)
+        agent = await get_agent_by_phone(phone_number)
+        if agent:
+            logger.info("Агент успешно подтвержден для номера %s", phone_number)
+            return True
+        else:
+            logger.error("Агент не подтвержден для номера %s", phone_number)
+            return False
 
     except Exception as e:
-        logger.error(f"Ошибка при сохранении профиля пользователя {telegram_id}: {e}")
+        logger.error(
+            "Ошибка при сохранении профиля пользователя %s: %s", telegram_id, e
+        )
         return False
 
 
+async def get_agent_schedule(phone_number: str) -> tuple[int, DaySchedule | None]:
+    phone_number = normalize_phone(phone_number)
+
+    cached = await schedule_cache.get(phone_number)
+    if cached is not MISSING:
+        return 200, cached
+
+    url = f"/api/agent-schedule/{phone_number}"
+    logger.info("Запрос расписания по URL: %s", url)
+
+    status, stores = await backend_client.get_json(url, endpoint="agent_schedule")
+    if status != 200:
+        return status, None
+
+    stores = stores or []
+    logger.info(
+        "Получено расписание для агента %s: %s магазинов", phone_number, len(stores)
+    )
+
+    try:
+        await store_index.add_many(stores)
+    except Exception as e:
+        logger.error("Ошибка при обновлении индекса магазинов из расписания: %s", e)
+
+    return 200, await schedule_cache.set(phone_number, stores)
+
+
 async def schedule(message: Message):
-    logger.info(f"Получение расписания для пользователя: {message.from_user.id}")
+    logger.info("Получение расписания для пользователя: %s", message.from_user.id)
 
     user = await get_user_profile(message.from_user.id)
     if not user:
-        logger.error(f"Профиль пользователя не найден: {message.from_user.id}")
+        logger.error("Профиль пользователя не найден: %s", message.from_user.id)
         await message.answer("Ошибка: профиль пользователя не найден.")
         return
 
-    phone_number = user["agent_number"]
-    if not phone_number.startswith("+"):
-        phone_number = f"+{phone_number}"
-        logger.info(f"Добавлен префикс '+' к номеру: {phone_number}")
-
-    url = f"{os.getenv('WEB_SERVICE_URL')}/api/agent-schedule/{phone_number}"
-    logger.info(f"Запрос расписания по URL: {url}")
+    phone_number = normalize_phone(user["agent_number"])
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 404:
-                    logger.warning(f"Агент с номером {phone_number} не найден")
-                    await message.answer(f"Агент с номером {phone_number} не найден.")
-                    return
-
-                if response.status != 200:
-                    logger.error(
-                        f"Ошибка при получении расписания: статус {response.status}"
-                    )
-                    await message.answer("Ошибка при получении расписания.")
-                    return
-
-                stores = await response.json()
-                logger.info(
-                    f"Получено расписание для агента {phone_number}: {len(stores)} магазинов"
-                )
+        status, day_schedule = await get_agent_schedule(phone_number)
     except Exception as e:
-        logger.error(f"Ошибка при запросе расписания для {phone_number}: {e}")
+        logger.error("Ошибка при запросе расписания для %s: %s", phone_number, e)
+        await message.answer("Ошибка при получении расписания.")
+        return
+
+    if status == 404:
+        logger.warning("Агент с номером %s не найден", phone_number)
+        await message.answer(f"Агент с номером {phone_number} не найден.")
+        return
+
+    if status != 200:
+        logger.error("Ошибка при получении расписания: статус %s", status)
         await message.answer("Ошибка при получении расписания.")
         return
 
+    stores = day_schedule.stores
+
     if not stores:
         weekdays = [
             "Понедельник",
@@ -173,347 +237,322 @@ async def schedule(message: Message):
             "Воскресенье",
         ]
         today = datetime.now().weekday()
-        logger.info(f"Нет назначенных магазинов на сегодня ({weekdays[today]})")
+        logger.info("Нет назначенных магазинов на сегодня (%s)", weekdays[today])
         await message.answer(
             f"На сегодня ({weekdays[today]}) у вас нет назначенных магазинов."
         )
         return
 
-    builder = ReplyKeyboardBuilder()
-    for store in stores:
-        builder.add(KeyboardButton(text=store["name"]))
-
-    builder.add(KeyboardButton(text="🔙 Назад"))
-    builder.adjust(2)
-
-    logger.info(f"Отправка клавиатуры с {len(stores)} магазинами")
+    logger.info("Отправка клавиатуры с %s магазинами", len(stores))
     await message.answer(
         "Ваши магазины на сегодня:\n\nВыберите магазин:",
-        reply_markup=builder.as_markup(resize_keyboard=True, one_time_keyboard=True),
+        reply_markup=get_stores_keyboard(
+            tuple(store["name"] for store in stores),
+            with_location=bool(len(day_schedule.geo)),
+        ),
     )
 
 
-async def check_coordinates(latitude, longitude, shop_name):
+async def check_coordinates(latitude, longitude, shop_name, phone_number=None):
     logger.info(
-        f"Проверка координат: lat={latitude}, lng={longitude}, shop={shop_name}"
+        "Проверка координат: lat=%s, lng=%s, shop=%s", latitude, longitude, shop_name
     )
 
-    try:
-        url = f"{os.getenv('WEB_SERVICE_URL')}/api/check-address/{longitude}/{latitude}/{shop_name}/"
-        logger.info(f"Запрос проверки координат: {url}")
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    success = data.get("success", False)
-                    distance = data.get("distance")
-
+    if phone_number and config.geofence.local:
+        try:
+            status, day_schedule = await get_agent_schedule(phone_number)
+            if status == 200 and day_schedule is not None:
+                result = day_schedule.geo.distance(shop_name, latitude, longitude)
+                if result is not None:
+                    distance, radius = result
+                    success = distance <= radius
                     logger.info(
-                        f"Результат проверки координат: success={success}, distance={distance}"
+                        "Локальная проверка координат: success=%s, distance=%.0fм, radius=%.0fм",
+                        success,
+                        distance,
+                        radius,
                     )
                     return success
-                else:
-                    error_text = await response.text()
-                    logger.error(
-                        f"Ошибка проверки координат: статус {response.status}, ответ: {error_text}"
-                    )
-                    return False
+                logger.info(
+                    "Координаты магазина '%s' неизвестны, проверка через API", shop_name
+                )
+        except Exception as e:
+            logger.error("Ошибка локальной проверки координат: %s", e)
+
+    try:
+        url = f"/api/check-address/{longitude}/{latitude}/{shop_name}/"
+        logger.info("Запрос проверки координат: %s", url)
+
+        async with backend_client.get(url, endpoint="check_address") as response:
+            if response.status == 200:
+                data = await response.json()
+                success = data.get("success", False)
+                distance = data.get("distance")
+
+                logger.info(
+                    "Результат проверки координат: success=%s, distance=%s",
+                    success,
+                    distance,
+                )
+                return success
+            else:
+                error_text = await response.text()
+                logger.error(
+                    "Ошибка проверки координат: статус %s, ответ: %s",
+                    response.status,
+                    error_text,
+                )
+                return False
 
     except Exception as e:
-        logger.error(f"Исключение при проверке координат: {e}")
+        logger.error("Исключение при проверке координат: %s", e)
         return False
 
 
-def check_photo_creation_time(file_path):
-    logger.info(f"Проверка времени создания фото: {file_path}")
+IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",
+    b"\x89PNG\r\n\x1a\n",
+    b"II*\x00",
+    b"MM\x00*",
+    b"BM",
+)
 
-    try:
-        file_extension = os.path.splitext(file_path.lower())[1]
-        user_timezone = pytz.timezone("Asia/Bishkek")
-        logger.info(f"Расширение файла: {file_extension}")
-
-        if file_extension == ".heic":
-            logger.info("Обработка HEIC файла")
-            metadata = get_heic_metadata(file_path)
-            if not metadata:
-                logger.warning(f"Метаданные отсутствуют в HEIC файле: {file_path}")
-                return False
 
-            date_time_str = None
-            for field in ["DateTimeOriginal", "CreateDate"]:
-                if field in metadata and metadata[field]:
-                    date_time_str = metadata[field]
-                    logger.info(f"Найдено поле времени {field}: {date_time_str}")
-                    break
+def is_image_header(head: bytes) -> bool:
+    if head.startswith(IMAGE_SIGNATURES):
+        return True
+    # HEIC/HEIF: ISO BMFF контейнер с боксом ftyp в начале файла
+    return head[4:8] == b"ftyp"
 
-            if not date_time_str:
-                logger.warning(
-                    f"Данные о времени создания отсутствуют в HEIC: {file_path}"
-                )
-                return False
 
-            match = re.match(
-                r"(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})", date_time_str
-            )
-            if not match:
-                logger.warning(f"Неизвестный формат даты в HEIC: {date_time_str}")
-                return False
+def _album_key(message: Message) -> str:
+    return f"album:{message.chat.id}:{message.media_group_id}"
 
-            year, month, day, hour, minute, second = map(int, match.groups())
-            photo_time_naive = datetime(year, month, day, hour, minute, second)
-            photo_time = user_timezone.localize(photo_time_naive)
 
-            current_time = datetime.now(user_timezone)
-            time_diff = current_time - photo_time
+async def album_started(message: Message) -> bool:
+    """Фильтр: альбом уже начали загружать, файл относится к нему в любом состоянии."""
+    return bool(await redis_client.exists(f"{_album_key(message)}:context"))
 
-            logger.info(
-                f"HEIC: время фото={photo_time}, текущее время={current_time}, разница={time_diff}"
-            )
-            result = time_diff <= timedelta(minutes=10)
-            logger.info(f"Результат проверки времени HEIC: {result}")
-            return result
 
-        else:
-            logger.info("Обработка обычного изображения")
-            try:
-                img = Image.open(file_path)
+async def collect_media_group(
+    message: Message, context: dict
+) -> tuple[list[dict], dict] | None:
+    """Собирает документы альбома из Redis.
 
-                if not img.info.get("exif"):
-                    logger.warning(
-                        f"EXIF данные отсутствуют в изображении: {file_path}"
-                    )
-                    return False
-
-                exif_dict = piexif.load(img.info["exif"])
-                date_time_str = None
-
-                if (
-                    "Exif" in exif_dict
-                    and piexif.ExifIFD.DateTimeOriginal in exif_dict["Exif"]
-                ):
-                    date_time_str = exif_dict["Exif"][
-                        piexif.ExifIFD.DateTimeOriginal
-                    ].decode("utf-8")
-                    logger.info(
-                        f"Найдено DateTimeOriginal в Exif секции: {date_time_str}"
-                    )
-
-                elif (
-                    "Exif" in exif_dict
-                    and piexif.ExifIFD.DateTimeDigitized in exif_dict["Exif"]
-                ):
-                    date_time_str = exif_dict["Exif"][
-                        piexif.ExifIFD.DateTimeDigitized
-                    ].decode("utf-8")
-                    logger.info(
-                        f"Найдено DateTimeDigitized в Exif секции: {date_time_str}"
-                    )
+    Каждое сообщение альбома добавляет свой файл в список; первое становится
+    лидером, ждет, пока список перестанет расти, и забирает все файлы вместе
+    с ключом лидера. Остальным возвращается None — их файлы обработает лидер.
+    Файл, пришедший после этого, начинает новую группу со своим лидером.
 
-                elif (
-                    "0th" in exif_dict and piexif.ImageIFD.DateTime in exif_dict["0th"]
-                ):
-                    date_time_str = exif_dict["0th"][piexif.ImageIFD.DateTime].decode(
-                        "utf-8"
-                    )
-                    logger.info(f"Найдено DateTime в 0th секции: {date_time_str}")
+    Первое сообщение альбома сохраняет context (тип фото, магазин,
+    геолокацию): к опоздавшим файлам состояние FSM может уже не подходить.
+    Возвращает файлы и этот сохраненный context.
+    """
+    key = _album_key(message)
+    document = message.document
+    item = json.dumps(
+        {
+            "file_id": document.file_id,
+            "file_unique_id": document.file_unique_id,
+            "file_name": document.file_name,
+            "file_size": document.file_size,
+        },
+        ensure_ascii=False,
+    )
 
-                if not date_time_str:
-                    logger.warning(
-                        f"Данные о времени создания отсутствуют в EXIF: {file_path}"
-                    )
-                    return False
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.rpush(f"{key}:files", item)
+        pipe.expire(f"{key}:files", 300)
+        pipe.set(f"{key}:leader", message.message_id, nx=True, ex=300)
+        pipe.set(
+            f"{key}:context", json.dumps(context, ensure_ascii=False), nx=True, ex=300
+        )
+        pipe.get(f"{key}:context")
+        size, _, is_leader, _, stored = await pipe.execute()
 
-                photo_time_naive = datetime.strptime(date_time_str, "%Y:%m:%d %H:%M:%S")
-                photo_time = user_timezone.localize(photo_time_naive)
+    if not is_leader:
+        logger.info("Файл добавлен в альбом %s: %s-й", message.media_group_id, size)
+        return None
 
-                current_time = datetime.now(user_timezone)
-                time_diff = current_time - photo_time
+    while True:
+        await asyncio.sleep(config.photo.album_wait)
+        new_size = await redis_client.llen(f"{key}:files")
+        if new_size == size:
+            break
+        size = new_size
 
-                logger.info(
-                    f"EXIF: время фото={photo_time}, текущее время={current_time}, разница={time_diff}"
-                )
-                result = time_diff <= timedelta(minutes=10)
-                logger.info(f"Результат проверки времени EXIF: {result}")
-                return result
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.lrange(f"{key}:files", 0, -1)
+        pipe.delete(f"{key}:files", f"{key}:leader")
+        items, _ = await pipe.execute()
 
-            except Exception as e:
-                logger.warning(f"Ошибка при чтении EXIF данных: {e}")
-                return False
+    logger.info("Альбом %s собран: %s файлов", message.media_group_id, len(items))
+    return [json.loads(item) for item in items], json.loads(stored)
 
-    except Exception as e:
-        logger.error(f"Ошибка при проверке времени создания файла: {e}")
-        return False
 
+async def download_file(file_url: str, filename: str, file_size: int | None = None):
+    logger.info("Скачивание файла: %s -> %s", file_url, filename)
 
-async def download_file(file_url: str, filename: str):
-    logger.info(f"Скачивание файла: {file_url} -> {filename}")
+    max_size = config.photo.max_file_size
+    if file_size and file_size > max_size:
+        logger.warning("Файл %s слишком большой: %s байт", filename, file_size)
+        raise PhotoRejectedError(
+            f"Файл слишком большой. Максимальный размер — {max_size // (1024 * 1024)} МБ."
+        )
 
+    photo = PhotoBuffer(filename)
     try:
-        os.makedirs("media/shelf", exist_ok=True)
-        _, ext = os.path.splitext(filename)
-        unique_filename = f"{uuid.uuid4()}{ext}"
-        save_path = f"media/shelf/{unique_filename}"
-        relative_path = f"shelf/{unique_filename}"
-
-        logger.info(f"Сохранение файла по пути: {save_path}")
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url) as response:
-                if response.status != 200:
-                    logger.error(f"Ошибка скачивания файла: статус {response.status}")
-                    raise Exception(f"Failed to download file: {response.status}")
-
-                with open(save_path, "wb") as f:
-                    content = await response.read()
-                    f.write(content)
-                    logger.info(f"Файл успешно скачан, размер: {len(content)} байт")
-
-        file_extension = os.path.splitext(filename.lower())[1]
-        image_extensions = [".jpg", ".jpeg", ".png", ".heic", ".tiff", ".bmp"]
-
-        if any(file_extension == ext for ext in image_extensions):
-            logger.info(f"Проверка изображения с расширением: {file_extension}")
-            is_valid = await sync_to_async(check_photo_creation_time)(save_path)
-
-            if not is_valid:
-                logger.error("Фото не прошло проверку времени создания")
-                if os.path.exists(save_path):
-                    os.remove(save_path)
-                    logger.info(f"Удален невалидный файл: {save_path}")
-                raise Exception(
-                    "Фото не содержит необходимые метаданные или было сделано более 10 минут назад."
-                )
+        with photo_stage("download", rejected=(PhotoRejectedError,)):
+            await _download_to(photo, file_url, max_size)
 
-            if file_extension in [".heic", ".heif"]:
-                logger.info("Конвертация HEIC в JPEG")
-                new_path = await convert_heic_to_jpeg(save_path)
-                relative_path = f"shelf/{os.path.basename(new_path)}"
-                logger.info(f"Файл сконвертирован: {relative_path}")
+        photo = await process_downloaded_photo(photo)
 
-        logger.info(f"Файл успешно обработан: {relative_path}")
-        return relative_path
+        logger.info("Файл успешно обработан: %s", photo.filename)
+        return photo
 
-    except Exception as e:
-        logger.error(f"Ошибка в download_file: {e}")
+    except (Exception, asyncio.CancelledError) as e:
+        logger.error("Ошибка в download_file: %s", e)
+        photo.close()
         raise
 
 
-def get_heic_metadata(file_path):
-    logger.info(f"Получение метаданных HEIC: {file_path}")
+async def _download_to(photo: PhotoBuffer, file_url: str, max_size: int) -> None:
+    filename = photo.filename
+    async with backend_client.get(file_url, endpoint="telegram_file") as response:
+        if response.status != 200:
+            logger.error("Ошибка скачивания файла: статус %s", response.status)
+            raise Exception(f"Failed to download file: {response.status}")
 
-    try:
-        try:
-            subprocess.run(["exiftool", "-ver"], capture_output=True, check=True)
-            logger.info("ExifTool найден и работает")
-        except (subprocess.SubprocessError, FileNotFoundError):
-            logger.error(
-                "ExifTool не установлен. Установите с помощью 'sudo dnf install perl-Image-ExifTool'"
+        if response.content_length and response.content_length > max_size:
+            raise PhotoRejectedError(
+                f"Файл слишком большой. Максимальный размер — {max_size // (1024 * 1024)} МБ."
             )
-            return None
 
-        result = subprocess.run(
-            ["exiftool", "-json", "-DateTimeOriginal", "-CreateDate", file_path],
-            capture_output=True,
-            text=True,
-        )
+        async for chunk in response.content.iter_chunked(config.photo.chunk_size):
+            if photo.size == 0 and not is_image_header(chunk):
+                logger.warning("Файл %s не является изображением", filename)
+                raise PhotoRejectedError(
+                    "Файл не является изображением. Отправьте фото файлом."
+                )
 
-        if result.returncode != 0:
-            logger.error(f"Ошибка при выполнении exiftool: {result.stderr}")
-            return None
+            if photo.size + len(chunk) > max_size:
+                raise PhotoRejectedError(
+                    f"Файл слишком большой. Максимальный размер — {max_size // (1024 * 1024)} МБ."
+                )
 
-        metadata = json.loads(result.stdout)
-        if not metadata or len(metadata) == 0:
-            logger.warning(f"Пустые метаданные для файла: {file_path}")
-            return None
+            photo.write(chunk)
 
-        logger.info(f"Метаданные HEIC успешно получены: {metadata[0]}")
-        return metadata[0]
+        logger.info("Файл успешно скачан, размер: %s байт", photo.size)
 
-    except Exception as e:
-        logger.error(f"Ошибка при чтении метаданных HEIC: {e}")
-        return None
 
+_imagemagick_semaphore = asyncio.Semaphore(config.imaging.convert_concurrency)
 
-async def convert_heic_to_jpeg(heic_path):
-    logger.info(f"Конвертация HEIC в JPEG: {heic_path}")
 
-    try:
-        if not heic_path.lower().endswith((".heic", ".heif")):
-            logger.info("Файл не является HEIC, пропуск конвертации")
-            return heic_path
+async def convert_heic_with_imagemagick(photo: PhotoBuffer) -> bytes:
+    cmd = ["convert", "heic:-", "jpeg:-"]
+    logger.info("Команда ImageMagick: %s", " ".join(cmd))
 
-        jpeg_path = os.path.splitext(heic_path)[0] + ".jpg"
-        logger.info(f"Целевой путь JPEG: {jpeg_path}")
+    async with _imagemagick_semaphore:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        jpeg_data, stderr = await process.communicate(photo.getvalue())
 
-        try:
-            pillow_heif.register_heif_opener()
-            with Image.open(heic_path) as img:
-                img.convert("RGB").save(jpeg_path, "JPEG", quality=95, optimize=True)
-            logger.info(
-                f"HEIC успешно конвертирован через pillow-heif: {heic_path} -> {jpeg_path}"
-            )
+    if process.returncode != 0:
+        error_msg = stderr.decode() if stderr else "Неизвестная ошибка"
+        logger.error("ImageMagick failed: %s", error_msg)
+        raise Exception(f"ImageMagick failed: {error_msg}")
 
-        except (ImportError, Exception) as e:
-            logger.warning(f"Pillow-heif не сработал: {e}. Пробуем ImageMagick...")
+    if not jpeg_data:
+        logger.error("Созданный JPEG файл пустой")
+        raise Exception("Созданный JPEG файл пустой")
 
-            cmd = ["convert", heic_path, jpeg_path]
-            logger.info(f"Команда ImageMagick: {' '.join(cmd)}")
+    logger.info("HEIC успешно конвертирован через ImageMagick")
+    return jpeg_data
 
-            process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
 
-            stdout, stderr = await process.communicate()
+async def _process_in_pool(
+    data: bytes, filename: str, metadata: dict | None
+) -> PhotoResult:
+    # image_pool — весь вызов пула вместе с ожиданием в очереди, этапы внутри
+    # рабочего процесса пишутся отдельно под своими именами.
+    with photo_stage("image_pool", rejected=(PhotoRejectedError,)):
+        result = await image_executor.run(
+            process_photo, data, filename, metadata, config.imaging
+        )
+    observe_photo_stages(result.stages)
+    return result
 
-            if process.returncode != 0:
-                error_msg = stderr.decode() if stderr else "Неизвестная ошибка"
-                logger.error(f"ImageMagick failed: {error_msg}")
-                raise Exception(f"ImageMagick failed: {error_msg}") from None
 
-            logger.info("HEIC успешно конвертирован через ImageMagick")
+async def process_downloaded_photo(photo: PhotoBuffer) -> PhotoBuffer:
+    data = photo.getvalue()
+    result = await _process_in_pool(data, photo.filename, None)
 
-        if not os.path.exists(jpeg_path):
-            logger.error(f"Не удалось создать JPEG файл: {jpeg_path}")
-            raise Exception(f"Не удалось создать JPEG файл: {jpeg_path}")
+    if result.needs_metadata:
+        with photo_stage("exiftool"):
+            metadata = await asyncio.to_thread(
+                exiftool.read_dates, data, photo.extension
+            )
+        if metadata:
+            logger.debug("Метаданные HEIC получены через ExifTool: %s", metadata)
+            result = await _process_in_pool(data, photo.filename, metadata)
+
+    if not result.valid:
+        logger.error("Фото не прошло проверку времени создания")
+        raise PhotoRejectedError(
+            "Фото не содержит необходимые метаданные или было сделано более 10 минут назад."
+        )
 
-        if os.path.getsize(jpeg_path) == 0:
-            logger.error("Созданный JPEG файл пустой")
-            raise Exception("Созданный JPEG файл пустой")
+    if result.needs_conversion:
+        logger.warning("Pillow-heif не сработал. Пробуем ImageMagick...")
+        jpeg_name = os.path.splitext(photo.filename)[0] + ".jpg"
+        with photo_stage("imagemagick"):
+            jpeg_data = await convert_heic_with_imagemagick(photo)
+        result = PhotoResult(
+            valid=True, filename=jpeg_name, data=jpeg_data, phash=result.phash
+        )
 
-        if os.path.exists(heic_path):
-            os.remove(heic_path)
-            logger.info(f"Удален оригинальный HEIC файл: {heic_path}")
+    if result.data is None:
+        photo.phash = result.phash
+        return photo
 
-        logger.info(f"Конвертация HEIC завершена успешно: {jpeg_path}")
-        return jpeg_path
-
-    except Exception as e:
-        logger.error(f"Ошибка в convert_heic_to_jpeg: {e}")
-        raise
+    photo.close()
+    logger.info("Файл сконвертирован: %s", result.filename)
+    converted = PhotoBuffer.from_bytes(result.filename, result.data)
+    converted.phash = result.phash
+    return converted
 
 
 async def save_file_to_post(
     id,
     store_id,
-    relative_path,
+    photo: PhotoBuffer,
     latitude=None,
     longitude=None,
     type_photo=None,
     dmp_type=None,
+    chat_id=None,
+    message_id=None,
+    dedup=None,
 ):
     logger.info(
-        f"Сохранение файла в пост: id={id}, store_id={store_id}, path={relative_path}"
+        "Сохранение файла в пост: id=%s, store_id=%s, file=%s",
+        id,
+        store_id,
+        photo.filename,
     )
-    logger.info(
-        f"Параметры: lat={latitude}, lng={longitude}, type={type_photo}, dmp_type={dmp_type}"
+    logger.debug(
+        "Параметры: lat=%s, lng=%s, type=%s, dmp_type=%s",
+        latitude,
+        longitude,
+        type_photo,
+        dmp_type,
     )
 
     try:
-        file_path = f"media/{relative_path}"
-        api_url = f"{os.getenv('WEB_SERVICE_URL')}/api/photo-posts/create/"
-        logger.info(f"API URL: {api_url}")
-
         data = {
             "agent": id,
             "store": store_id,
@@ -523,54 +562,72 @@ async def save_file_to_post(
             "dmp_type": dmp_type,
         }
 
-        logger.info(f"Отправка файла: {file_path}")
-        logger.info(f"Данные запроса: {data}")
+        job_id = await outbox.enqueue(
+            data,
+            photo=photo.getvalue(),
+            filename=photo.filename,
+            chat_id=chat_id,
+            message_id=message_id,
+            dedup=dedup,
+        )
+        return {"success": True, "job_id": job_id}
 
-        async with aiohttp.ClientSession() as session:
-            with open(file_path, "rb") as image_file:
-                form_data = aiohttp.FormData()
-                for key, value in data.items():
-                    if value is not None:
-                        form_data.add_field(key, str(value))
+    except Exception as e:
+        logger.error("Ошибка в save_file_to_post: %s", e)
+        return {"success": False, "error": str(e)}
+    finally:
+        photo.close()
 
-                form_data.add_field(
-                    "image", image_file, filename=os.path.basename(file_path)
-                )
 
-                async with session.post(api_url, data=form_data) as response:
-                    response_text = await response.text()
-                    logger.info(
-                        f"Ответ API: статус={response.status}, текст={response_text}"
-                    )
+async def save_files_to_post(
+    id,
+    store_id,
+    photos: list[PhotoBuffer],
+    latitude=None,
+    longitude=None,
+    type_photo=None,
+    dmp_type=None,
+    chat_id=None,
+    message_id=None,
+    note=None,
+    dedup=None,
+):
+    logger.info(
+        "Сохранение пачки файлов в пост: id=%s, store_id=%s, файлов=%s",
+        id,
+        store_id,
+        len(photos),
+    )
 
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        logger.info(f"Удален временный файл: {file_path}")
-
-                    if response.status == 201:
-                        logger.info("Файл успешно загружен в пост")
-                        return {
-                            "success": True,
-                            "data": json.loads(response_text)
-                            if response_text
-                            else None,
-                        }
-                    else:
-                        logger.error(
-                            f"Ошибка при создании поста. Статус: {response.status}, Ответ: {response_text}"
-                        )
-                        return {
-                            "success": False,
-                            "status": response.status,
-                            "error": response_text,
-                        }
+    try:
+        data = {
+            "agent": id,
+            "store": store_id,
+            "post_type": type_photo,
+            "latitude": latitude,
+            "longitude": longitude,
+            "dmp_type": dmp_type,
+        }
+
+        batch_id = await outbox.enqueue_batch(
+            [
+                (data, photo.getvalue(), photo.filename, entry)
+                for photo, entry in zip(
+                    photos, dedup or [None] * len(photos), strict=True
+                )
+            ],
+            chat_id=chat_id,
+            message_id=message_id,
+            note=note,
+        )
+        return {"success": True, "batch_id": batch_id}
 
     except Exception as e:
-        logger.error(f"Ошибка в save_file_to_post: {e}")
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"Удален файл после ошибки: {file_path}")
+        logger.error("Ошибка в save_files_to_post: %s", e)
         return {"success": False, "error": str(e)}
+    finally:
+        for photo in photos:
+            photo.close()
 
 
 async def save_post_data(
@@ -581,16 +638,19 @@ async def save_post_data(
     type_photo=None,
     brand_name=None,
     dmp_count=None,
+    chat_id=None,
 ):
-    logger.info(f"Сохранение данных поста: id={id}, store_id={store_id}")
-    logger.info(
-        f"Параметры: lat={latitude}, lng={longitude}, type={type_photo}, brand={brand_name}, count={dmp_count}"
+    logger.info("Сохранение данных поста: id=%s, store_id=%s", id, store_id)
+    logger.debug(
+        "Параметры: lat=%s, lng=%s, type=%s, brand=%s, count=%s",
+        latitude,
+        longitude,
+        type_photo,
+        brand_name,
+        dmp_count,
     )
 
     try:
-        api_url = f"{os.getenv('WEB_SERVICE_URL')}/api/photo-posts/create/"
-        logger.info(f"API URL: {api_url}")
-
         data = {
             "agent": id,
             "store": store_id,
@@ -601,34 +661,9 @@ async def save_post_data(
             "dmp_count": dmp_count,
         }
 
-        data = {k: v for k, v in data.items() if v is not None}
-        logger.info(f"Отправка данных (без None): {data}")
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                api_url, json=data, headers={"Content-Type": "application/json"}
-            ) as response:
-                response_text = await response.text()
-                logger.info(
-                    f"Ответ API: статус={response.status}, текст={response_text}"
-                )
-
-                if response.status == 201:
-                    logger.info("Данные поста успешно сохранены")
-                    return {
-                        "success": True,
-                        "data": json.loads(response_text) if response_text else None,
-                    }
-                else:
-                    logger.error(
-                        f"Ошибка при создании поста. Статус: {response.status}, Ответ: {response_text}"
-                    )
-                    return {
-                        "success": False,
-                        "status": response.status,
-                        "error": response_text,
-                    }
+        job_id = await outbox.enqueue(data, chat_id=chat_id)
+        return {"success": True, "job_id": job_id}
 
     except Exception as e:
-        logger.error(f"Ошибка в save_post_data: {e}")
+        logger.error("Ошибка в save_post_data: %s", e)
         return {"success": False, "error": str(e)}
@@ -2,109 +2,134 @@ from aiogram.types import (
     KeyboardButton,
     ReplyKeyboardMarkup,
 )
+from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
+from handlers.constants import (
+    COMPETITOR_BRANDS,
+    NEARBY_STORE_BUTTON,
+    ORIMI_BRANDS,
+    POST_TYPE_CHOICES,
+)
+from services.cache import MISSING, LRUCache
 
-def get_contact_keyboard() -> ReplyKeyboardMarkup:
+# Статические клавиатуры собираются один раз при импорте и переиспользуются:
+# объекты aiogram неизменяемы, поэтому их безопасно отдавать всем хендлерам.
+
+BACK_BUTTON = KeyboardButton(text="🔙 Назад")
+
+
+def _column_keyboard(texts: list[str], **kwargs) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📱 Поделиться контактом", request_contact=True)]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True,
+        keyboard=[[KeyboardButton(text=text)] for text in texts] + [[BACK_BUTTON]],
+        **kwargs,
     )
 
 
-def get_main_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="🏪 Выбрать маркет"),
-                KeyboardButton(text="👤 Мой профиль"),
-                KeyboardButton(text="❓ Помощь"),
-            ],
+CONTACT_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="📱 Поделиться контактом", request_contact=True)]],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+
+MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [
+            KeyboardButton(text="🏪 Выбрать маркет"),
+            KeyboardButton(text="👤 Мой профиль"),
+            KeyboardButton(text="❓ Помощь"),
         ],
-        resize_keyboard=True,
-    )
+    ],
+    resize_keyboard=True,
+)
+
+LOCATION_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📍 Отправить геолокацию", request_location=True)],
+        [BACK_BUTTON],
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+
+BACK_KEYBOARD = ReplyKeyboardMarkup(keyboard=[[BACK_BUTTON]], resize_keyboard=True)
+
+PHOTO_TYPE_KEYBOARD = _column_keyboard(
+    POST_TYPE_CHOICES, resize_keyboard=True, one_time_keyboard=True
+)
+
+DMP_BRAND_KEYBOARDS = {
+    "orimi": _column_keyboard(
+        ORIMI_BRANDS, resize_keyboard=True, one_time_keyboard=True
+    ),
+    "competitor": _column_keyboard(
+        COMPETITOR_BRANDS, resize_keyboard=True, one_time_keyboard=True
+    ),
+}
+
+CONTINUE_IN_SHOP_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📷 Продолжить в этом магазине")],
+        [KeyboardButton(text="🏪 Выбрать другой магазин")],
+        [KeyboardButton(text="👤 Мой профиль"), KeyboardButton(text="❓ Помощь")],
+    ],
+    resize_keyboard=True,
+)
+
+
+def get_contact_keyboard() -> ReplyKeyboardMarkup:
+    return CONTACT_KEYBOARD
+
+
+def get_main_keyboard() -> ReplyKeyboardMarkup:
+    return MAIN_KEYBOARD
 
 
 def get_location_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📍 Отправить геолокацию", request_location=True)],
-            [KeyboardButton(text="🔙 Назад")],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
+    return LOCATION_KEYBOARD
 
 
 def get_back_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="🔙 Назад")],
-        ],
-        resize_keyboard=True,
-    )
+    return BACK_KEYBOARD
 
 
 def get_photo_type_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="РМП_чай_ДО")],
-            [KeyboardButton(text="РМП_чай_ПОСЛЕ")],
-            [KeyboardButton(text="РМП_кофе_ДО")],
-            [KeyboardButton(text="РМП_кофе_ПОСЛЕ")],
-            [KeyboardButton(text="ДМП_ОРИМИ КР")],
-            [KeyboardButton(text="ДМП_конкурент")],
-            [KeyboardButton(text="🔙 Назад")],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
+    return PHOTO_TYPE_KEYBOARD
 
 
 def get_photo_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="🔙 Назад")],
-        ],
-        resize_keyboard=True,
-    )
+    return BACK_KEYBOARD
 
 
-async def get_dmp_brands_keyboard(brand_type: str) -> ReplyKeyboardMarkup:
-    if brand_type == "orimi":
-        brands = ["Tess", "Гринф", "ЖН", "Шах", "Jardin", "Жокей"]
-    elif brand_type == "competitor":
-        brands = [
-            "Beta",
-            "Пиала",
-            "Ахмад",
-            "Jacobs",
-            "Nestle",
-        ]
-    else:
-        brands = []
-
-    buttons = []
-    for brand in brands:
-        buttons.append([KeyboardButton(text=brand)])
-
-    buttons.append([KeyboardButton(text="🔙 Назад")])
-
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=buttons, resize_keyboard=True, one_time_keyboard=True
-    )
-
-    return keyboard
+def get_dmp_brands_keyboard(brand_type: str) -> ReplyKeyboardMarkup:
+    return DMP_BRAND_KEYBOARDS.get(brand_type, BACK_KEYBOARD)
 
 
 def get_continue_in_shop_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📷 Продолжить в этом магазине")],
-            [KeyboardButton(text="🏪 Выбрать другой магазин")],
-            [KeyboardButton(text="👤 Мой профиль"), KeyboardButton(text="❓ Помощь")],
-        ],
-        resize_keyboard=True,
-    )
+    return CONTINUE_IN_SHOP_KEYBOARD
+
+
+# Клавиатуры магазинов зависят только от списка названий, поэтому кэшируются
+# по нему: у агентов с одинаковым расписанием клавиатура общая, а изменение
+# расписания дает новый ключ.
+_stores_keyboards = LRUCache(maxsize=1000, ttl=24 * 3600)
+
+
+def get_stores_keyboard(
+    store_names: tuple[str, ...], with_location: bool = False
+) -> ReplyKeyboardMarkup:
+    key = (store_names, with_location)
+    keyboard = _stores_keyboards.get(key)
+    if keyboard is not MISSING:
+        return keyboard
+
+    builder = ReplyKeyboardBuilder()
+    for name in store_names:
+        builder.add(KeyboardButton(text=name))
+    builder.add(BACK_BUTTON)
+    builder.adjust(2)
+    if with_location:
+        builder.row(KeyboardButton(text=NEARBY_STORE_BUTTON, request_location=True))
+
+    keyboard = builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
+    _stores_keyboards.set(key, keyboard)
+    return keyboard
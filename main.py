@@ -1,19 +1,127 @@
 import asyncio
+import signal
+import time
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
 
 from config.config import load_config
+from config.redis_connect import fsm_storage, redis_client
 from handlers.user_handlers import router as user_router
 from keyboards.menu import set_menu
-from services.logger import logger
+from services.backend import backend_client
+from services.exiftool import exiftool
+from services.imaging import image_executor
+from services.logger import get_logger
+from services.metrics import start_metrics_server
 from services.notifications import setup_scheduler
+from services.outbox import outbox
+
+logger = get_logger(__name__)
 
 config = load_config()
 
+background_tasks: set[asyncio.Task] = set()
+
+
+async def on_startup(started_at: float):
+    logger.info(
+        "Бот готов принимать обновления: %.3fс с начала main(), CPU-время процесса с учетом импортов: %.3fс",
+        time.perf_counter() - started_at,
+        time.process_time(),
+    )
+
+    task = asyncio.create_task(image_executor.warm_up())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=fsm_storage)
+    dp.include_router(user_router)
+    dp.startup.register(on_startup)
+    return dp
+
+
+async def run_polling(dp: Dispatcher, bot: Bot, started_at: float):
+    await bot.delete_webhook(drop_pending_updates=False)
+    await dp.start_polling(bot, started_at=started_at)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, started_at: float):
+    if not config.webhook.base_url or not config.webhook.secret:
+        raise ValueError("Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    async def health(request: web.Request) -> web.Response:
+        if stopping.is_set():
+            return web.json_response({"status": "draining"}, status=503)
+        try:
+            await asyncio.wait_for(redis_client.ping(), timeout=1)
+            outbox_stats = await outbox.stats()
+        except Exception as e:
+            logger.error("Проверка здоровья: Redis недоступен: %s", e)
+            return web.json_response({"status": "redis unavailable"}, status=503)
+        return web.json_response({"status": "ok", "outbox": outbox_stats})
+
+    # Обновление обрабатывается в рамках HTTP-запроса: при остановке сервер
+    # дожидается завершения запросов, а недоставленные обновления Telegram
+    # повторит на другой реплике.
+    webhook_handler = SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=config.webhook.secret,
+        started_at=started_at,
+    )
+
+    app = web.Application()
+    app.router.add_post(config.webhook.path, webhook_handler.handle)
+    app.router.add_get("/healthz", health)
+
+    runner = web.AppRunner(
+        app, handle_signals=False, shutdown_timeout=config.webhook.drain_timeout
+    )
+    await runner.setup()
+    site = web.TCPSite(runner, config.webhook.host, config.webhook.port)
+    await site.start()
+
+    await dp.emit_startup(bot=bot, started_at=started_at)
+    await bot.set_webhook(
+        f"{config.webhook.base_url}{config.webhook.path}",
+        secret_token=config.webhook.secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False,
+    )
+    logger.info(
+        "Webhook сервер запущен на %s:%s%s",
+        config.webhook.host,
+        config.webhook.port,
+        config.webhook.path,
+    )
+
+    try:
+        await stopping.wait()
+        logger.info(
+            "Получен сигнал остановки, ожидание %sс перед закрытием",
+            config.webhook.drain_delay,
+        )
+        await asyncio.sleep(config.webhook.drain_delay)
+    finally:
+        await runner.cleanup()
+        logger.info("Webhook сервер остановлен, обработка обновлений завершена")
+        await dp.emit_shutdown(bot=bot)
+
 
 async def main():
+    started_at = time.perf_counter()
     logger.info("Starting bot")
 
     bot = Bot(
@@ -21,19 +129,35 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
     await set_menu(bot)
-    dp = Dispatcher()
-    dp.include_router(user_router)
+    await backend_client.start()
+    exiftool.probe()
+    image_executor.start()
+    outbox.start(bot)
+    dp = create_dispatcher()
     scheduler = setup_scheduler(bot)
     scheduler.start()
+    metrics_runner = None
     try:
-        logger.info("Bot is starting")
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        # Внутри try: если порт метрик занят, ресурсы выше все равно закрываются
+        metrics_runner = await start_metrics_server()
+        logger.info("Bot is starting in %s mode", config.webhook.mode)
+        if config.webhook.mode == "webhook":
+            await run_webhook(dp, bot, started_at)
+        else:
+            await run_polling(dp, bot, started_at)
     except Exception as e:
-        logger.error(f"Critical error: {e}")
+        logger.error("Critical error: %s", e)
     finally:
         logger.info("Bot stopped")
+        scheduler.shutdown(wait=False)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await outbox.stop()
+        await backend_client.close()
+        exiftool.close()
+        image_executor.shutdown()
         await bot.session.close()
+        await fsm_storage.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any
+
+import aiohttp
+
+from config.config import BackendConfig, load_config
+from services.logger import get_logger
+from services.metrics import (
+    BACKEND_COALESCED,
+    BACKEND_IN_FLIGHT,
+    BACKEND_REQUESTS,
+    BACKEND_SECONDS,
+)
+
+logger = get_logger(__name__)
+
+# Общий таймаут (сек.) для каждого эндпоинта веб-сервиса. Эндпоинты, которых
+# нет в таблице, получают BackendConfig.default_timeout.
+ENDPOINT_TIMEOUTS = {
+    "agent": 5,
+    "store_id": 5,
+    "agent_schedule": 10,
+    "check_address": 10,
+    "daily_plans": 30,
+    "telegram_file": 60,
+}
+
+UPLOAD_ENDPOINTS = {"photo_posts"}
+
+
+class BackendClient:
+    """Долгоживущий HTTP-клиент веб-сервиса с общим пулом keep-alive соединений.
+
+    Создается один раз на процесс: `start()` вызывается при запуске бота,
+    `close()` — при остановке вместе с `bot.session.close()`.
+    """
+
+    def __init__(self, config: BackendConfig):
+        self.config = config
+        self._session: aiohttp.ClientSession | None = None
+        self._in_flight: dict[tuple[str, str], asyncio.Task] = {}
+        self.flights: dict[str, int] = {}
+        self.coalesced: dict[str, int] = {}
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.config.pool_limit,
+            limit_per_host=self.config.pool_limit_per_host,
+            keepalive_timeout=self.config.keepalive_timeout,
+            ttl_dns_cache=self.config.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=self.config.default_timeout,
+                connect=self.config.connect_timeout,
+            ),
+        )
+        logger.info(
+            "HTTP-клиент веб-сервиса запущен: пул=%s, на хост=%s, DNS TTL=%sс",
+            self.config.pool_limit,
+            self.config.pool_limit_per_host,
+            self.config.dns_cache_ttl,
+        )
+
+    async def close(self) -> None:
+        if self._session is None or self._session.closed:
+            return
+
+        await self._session.close()
+        self._session = None
+        logger.info("HTTP-клиент веб-сервиса остановлен")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("BackendClient не запущен, вызовите start()")
+        return self._session
+
+    def url(self, path: str) -> str:
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.config.base_url}{path}"
+
+    def timeout(self, endpoint: str) -> aiohttp.ClientTimeout:
+        if endpoint in UPLOAD_ENDPOINTS:
+            total = self.config.upload_timeout
+        else:
+            total = ENDPOINT_TIMEOUTS.get(endpoint, self.config.default_timeout)
+        return aiohttp.ClientTimeout(total=total, connect=self.config.connect_timeout)
+
+    @asynccontextmanager
+    async def request(
+        self, method: str, path: str, endpoint: str = "default", **kwargs
+    ):
+        """Запрос к веб-сервису с замером времени и статуса по эндпоинту.
+
+        Время считается до выхода из `async with`, то есть вместе с чтением
+        тела ответа.
+        """
+        kwargs.setdefault("timeout", self.timeout(endpoint))
+        status = "error"
+        started = time.perf_counter()
+        try:
+            with BACKEND_IN_FLIGHT.track(endpoint):
+                async with self.session.request(
+                    method, self.url(path), **kwargs
+                ) as response:
+                    status = str(response.status)
+                    yield response
+        finally:
+            BACKEND_SECONDS.observe(time.perf_counter() - started, endpoint, method)
+            BACKEND_REQUESTS.inc(endpoint, status)
+
+    def get(self, path: str, endpoint: str = "default", **kwargs):
+        return self.request("GET", path, endpoint, **kwargs)
+
+    def post(self, path: str, endpoint: str = "default", **kwargs):
+        return self.request("POST", path, endpoint, **kwargs)
+
+    async def _fetch_json(self, path: str, endpoint: str) -> tuple[int, Any]:
+        async with self.get(path, endpoint) as response:
+            if response.status != 200:
+                return response.status, None
+            return response.status, await response.json()
+
+    async def get_json(self, path: str, endpoint: str = "default") -> tuple[int, Any]:
+        """GET с объединением одинаковых одновременных запросов (single-flight).
+
+        Пока запрос с тем же эндпоинтом и путем выполняется, новые вызовы ждут
+        его результат, а не отправляют свой. Результат не кэшируется: следующий
+        вызов после завершения идет в веб-сервис. Возвращает (статус, JSON или
+        None при статусе не 200); данные общие для всех ожидающих, изменять их
+        нельзя. Отмена одного вызова не отменяет общий запрос.
+        """
+        key = (endpoint, path)
+        task = self._in_flight.get(key)
+        if task is None:
+            self.flights[endpoint] = self.flights.get(endpoint, 0) + 1
+            task = asyncio.create_task(self._fetch_json(path, endpoint))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish_flight(key, done))
+        else:
+            self.coalesced[endpoint] = self.coalesced.get(endpoint, 0) + 1
+            BACKEND_COALESCED.inc(endpoint)
+        return await asyncio.shield(task)
+
+    def _finish_flight(self, key: tuple[str, str], task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Если все ожидающие отменены, исключение иначе останется непрочитанным
+        if not task.cancelled():
+            task.exception()
+
+    def coalescing_stats(self) -> dict[str, dict[str, float]]:
+        stats = {}
+        for endpoint, flights in self.flights.items():
+            coalesced = self.coalesced.get(endpoint, 0)
+            stats[endpoint] = {
+                "requests": flights,
+                "coalesced": coalesced,
+                "ratio": round(coalesced / (flights + coalesced), 3),
+            }
+        return stats
+
+    def log_stats(self) -> None:
+        logger.info("Объединение запросов к веб-сервису: %s", self.coalescing_stats())
+
+
+config = load_config()
+
+backend_client = BackendClient(config.backend)
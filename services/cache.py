@@ -0,0 +1,160 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any
+
+from config.config import load_config
+from config.redis_connect import redis_client
+from services.logger import get_logger
+from services.metrics import AGENT_CACHE_LOOKUPS
+
+logger = get_logger(__name__)
+
+MISSING = object()
+
+
+class LRUCache:
+    """Процессный LRU-кэш с TTL на запись и счетчиками попаданий."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class AgentCache:
+    """Двухуровневый кэш агентов по номеру телефона: LRU процесса перед Redis.
+
+    Отсутствующие агенты кэшируются отдельно (негативный кэш) с более
+    коротким TTL, чтобы после регистрации номера администратором бот быстро
+    увидел изменения. `invalidate` удаляет запись из Redis и LRU только
+    текущего процесса: другие реплики видят старое значение, пока не истечет
+    TTL их локальной записи.
+    """
+
+    def __init__(
+        self,
+        redis,
+        maxsize: int,
+        ttl: int,
+        negative_ttl: int,
+        prefix: str = "agent",
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.prefix = prefix
+        self.local = LRUCache(maxsize, ttl)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def _key(self, phone_number: str) -> str:
+        return f"{self.prefix}:{phone_number}"
+
+    def _hit(self, level: str, value) -> None:
+        if not value:
+            self.negative_hits += 1
+        AGENT_CACHE_LOOKUPS.inc(level if value else "negative")
+
+    async def get(self, phone_number: str):
+        value = self.local.get(phone_number)
+        if value is not MISSING:
+            self.local_hits += 1
+            self._hit("local", value)
+            return value
+
+        try:
+            raw = await self.redis.get(self._key(phone_number))
+        except Exception as e:
+            logger.error("Ошибка чтения кэша агента %s из Redis: %s", phone_number, e)
+            raw = None
+
+        if raw is None:
+            self.misses += 1
+            AGENT_CACHE_LOOKUPS.inc("miss")
+            return MISSING
+
+        self.redis_hits += 1
+        value = json.loads(raw)
+        self._hit("redis", value)
+        ttl = self.ttl if value else self.negative_ttl
+        self.local.set(phone_number, value, ttl=ttl)
+        return value
+
+    async def set(self, phone_number: str, agent) -> None:
+        ttl = self.ttl if agent else self.negative_ttl
+        self.local.set(phone_number, agent, ttl=ttl)
+        try:
+            await self.redis.set(self._key(phone_number), json.dumps(agent), ex=ttl)
+        except Exception as e:
+            logger.error("Ошибка записи кэша агента %s в Redis: %s", phone_number, e)
+
+    async def invalidate(self, phone_number: str) -> None:
+        self.local.delete(phone_number)
+        try:
+            await self.redis.delete(self._key(phone_number))
+        except Exception as e:
+            logger.error("Ошибка инвалидации кэша агента %s: %s", phone_number, e)
+        logger.info("Кэш агента %s сброшен", phone_number)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "local_size": len(self.local),
+        }
+
+    def log_stats(self) -> None:
+        logger.info("Кэш агентов: %s", self.stats())
+
+
+config = load_config()
+
+agent_cache = AgentCache(
+    redis_client,
+    maxsize=config.cache.agent_cache_size,
+    ttl=config.cache.agent_ttl,
+    negative_ttl=config.cache.agent_negative_ttl,
+)
+
+profile_cache = LRUCache(
+    maxsize=config.cache.agent_cache_size, ttl=config.cache.profile_ttl
+)
@@ -0,0 +1,98 @@
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ExifToolDaemon:
+    """Один долгоживущий процесс `exiftool -stay_open` на весь бот.
+
+    Доступность exiftool проверяется один раз (`probe()` при запуске), сам
+    процесс стартует при первом запросе. Запросы сериализуются блокировкой:
+    вызывать из рабочих потоков, не из event loop.
+    """
+
+    READY_MARKER = "{ready}"
+
+    def __init__(self, executable: str = "exiftool"):
+        self.executable = executable
+        self.available: bool | None = None
+        self._process: subprocess.Popen | None = None
+        self._lock = threading.Lock()
+
+    def probe(self) -> bool:
+        self.available = shutil.which(self.executable) is not None
+        if self.available:
+            logger.info("ExifTool найден, будет использован как резервный парсер")
+        else:
+            logger.warning(
+                "ExifTool не установлен, HEIC читаются только через pillow-heif"
+            )
+        return self.available
+
+    def _start(self) -> None:
+        self._process = subprocess.Popen(
+            [self.executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        logger.info("ExifTool запущен в режиме stay_open, pid=%s", self._process.pid)
+
+    def _execute(self, *args: str) -> str:
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+
+        self._process.stdin.write("\n".join((*args, "-execute")) + "\n")
+        self._process.stdin.flush()
+
+        lines = []
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                raise RuntimeError("ExifTool неожиданно завершился")
+            if line.strip() == self.READY_MARKER:
+                break
+            lines.append(line)
+        return "".join(lines)
+
+    def read_dates(self, data: bytes, suffix: str = ".heic") -> dict | None:
+        if self.available is None:
+            self.probe()
+        if not self.available:
+            return None
+
+        # В режиме stay_open stdin занят командами, поэтому файл передается
+        # через временный файл; это только резервный путь.
+        with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+            tmp.write(data)
+            tmp.flush()
+            with self._lock:
+                output = self._execute(
+                    "-json", "-DateTimeOriginal", "-CreateDate", tmp.name
+                )
+
+        metadata = json.loads(output) if output.strip() else []
+        return metadata[0] if metadata else None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                return
+            try:
+                self._process.stdin.write("-stay_open\nFalse\n")
+                self._process.stdin.flush()
+                self._process.wait(timeout=5)
+            except Exception as e:
+                logger.warning("ExifTool не завершился штатно: %s", e)
+                self._process.kill()
+            self._process = None
+
+
+exiftool = ExifToolDaemon()
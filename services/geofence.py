@@ -0,0 +1,103 @@
+import math
+from collections import defaultdict
+
+EARTH_RADIUS_M = 6371008.8
+
+# Размер ячейки сетки в градусах (~1.1 км по широте). Магазин заносится во
+# все ячейки, которые пересекает круг его радиуса, поэтому поиск — это
+# просмотр одной ячейки.
+CELL_DEG = 0.01
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _float(value) -> float | None:
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def store_coordinates(store: dict) -> tuple[float, float, float] | None:
+    """Координаты и радиус магазина из записи расписания.
+
+    Берутся только поля `latitude`, `longitude` и `radius` самой записи. Если
+    какого-то нет, возвращается None и магазин проверяется через
+    `/api/check-address/`: радиус по умолчанию у веб-сервиса свой, и
+    подставленное ботом значение давало бы другой результат.
+    """
+    latitude = _float(store.get("latitude"))
+    longitude = _float(store.get("longitude"))
+    radius = _float(store.get("radius"))
+    if latitude is None or longitude is None or not radius or radius <= 0:
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    if latitude == 0 and longitude == 0:
+        return None
+    return latitude, longitude, radius
+
+
+def _cell(latitude: float, longitude: float) -> tuple[int, int]:
+    return math.floor(latitude / CELL_DEG), math.floor(longitude / CELL_DEG)
+
+
+class StoreGeoIndex:
+    """Сетка магазинов расписания для проверки геолокации без запроса к API.
+
+    `missing` — число магазинов без координат или радиуса: их в сетке нет,
+    поэтому пустой результат `locate` не значит, что рядом магазина нет.
+    """
+
+    def __init__(self, stores: list[dict]):
+        self.places: dict[str, tuple[float, float, float]] = {}
+        self.missing = 0
+        self._grid: dict[tuple[int, int], list[str]] = defaultdict(list)
+
+        for store in stores:
+            name = store.get("name")
+            coordinates = store_coordinates(store)
+            if not name or coordinates is None:
+                self.missing += 1
+                continue
+            self.places[name] = coordinates
+
+            latitude, longitude, radius = coordinates
+            dlat = radius / 111_320
+            dlon = radius / (111_320 * max(math.cos(math.radians(latitude)), 0.01))
+            min_row, min_col = _cell(latitude - dlat, longitude - dlon)
+            max_row, max_col = _cell(latitude + dlat, longitude + dlon)
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    self._grid[(row, col)].append(name)
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def distance(self, name: str, latitude: float, longitude: float):
+        """(расстояние, радиус) до магазина или None, если координат нет."""
+        place = self.places.get(name)
+        if place is None:
+            return None
+        return haversine_m(latitude, longitude, place[0], place[1]), place[2]
+
+    def locate(self, latitude: float, longitude: float) -> list[tuple[float, str]]:
+        """Магазины, в радиусе которых находится точка, от ближайшего."""
+        found = []
+        for name in self._grid.get(_cell(latitude, longitude), ()):
+            store_lat, store_lon, radius = self.places[name]
+            distance = haversine_m(latitude, longitude, store_lat, store_lon)
+            if distance <= radius:
+                found.append((distance, name))
+        return sorted(found)
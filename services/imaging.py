@@ -0,0 +1,576 @@
+import asyncio
+import functools
+import io
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytz
+
+from config.config import ImagingConfig, load_config
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".heic", ".tiff", ".bmp")
+
+OUTPUT_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp"}
+
+# Имена полей как у ExifTool -> теги EXIF IFD (DateTimeOriginal, DateTimeDigitized)
+HEIC_EXIF_FIELDS = {
+    "DateTimeOriginal": 36867,
+    "CreateDate": 36868,
+}
+
+
+@functools.cache
+def load_imaging() -> SimpleNamespace:
+    """Импортирует PIL, piexif и pillow-heif и регистрирует HEIF opener.
+
+    Выполняется один раз на процесс: в рабочих процессах пула — при их
+    старте, в основном процессе бота тяжелый стек не загружается вовсе.
+    """
+    started = time.perf_counter()
+
+    import piexif
+    import pillow_heif
+    from PIL import Image, ImageOps
+
+    pillow_heif.register_heif_opener()
+
+    logger.info(
+        "Модули обработки изображений загружены за %.3fс (pid=%s)",
+        time.perf_counter() - started,
+        os.getpid(),
+    )
+    return SimpleNamespace(
+        Image=Image, ImageOps=ImageOps, piexif=piexif, pillow_heif=pillow_heif
+    )
+
+
+def warm_up_worker() -> None:
+    load_imaging()
+
+
+class PhotoRejectedError(Exception):
+    """Файл отклонен проверкой; текст исключения показывается пользователю."""
+
+
+class ImagePoolBusyError(PhotoRejectedError):
+    """Очередь обработки изображений переполнена."""
+
+
+@dataclass
+class PhotoResult:
+    valid: bool
+    filename: str
+    data: bytes | None = None
+    needs_metadata: bool = False
+    needs_conversion: bool = False
+    phash: int | None = None
+    # Этапы в рабочем процессе: (этап, секунды, ok/rejected/error)
+    stages: list[tuple[str, float, str]] = field(default_factory=list)
+
+
+def _timed(stages: list, stage: str, fn, *args, check=None):
+    """Вызывает `fn` и записывает время этапа; `check` решает, отклонен ли результат."""
+    started = time.perf_counter()
+    try:
+        result = fn(*args)
+    except Exception:
+        stages.append((stage, time.perf_counter() - started, "error"))
+        raise
+    outcome = "rejected" if check is not None and not check(result) else "ok"
+    stages.append((stage, time.perf_counter() - started, outcome))
+    return result
+
+
+def get_heic_metadata(data: bytes, filename: str) -> dict | None:
+    logger.info("Получение метаданных HEIC: %s", filename)
+
+    imaging = load_imaging()
+    piexif = imaging.piexif
+
+    try:
+        heif_file = imaging.pillow_heif.open_heif(
+            io.BytesIO(data), convert_hdr_to_8bit=False
+        )
+        exif_bytes = heif_file.info.get("exif")
+        if not exif_bytes:
+            logger.info("EXIF в HEIC не найден через pillow-heif: %s", filename)
+            return None
+
+        exif_dict = piexif.load(exif_bytes)
+        metadata = {
+            name: exif_dict["Exif"][tag].decode("utf-8")
+            for name, tag in HEIC_EXIF_FIELDS.items()
+            if tag in exif_dict.get("Exif", {})
+        }
+        if not metadata:
+            return None
+
+        logger.info("Метаданные HEIC прочитаны через pillow-heif: %s", metadata)
+        return metadata
+
+    except Exception as e:
+        logger.warning("Pillow-heif не смог прочитать EXIF из HEIC: %s", e)
+        return None
+
+
+def check_photo_creation_time(
+    data: bytes, filename: str, heic_metadata: dict | None = None
+) -> bool:
+    file_path = filename
+    logger.info("Проверка времени создания фото: %s", file_path)
+
+    imaging = load_imaging()
+    piexif = imaging.piexif
+
+    try:
+        file_extension = os.path.splitext(filename.lower())[1]
+        user_timezone = pytz.timezone("Asia/Bishkek")
+        logger.info("Расширение файла: %s", file_extension)
+
+        if file_extension == ".heic":
+            logger.info("Обработка HEIC файла")
+            metadata = heic_metadata or get_heic_metadata(data, filename)
+            if not metadata:
+                logger.warning("Метаданные отсутствуют в HEIC файле: %s", file_path)
+                return False
+
+            date_time_str = None
+            for field in ["DateTimeOriginal", "CreateDate"]:
+                if field in metadata and metadata[field]:
+                    date_time_str = metadata[field]
+                    logger.info("Найдено поле времени %s: %s", field, date_time_str)
+                    break
+
+            if not date_time_str:
+                logger.warning(
+                    "Данные о времени создания отсутствуют в HEIC: %s", file_path
+                )
+                return False
+
+            match = re.match(
+                r"(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})", date_time_str
+            )
+            if not match:
+                logger.warning("Неизвестный формат даты в HEIC: %s", date_time_str)
+                return False
+
+            year, month, day, hour, minute, second = map(int, match.groups())
+            photo_time_naive = datetime(year, month, day, hour, minute, second)
+            photo_time = user_timezone.localize(photo_time_naive)
+
+            current_time = datetime.now(user_timezone)
+            time_diff = current_time - photo_time
+
+            logger.info(
+                "HEIC: время фото=%s, текущее время=%s, разница=%s",
+                photo_time,
+                current_time,
+                time_diff,
+            )
+            result = time_diff <= timedelta(minutes=10)
+            logger.info("Результат проверки времени HEIC: %s", result)
+            return result
+
+        else:
+            logger.info("Обработка обычного изображения")
+            try:
+                img = imaging.Image.open(io.BytesIO(data))
+
+                if not img.info.get("exif"):
+                    logger.warning(
+                        "EXIF данные отсутствуют в изображении: %s", file_path
+                    )
+                    return False
+
+                exif_dict = piexif.load(img.info["exif"])
+                date_time_str = None
+
+                if (
+                    "Exif" in exif_dict
+                    and piexif.ExifIFD.DateTimeOriginal in exif_dict["Exif"]
+                ):
+                    date_time_str = exif_dict["Exif"][
+                        piexif.ExifIFD.DateTimeOriginal
+                    ].decode("utf-8")
+                    logger.info(
+                        "Найдено DateTimeOriginal в Exif секции: %s", date_time_str
+                    )
+
+                elif (
+                    "Exif" in exif_dict
+                    and piexif.ExifIFD.DateTimeDigitized in exif_dict["Exif"]
+                ):
+                    date_time_str = exif_dict["Exif"][
+                        piexif.ExifIFD.DateTimeDigitized
+                    ].decode("utf-8")
+                    logger.info(
+                        "Найдено DateTimeDigitized в Exif секции: %s", date_time_str
+                    )
+
+                elif (
+                    "0th" in exif_dict and piexif.ImageIFD.DateTime in exif_dict["0th"]
+                ):
+                    date_time_str = exif_dict["0th"][piexif.ImageIFD.DateTime].decode(
+                        "utf-8"
+                    )
+                    logger.info("Найдено DateTime в 0th секции: %s", date_time_str)
+
+                if not date_time_str:
+                    logger.warning(
+                        "Данные о времени создания отсутствуют в EXIF: %s", file_path
+                    )
+                    return False
+
+                photo_time_naive = datetime.strptime(date_time_str, "%Y:%m:%d %H:%M:%S")
+                photo_time = user_timezone.localize(photo_time_naive)
+
+                current_time = datetime.now(user_timezone)
+                time_diff = current_time - photo_time
+
+                logger.info(
+                    "EXIF: время фото=%s, текущее время=%s, разница=%s",
+                    photo_time,
+                    current_time,
+                    time_diff,
+                )
+                result = time_diff <= timedelta(minutes=10)
+                logger.info("Результат проверки времени EXIF: %s", result)
+                return result
+
+            except Exception as e:
+                logger.warning("Ошибка при чтении EXIF данных: %s", e)
+                return False
+
+    except Exception as e:
+        logger.error("Ошибка при проверке времени создания файла: %s", e)
+        return False
+
+
+def convert_heic_to_jpeg(data: bytes, filename: str) -> PhotoResult:
+    """Конвертирует HEIC в JPEG; dHash считается по уже декодированному кадру."""
+    imaging = load_imaging()
+    output = io.BytesIO()
+    with imaging.Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        phash = image_dhash(imaging.ImageOps.exif_transpose(img))
+        img.save(output, "JPEG", quality=95, optimize=True)
+    return PhotoResult(
+        valid=True,
+        filename=os.path.splitext(filename)[0] + ".jpg",
+        data=output.getvalue(),
+        phash=phash,
+    )
+
+
+def compute_dhash(data: bytes) -> int | None:
+    """dHash файла, который не пережимается.
+
+    Для JPEG `draft()` декодирует сразу в уменьшенном масштабе, поэтому
+    полное изображение не распаковывается.
+    """
+    imaging = load_imaging()
+    try:
+        with imaging.Image.open(io.BytesIO(data)) as img:
+            img.draft("L", (64, 64))
+            return image_dhash(imaging.ImageOps.exif_transpose(img))
+    except Exception as e:
+        logger.warning("Не удалось вычислить хэш фото: %s", e)
+        return None
+
+
+def image_dhash(img) -> int | None:
+    """64-битный dHash по уменьшенной копии в оттенках серого.
+
+    Принимает уже декодированное изображение, чтобы не распаковывать файл
+    второй раз: сначала `reduce()` до малого размера, потом 9x8.
+    """
+    imaging = load_imaging()
+    try:
+        small = img.resize(
+            (9, 8), imaging.Image.Resampling.BILINEAR, reducing_gap=2.0
+        ).convert("L")
+        pixels = list(small.getdata())
+    except Exception as e:
+        logger.warning("Не удалось вычислить хэш фото: %s", e)
+        return None
+
+    phash = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            phash = (phash << 1) | (left > right)
+    return phash
+
+
+def _preserved_exif(img) -> bytes | None:
+    """Оставляет из EXIF только время съемки и GPS."""
+    piexif = load_imaging().piexif
+    exif_bytes = img.info.get("exif")
+    if not exif_bytes:
+        return None
+
+    try:
+        exif_dict = piexif.load(exif_bytes)
+    except Exception as e:
+        logger.warning("Не удалось прочитать EXIF для переноса: %s", e)
+        return None
+
+    exif_fields = (
+        piexif.ExifIFD.DateTimeOriginal,
+        piexif.ExifIFD.DateTimeDigitized,
+        piexif.ExifIFD.OffsetTimeOriginal,
+    )
+    preserved = {
+        "0th": {
+            tag: value
+            for tag, value in exif_dict.get("0th", {}).items()
+            if tag == piexif.ImageIFD.DateTime
+        },
+        "Exif": {
+            tag: value
+            for tag, value in exif_dict.get("Exif", {}).items()
+            if tag in exif_fields
+        },
+        "GPS": exif_dict.get("GPS") or {},
+    }
+    try:
+        return piexif.dump(preserved)
+    except Exception as e:
+        logger.warning("Не удалось записать EXIF: %s", e)
+        return None
+
+
+def normalize_image(data: bytes, filename: str, options: ImagingConfig) -> PhotoResult:
+    """Уменьшает фото до `max_edge` и пережимает в JPEG/WebP.
+
+    Если для исходного JPEG результат не меньше оригинала, `data` в
+    результате None — отправляется оригинал. dHash считается по уже
+    уменьшенному кадру.
+    """
+    imaging = load_imaging()
+    extension = OUTPUT_EXTENSIONS.get(options.output_format, ".jpg")
+    image_format = "WEBP" if extension == ".webp" else "JPEG"
+
+    with imaging.Image.open(io.BytesIO(data)) as img:
+        exif = _preserved_exif(img)
+        source_format = img.format
+        img = imaging.ImageOps.exif_transpose(img)
+        original_size = img.size
+        if options.max_edge and max(img.size) > options.max_edge:
+            img.thumbnail(
+                (options.max_edge, options.max_edge), imaging.Image.Resampling.LANCZOS
+            )
+        phash = image_dhash(img)
+
+        save_kwargs = {"quality": options.quality}
+        if exif:
+            save_kwargs["exif"] = exif
+        if image_format == "JPEG":
+            img = img.convert("RGB")
+            save_kwargs.update(optimize=True, progressive=True)
+        else:
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGB")
+            save_kwargs["method"] = 4
+
+        output = io.BytesIO()
+        img.save(output, image_format, **save_kwargs)
+
+    result = output.getvalue()
+    if source_format == image_format and len(result) >= len(data):
+        logger.info(
+            "Пережатие не уменьшило %s (%s -> %s байт), оставляем оригинал",
+            filename,
+            len(data),
+            len(result),
+        )
+        return PhotoResult(valid=True, filename=filename, phash=phash)
+
+    logger.info(
+        "Фото нормализовано: %s %sx%s -> %sx%s, %s -> %s байт",
+        filename,
+        original_size[0],
+        original_size[1],
+        img.size[0],
+        img.size[1],
+        len(data),
+        len(result),
+    )
+    return PhotoResult(
+        valid=True,
+        filename=os.path.splitext(filename)[0] + extension,
+        data=result,
+        phash=phash,
+    )
+
+
+def process_photo(
+    data: bytes,
+    filename: str,
+    heic_metadata: dict | None = None,
+    options: ImagingConfig | None = None,
+) -> PhotoResult:
+    """Проверка EXIF, конвертация HEIC и нормализация. Выполняется в пуле процессов.
+
+    Время каждого этапа возвращается в `stages`: метрики пишет основной
+    процесс, у рабочих процессов своего реестра нет.
+    """
+    stages = []
+    result = _process_photo(data, filename, heic_metadata, options, stages)
+    result.stages = stages
+    return result
+
+
+def _process_photo(
+    data: bytes,
+    filename: str,
+    heic_metadata: dict | None,
+    options: ImagingConfig | None,
+    stages: list,
+) -> PhotoResult:
+    file_extension = os.path.splitext(filename.lower())[1]
+    if file_extension not in IMAGE_EXTENSIONS:
+        return PhotoResult(valid=True, filename=filename)
+
+    if file_extension == ".heic" and heic_metadata is None:
+        heic_metadata = _timed(
+            stages, "heic_metadata", get_heic_metadata, data, filename
+        )
+        if heic_metadata is None:
+            return PhotoResult(valid=False, filename=filename, needs_metadata=True)
+
+    if not _timed(
+        stages,
+        "exif_check",
+        check_photo_creation_time,
+        data,
+        filename,
+        heic_metadata,
+        check=bool,
+    ):
+        return PhotoResult(valid=False, filename=filename)
+
+    # dHash считается по кадру, который декодирует пережатие или конвертация;
+    # отдельное декодирование (через draft) — только для файлов без пережатия.
+    if options is not None and options.normalize:
+        try:
+            return _timed(stages, "normalize", normalize_image, data, filename, options)
+        except Exception as e:
+            logger.warning("Не удалось нормализовать %s: %s", filename, e)
+
+    if file_extension == ".heic":
+        try:
+            result = _timed(
+                stages, "heic_convert", convert_heic_to_jpeg, data, filename
+            )
+            logger.info("HEIC успешно конвертирован через pillow-heif: %s", filename)
+            return result
+        except Exception as e:
+            logger.warning("Pillow-heif не сработал: %s", e)
+            return PhotoResult(valid=True, filename=filename, needs_conversion=True)
+
+    phash = _timed(stages, "dhash", compute_dhash, data)
+    return PhotoResult(valid=True, filename=filename, phash=phash)
+
+
+class ImageExecutor:
+    """Пул процессов для декодирования, проверки EXIF и кодирования JPEG.
+
+    Число задач в работе и в очереди ограничено `queue_limit`; сверх лимита
+    `run()` сразу бросает ImagePoolBusyError, а не копит очередь.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self._pool: ProcessPoolExecutor | None = None
+
+    def start(self) -> None:
+        if self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=load_imaging,
+        )
+        logger.info(
+            "Пул обработки изображений запущен: процессов=%s, очередь=%s",
+            self.workers,
+            self.queue_limit,
+        )
+
+    async def run(self, fn, *args):
+        if self._pool is None:
+            self.start()
+
+        if self.pending >= self.queue_limit:
+            logger.warning("Пул обработки изображений занят: задач=%s", self.pending)
+            raise ImagePoolBusyError(
+                "Сейчас много фото в обработке. Отправьте файл еще раз через минуту."
+            )
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._pool.submit(fn, *args)
+            # Задача освобождает место, когда ее закончил процесс, а не когда
+            # отменили ожидающий ее обработчик: процесс в это время еще занят
+            self.pending += 1
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            logger.error("Пул обработки изображений сломан, пересоздаем")
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            raise
+
+    def _release(self) -> None:
+        self.pending -= 1
+
+    async def warm_up(self) -> None:
+        """Поднимает все рабочие процессы заранее, чтобы первое фото не ждало."""
+        if self._pool is None:
+            self.start()
+
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(self._pool, warm_up_worker)
+                    for _ in range(self.workers)
+                )
+            )
+        except Exception as e:
+            logger.error("Ошибка прогрева пула обработки изображений: %s", e)
+            return
+
+        logger.info(
+            "Пул обработки изображений прогрет за %.3fс", time.perf_counter() - started
+        )
+
+    def shutdown(self) -> None:
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+        logger.info("Пул обработки изображений остановлен")
+
+
+config = load_config()
+
+image_executor = ImageExecutor(
+    workers=config.imaging.workers, queue_limit=config.imaging.queue_limit
+)
@@ -1,10 +1,143 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import sys
+import threading
 import time
+from datetime import datetime, timezone
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s",
-    handlers=[logging.StreamHandler()],
-)
-logger = logging.getLogger(__name__)
-logging.Formatter.converter = time.gmtime
+from config.config import load_config
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — один JSON-объект в строке."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "message": record.getMessage(),
+        }
+        sampled_out = getattr(record, "sampled_out", 0)
+        if sampled_out:
+            payload["sampled_out"] = sampled_out
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        sampled_out = getattr(record, "sampled_out", 0)
+        if sampled_out:
+            line += f" (пропущено похожих: {sampled_out})"
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Ограничивает число записей INFO и ниже с одной строки кода.
+
+    За окно `window` секунд с каждого места вызова проходит не больше `rate`
+    записей; число отброшенных добавляется в `sampled_out` первой записи
+    следующего окна. WARNING и выше не ограничиваются.
+    """
+
+    def __init__(self, rate: int, window: float):
+        super().__init__()
+        self.rate = rate
+        self.window = window
+        self._sites: dict[tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site is not None else 0
+                self._sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.sampled_out = suppressed
+                return True
+            if site[1] < self.rate:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладет запись в очередь с уже подставленными аргументами.
+
+    Стандартный `prepare` форматирует запись целиком; здесь в потоке
+    вызывающего остается только `getMessage()` (аргументы могут быть
+    изменяемыми объектами), а JSON и запись в поток делает слушатель.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _parse_levels(spec: str) -> dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    settings = load_config().logging
+
+    output = logging.StreamHandler(sys.stdout)
+    if settings.format == "text":
+        output.setFormatter(TextFormatter(TEXT_FORMAT))
+    else:
+        output.setFormatter(JsonFormatter())
+
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(SamplingFilter(settings.sample_rate, settings.sample_window))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(settings.level)
+    for name, level in _parse_levels(settings.levels).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(
+        handler.queue, output, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+listener = setup_logging()
+logger = get_logger(__name__)
@@ -0,0 +1,242 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from config.config import load_config
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+config = load_config()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Метрика в текстовом формате Prometheus.
+
+    Значения обновляются только из event loop, поэтому блокировки не нужны.
+    Метрика регистрируется в `registry` при создании.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def _key(self, values: tuple) -> tuple:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name}: ожидались метки {self.labels}")
+        return values
+
+    def samples(self):
+        for values, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, values)} {value:g}"
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *values, amount: float = 1) -> None:
+        key = self._key(values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *values, amount: float = 1) -> None:
+        key = self._key(values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *values, amount: float = 1) -> None:
+        self.inc(*values, amount=-amount)
+
+    @contextmanager
+    def track(self, *values):
+        self.inc(*values)
+        try:
+            yield
+        finally:
+            self.dec(*values)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *values) -> None:
+        key = self._key(values)
+        series = self._series.get(key)
+        if series is None:
+            # [счетчики корзин..., +Inf, сумма]
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *values)
+
+    def samples(self):
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1], strict=True):
+                cumulative += count
+                le = _labels(self.labels, values, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {series[-1]:g}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+registry: list[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds",
+    "Время обработки сообщения хендлером",
+    ("handler", "state"),
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total",
+    "Необработанные исключения хендлеров",
+    ("handler",),
+)
+HANDLER_IN_FLIGHT = Gauge(
+    "bot_handler_in_flight",
+    "Сообщения в обработке",
+    ("handler",),
+)
+FSM_TRANSITIONS = Counter(
+    "bot_fsm_transitions_total",
+    "Переходы между состояниями FSM",
+    ("from_state", "to_state"),
+)
+AGENT_CACHE_LOOKUPS = Counter(
+    "agent_cache_lookups_total",
+    "Поиск агента в кэше: local, redis, negative (кэшированное отсутствие), miss",
+    ("result",),
+)
+BACKEND_SECONDS = Histogram(
+    "backend_request_duration_seconds",
+    "Время запроса к веб-сервису до освобождения ответа",
+    ("endpoint", "method"),
+)
+BACKEND_REQUESTS = Counter(
+    "backend_requests_total",
+    "Запросы к веб-сервису по статусу ответа",
+    ("endpoint", "status"),
+)
+BACKEND_IN_FLIGHT = Gauge(
+    "backend_requests_in_flight",
+    "Запросы к веб-сервису в процессе",
+    ("endpoint",),
+)
+BACKEND_COALESCED = Counter(
+    "backend_coalesced_total",
+    "Запросы, дождавшиеся уже выполняющегося одинакового запроса",
+    ("endpoint",),
+)
+PHOTO_STAGE_SECONDS = Histogram(
+    "photo_stage_duration_seconds",
+    "Время этапа обработки фото",
+    ("stage",),
+)
+PHOTO_STAGES = Counter(
+    "photo_stage_total",
+    "Этапы обработки фото по результату",
+    ("stage", "result"),
+)
+
+
+@contextmanager
+def photo_stage(stage: str, rejected: tuple[type[Exception], ...] = ()):
+    """Замеряет этап обработки фото: ok, rejected (ожидаемый отказ) или error."""
+    started = time.perf_counter()
+    result = "cancelled"
+    try:
+        yield
+        result = "ok"
+    except rejected:
+        result = "rejected"
+        raise
+    except Exception:
+        result = "error"
+        raise
+    finally:
+        PHOTO_STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+        PHOTO_STAGES.inc(stage, result)
+
+
+def observe_photo_stages(stages: list[tuple[str, float, str]]) -> None:
+    """Записывает этапы, замеренные в рабочем процессе пула изображений."""
+    for stage, seconds, result in stages:
+        PHOTO_STAGE_SECONDS.observe(seconds, stage)
+        PHOTO_STAGES.inc(stage, result)
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server() -> web.AppRunner | None:
+    settings = config.metrics
+    if not settings.enabled:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, settings.host, settings.port).start()
+    logger.info(
+        "Метрики доступны на http://%s:%s/metrics", settings.host, settings.port
+    )
+    return runner
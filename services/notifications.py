@@ -1,29 +1,38 @@
-import os
-
-import aiohttp
 import pytz
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
-from services.logger import logger
+from config.config import load_config
+from handlers.utils import get_store_id_by_name
+from services.backend import backend_client
+from services.cache import agent_cache
+from services.logger import get_logger
+from services.outbox import outbox
+from services.store_index import store_index
 
+logger = get_logger(__name__)
 
-async def send_daily_plans_post_request():
-    api_url = f"{os.getenv('WEB_SERVICE_URL')}/api/record-daily-plans/"
+config = load_config()
 
+
+async def send_daily_plans_post_request():
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url) as response:
-                if response.status == 201:
-                    data = await response.json()
-                    logger.info(f"Daily plans created successfully: {data}")
-                else:
-                    error_text = await response.text()
-                    logger.error(
-                        f"Failed to create daily plans. Status: {response.status}, Response: {error_text}"
-                    )
+        async with backend_client.post(
+            "/api/record-daily-plans/", endpoint="daily_plans"
+        ) as response:
+            if response.status == 201:
+                data = await response.json()
+                logger.info("Daily plans created successfully: %s", data)
+            else:
+                error_text = await response.text()
+                logger.error(
+                    "Failed to create daily plans. Status: %s, Response: %s",
+                    response.status,
+                    error_text,
+                )
     except Exception as e:
-        logger.error(f"Error while posting daily plans: {e}")
+        logger.error("Error while posting daily plans: %s", e)
 
 
 def setup_scheduler(bot):
@@ -34,6 +43,35 @@ def setup_scheduler(bot):
         CronTrigger(hour="13", minute="30"),
     )
 
+    scheduler.add_job(
+        store_index.refresh,
+        IntervalTrigger(minutes=config.store_index.refresh_minutes),
+        args=[get_store_id_by_name],
+        max_instances=1,
+        coalesce=True,
+    )
+
+    scheduler.add_job(
+        outbox.log_stats,
+        IntervalTrigger(minutes=5),
+        max_instances=1,
+        coalesce=True,
+    )
+
+    scheduler.add_job(
+        agent_cache.log_stats,
+        IntervalTrigger(minutes=5),
+        max_instances=1,
+        coalesce=True,
+    )
+
+    scheduler.add_job(
+        backend_client.log_stats,
+        IntervalTrigger(minutes=5),
+        max_instances=1,
+        coalesce=True,
+    )
+
     logger.info(
         "Планировщик настроен для ежемесячных уведомлений и ежедневной отправки планов"
     )
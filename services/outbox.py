@@ -0,0 +1,558 @@
+import asyncio
+import json
+import mimetypes
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+
+import aiohttp
+
+from config.config import OutboxConfig, load_config
+from config.redis_connect import redis_client
+from services.backend import backend_client
+from services.logger import get_logger
+from services.metrics import photo_stage
+from services.photo_hashes import photo_hashes
+
+logger = get_logger(__name__)
+
+PHOTO_POSTS_URL = "/api/photo-posts/create/"
+
+# Ответы, после которых повтор имеет смысл; остальные 4xx сразу уходят в
+# dead-letter, повтор того же запроса их не исправит.
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Воркер ставит аренду отдельным запросом сразу после BLMOVE. Задача без
+# аренды дольше этого времени считается потерянной (воркер упал между
+# запросами) и возвращается в очередь.
+ORPHAN_GRACE = 10
+
+
+class BlobPayload(aiohttp.payload.AsyncIterablePayload):
+    """Фото из Redis частями с заранее известным размером.
+
+    Размер берется из STRLEN, поэтому запрос уходит с Content-Length, а не
+    chunked-передачей: ее принимают не все WSGI-бэкенды.
+    """
+
+    def __init__(self, value, size: int, **kwargs):
+        super().__init__(value, **kwargs)
+        self._size = size
+
+
+class DeliveryError(Exception):
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class Outbox:
+    """Очередь отправки постов в веб-сервис через Redis.
+
+    Обработчик кладет задачу (поля поста и фото отдельным ключом) и сразу
+    отвечает пользователю, доставкой занимаются фоновые воркеры. Ключи:
+    `{prefix}:jobs` — хэш задач по id, `{prefix}:queue` — очередь id,
+    `{prefix}:processing` и `{prefix}:leases` — задачи в работе со сроком
+    аренды, `{prefix}:delayed` — отложенные повторы, `{prefix}:dead` —
+    задачи, исчерпавшие попытки. Задача с истекшей арендой (воркер упал)
+    возвращается в очередь; повторная отправка безопасна благодаря
+    заголовку `Idempotency-Key` с id задачи.
+    """
+
+    def __init__(self, redis, config: OutboxConfig, prefix: str = "outbox"):
+        self.redis = redis
+        self.config = config
+        self.prefix = prefix
+        self.bot = None
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self._latencies: deque[float] = deque(maxlen=1000)
+        self._tasks: list[asyncio.Task] = []
+        self._progress: dict[str, asyncio.Task] = {}
+        self._orphans: dict[bytes, float] = {}
+        self._stopping = asyncio.Event()
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    def _blob_key(self, job_id: str) -> str:
+        return f"{self.prefix}:blob:{job_id}"
+
+    def _new_job(
+        self,
+        fields: dict,
+        photo: bytes | None,
+        filename: str | None,
+        chat_id: int | None,
+        message_id: int | None,
+        dedup: dict | None = None,
+    ) -> dict:
+        return {
+            "id": uuid.uuid4().hex,
+            "fields": {k: v for k, v in fields.items() if v is not None},
+            "filename": filename,
+            "content_type": (mimetypes.guess_type(filename)[0] if filename else None),
+            "has_photo": photo is not None,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "dedup": dedup,
+            "attempts": 0,
+            "enqueued_at": time.time(),
+        }
+
+    def _push(self, pipe, job: dict, photo: bytes | None) -> None:
+        if photo is not None:
+            pipe.set(self._blob_key(job["id"]), photo, ex=self.config.blob_ttl)
+        pipe.hset(self._key("jobs"), job["id"], json.dumps(job, ensure_ascii=False))
+        pipe.lpush(self._key("queue"), job["id"])
+
+    async def enqueue(
+        self,
+        fields: dict,
+        photo: bytes | None = None,
+        filename: str | None = None,
+        chat_id: int | None = None,
+        message_id: int | None = None,
+        dedup: dict | None = None,
+    ) -> str:
+        """Ставит пост в очередь.
+
+        `dedup` — запись `PhotoHashIndex.entry`, она снимается из индекса
+        дубликатов, если пост попадет в dead-letter.
+        """
+        job = self._new_job(fields, photo, filename, chat_id, message_id, dedup)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._push(pipe, job, photo)
+            await pipe.execute()
+
+        logger.info(
+            "Пост поставлен в очередь отправки: id=%s, файл=%s, размер=%s байт",
+            job["id"],
+            filename,
+            len(photo) if photo is not None else 0,
+        )
+        return job["id"]
+
+    async def enqueue_batch(
+        self,
+        items: list[tuple[dict, bytes, str, dict | None]],
+        chat_id: int | None = None,
+        message_id: int | None = None,
+        note: str | None = None,
+    ) -> str:
+        """Ставит пачку фото (поля, содержимое, имя файла, dedup) одной транзакцией.
+
+        Все задачи пачки обновляют одно сообщение о статусе: счетчики
+        доставленных и неудачных хранятся в `{prefix}:batch:{id}`, `note`
+        дописывается к каждому обновлению.
+        """
+        batch_id = uuid.uuid4().hex
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for fields, photo, filename, dedup in items:
+                job = self._new_job(fields, photo, filename, chat_id, message_id, dedup)
+                job["batch"] = batch_id
+                job["batch_size"] = len(items)
+                job["batch_note"] = note
+                self._push(pipe, job, photo)
+            await pipe.execute()
+
+        logger.info(
+            "Пачка из %s фото поставлена в очередь отправки: batch=%s, размер=%s байт",
+            len(items),
+            batch_id,
+            sum(len(item[1]) for item in items),
+        )
+        return batch_id
+
+    def start(self, bot=None) -> None:
+        if self._tasks:
+            return
+        self.bot = bot
+        self._stopping.clear()
+        self._tasks = [
+            asyncio.create_task(self._worker(n)) for n in range(self.config.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._promoter()))
+        logger.info(
+            "Очередь отправки постов запущена: воркеров=%s", self.config.workers
+        )
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Дает воркерам закончить текущие отправки, затем отменяет их."""
+        if not self._tasks:
+            return
+        self._stopping.set()
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for job_id in list(self._progress):
+            await self._finish_progress(job_id)
+        self._tasks = []
+        logger.info("Очередь отправки постов остановлена")
+
+    async def _worker(self, number: int) -> None:
+        while not self._stopping.is_set():
+            try:
+                job_id = await self.redis.blmove(
+                    self._key("queue"),
+                    self._key("processing"),
+                    1,
+                    src="RIGHT",
+                    dest="LEFT",
+                )
+                if job_id is None:
+                    continue
+                job_id = job_id.decode()
+                await self.redis.zadd(
+                    self._key("leases"),
+                    {job_id: time.time() + self.config.lease_timeout},
+                )
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка воркера очереди отправки #%s: %s", number, e)
+                await asyncio.sleep(1)
+
+    async def _process(self, job_id: str) -> None:
+        raw = await self.redis.hget(self._key("jobs"), job_id)
+        if raw is None:
+            logger.warning("Задача %s не найдена, удаляем из обработки", job_id)
+            await self._release(job_id)
+            return
+
+        job = json.loads(raw)
+        job["attempts"] += 1
+        try:
+            # Посты без фото (данные конкурентов/ДМП) в этап upload не входят
+            with photo_stage("upload") if job["has_photo"] else nullcontext():
+                await self._deliver(job)
+        except Exception as e:
+            # Прочие ошибки (Redis, сборка запроса) тоже расходуют попытку:
+            # иначе счетчик не сохранится и задача никогда не попадет в dead
+            if isinstance(e, DeliveryError):
+                retryable, error = e.retryable, str(e)
+            else:
+                retryable, error = True, f"{type(e).__name__}: {e}"
+            if retryable and job["attempts"] < self.config.max_attempts:
+                await self._retry(job, error)
+            else:
+                await self._bury(job, error)
+            return
+
+        latency = time.time() - job["enqueued_at"]
+        self._latencies.append(latency)
+        self.delivered += 1
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self._key("processing"), 0, job_id)
+            pipe.zrem(self._key("leases"), job_id)
+            pipe.hdel(self._key("jobs"), job_id)
+            pipe.delete(self._blob_key(job_id))
+            await pipe.execute()
+
+        logger.info(
+            "Пост %s доставлен: попытка %s, задержка %.1fс",
+            job_id,
+            job["attempts"],
+            latency,
+        )
+        if job.get("batch"):
+            await self._notify_batch(job, "delivered")
+        elif job.get("message_id") is not None:
+            await self._notify(job, "✅ Файл успешно сохранен")
+
+    async def _deliver(self, job: dict) -> None:
+        headers = {"Idempotency-Key": job["id"]}
+
+        if job["has_photo"]:
+            size = await self.redis.strlen(self._blob_key(job["id"]))
+            if not size:
+                raise DeliveryError("Фото задачи истекло в Redis", retryable=False)
+            form_data = aiohttp.FormData()
+            for key, value in job["fields"].items():
+                form_data.add_field(key, str(value))
+            form_data.add_field(
+                "image",
+                # FormData не меняет заголовки готового Payload, тип задается в нем
+                BlobPayload(
+                    self._stream_blob(job, size),
+                    size,
+                    content_type=job.get("content_type") or "application/octet-stream",
+                ),
+                filename=job["filename"],
+            )
+            kwargs = {"data": form_data}
+        else:
+            kwargs = {"json": job["fields"]}
+
+        try:
+            async with backend_client.post(
+                PHOTO_POSTS_URL, endpoint="photo_posts", headers=headers, **kwargs
+            ) as response:
+                response_text = await response.text()
+                if response.status == 201:
+                    return
+                raise DeliveryError(
+                    f"статус {response.status}: {response_text[:500]}",
+                    retryable=response.status in RETRYABLE_STATUSES,
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DeliveryError(f"{type(e).__name__}: {e}", retryable=True) from e
+        finally:
+            await self._finish_progress(job["id"])
+
+    async def _stream_blob(self, job: dict, size: int):
+        """Отдает фото из Redis частями через GETRANGE.
+
+        Тело запроса уходит без копии файла в памяти воркера. Для больших
+        одиночных фото сообщение о статусе обновляется на 25/50/75%: правка
+        отправляется фоновой задачей и не задерживает загрузку, а по
+        окончании отправки отменяется, чтобы не затереть итоговый статус.
+        """
+        key = self._blob_key(job["id"])
+        chunk_size = self.config.upload_chunk_size
+        report = (
+            job.get("message_id") is not None
+            and not job.get("batch")
+            and size >= self.config.progress_min_size
+        )
+        reported = 0
+
+        for start in range(0, size, chunk_size):
+            chunk = await self.redis.getrange(key, start, start + chunk_size - 1)
+            yield chunk
+
+            if report:
+                percent = (start + len(chunk)) * 100 // size
+                if percent < 100 and percent - reported >= 25:
+                    reported = percent - percent % 25
+                    self._report_progress(job, f"📤 Отправка файла: {reported}%")
+
+    def _report_progress(self, job: dict, text: str) -> None:
+        task = self._progress.get(job["id"])
+        if task is not None and not task.done():
+            # Предыдущая правка еще отправляется, эту пропускаем
+            return
+        self._progress[job["id"]] = asyncio.create_task(self._notify(job, text))
+
+    async def _finish_progress(self, job_id: str) -> None:
+        task = self._progress.pop(job_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(
+            self.config.backoff_max, self.config.backoff_base * 2 ** (attempts - 1)
+        )
+        return delay * random.uniform(0.5, 1)
+
+    async def _retry(self, job: dict, error: str) -> None:
+        delay = self._backoff(job["attempts"])
+        self.retried += 1
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key("jobs"), job["id"], json.dumps(job, ensure_ascii=False))
+            pipe.lrem(self._key("processing"), 0, job["id"])
+            pipe.zrem(self._key("leases"), job["id"])
+            pipe.zadd(self._key("delayed"), {job["id"]: time.time() + delay})
+            await pipe.execute()
+
+        logger.warning(
+            "Пост %s не доставлен (попытка %s): %s. Повтор через %.1fс",
+            job["id"],
+            job["attempts"],
+            error,
+            delay,
+        )
+
+    async def _bury(self, job: dict, error: str) -> None:
+        job["error"] = error
+        job["failed_at"] = time.time()
+        self.dead += 1
+
+        # Фото остается в Redis до истечения blob_ttl, чтобы задачу можно было
+        # переотправить вручную из dead-letter.
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lpush(self._key("dead"), json.dumps(job, ensure_ascii=False))
+            pipe.hdel(self._key("jobs"), job["id"])
+            pipe.lrem(self._key("processing"), 0, job["id"])
+            pipe.zrem(self._key("leases"), job["id"])
+            await pipe.execute()
+
+        logger.error(
+            "Пост %s перемещен в dead-letter после %s попыток: %s",
+            job["id"],
+            job["attempts"],
+            error,
+        )
+        if job.get("dedup"):
+            # Иначе повторная отправка того же фото была бы отклонена как дубликат
+            await photo_hashes.remove(job["dedup"])
+        if job.get("batch"):
+            await self._notify_batch(job, "failed")
+            return
+
+        what = "файл" if job["has_photo"] else "данные"
+        await self._notify(
+            job, f"❌ Не удалось сохранить {what} в системе. Отправьте еще раз."
+        )
+
+    async def _release(self, job_id: str) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self._key("processing"), 0, job_id)
+            pipe.zrem(self._key("leases"), job_id)
+            await pipe.execute()
+
+    async def _notify(self, job: dict, text: str) -> None:
+        if self.bot is None or job.get("chat_id") is None:
+            return
+        try:
+            if job.get("message_id") is not None:
+                await self.bot.edit_message_text(
+                    text, chat_id=job["chat_id"], message_id=job["message_id"]
+                )
+            else:
+                await self.bot.send_message(job["chat_id"], text)
+        except Exception as e:
+            logger.warning("Не удалось уведомить о посте %s: %s", job["id"], e)
+
+    async def _notify_batch(self, job: dict, outcome: str) -> None:
+        key = self._key(f"batch:{job['batch']}")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, outcome, 1)
+            pipe.expire(key, self.config.blob_ttl)
+            pipe.hgetall(key)
+            _, _, counters = await pipe.execute()
+
+        delivered = int(counters.get(b"delivered", 0))
+        failed = int(counters.get(b"failed", 0))
+        total = job["batch_size"]
+
+        if delivered + failed < total:
+            text = f"📤 Сохранено {delivered} из {total} файлов..."
+        elif failed:
+            text = (
+                f"⚠️ Сохранено {delivered} из {total} файлов, "
+                f"не удалось сохранить: {failed}. Отправьте их еще раз."
+            )
+        else:
+            text = f"✅ Все файлы сохранены ({total})"
+        if job.get("batch_note"):
+            text = f"{text}\n{job['batch_note']}"
+        await self._notify(job, text)
+
+    async def _promoter(self) -> None:
+        """Переносит наступившие повторы и задачи с истекшей арендой в очередь.
+
+        ZREM выполняется перед переносом и служит захватом: при нескольких
+        репликах задачу переносит только одна. Задачи в processing без аренды
+        тоже возвращаются в очередь, см. `_reclaim_orphans`.
+        """
+        while not self._stopping.is_set():
+            try:
+                now = time.time()
+                for name in ("delayed", "leases"):
+                    due = await self.redis.zrangebyscore(
+                        self._key(name), "-inf", now, start=0, num=100
+                    )
+                    for job_id in due:
+                        if not await self.redis.zrem(self._key(name), job_id):
+                            continue
+                        async with self.redis.pipeline(transaction=True) as pipe:
+                            if name == "leases":
+                                logger.warning(
+                                    "Аренда поста %s истекла, возвращаем в очередь",
+                                    job_id.decode(),
+                                )
+                                pipe.lrem(self._key("processing"), 0, job_id)
+                            pipe.lpush(self._key("queue"), job_id)
+                            await pipe.execute()
+                await self._reclaim_orphans()
+            except Exception as e:
+                logger.error("Ошибка переноса отложенных постов: %s", e)
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _reclaim_orphans(self) -> None:
+        """Возвращает в очередь задачи, оставшиеся в processing без аренды.
+
+        Такое бывает, если воркер упал или был отменен между BLMOVE и ZADD
+        аренды, либо промоутер — между ZREM аренды и переносом. Задача
+        считается потерянной, если ее аренды нет на каждом проходе дольше
+        ORPHAN_GRACE секунд; захватом служит ключ `{prefix}:reclaim:{id}`.
+        """
+        processing = await self.redis.lrange(self._key("processing"), 0, -1)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for job_id in processing:
+                pipe.zscore(self._key("leases"), job_id)
+            leases = await pipe.execute()
+
+        now = time.monotonic()
+        seen, self._orphans = self._orphans, {}
+        for job_id, lease in zip(processing, leases, strict=True):
+            if lease is not None:
+                continue
+            since = self._orphans[job_id] = seen.get(job_id, now)
+            if now - since < ORPHAN_GRACE:
+                continue
+            claim = self._key(f"reclaim:{job_id.decode()}")
+            if not await self.redis.set(claim, 1, nx=True, ex=ORPHAN_GRACE * 6):
+                continue
+
+            logger.warning(
+                "Пост %s в обработке без аренды, возвращаем в очередь",
+                job_id.decode(),
+            )
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(self._key("processing"), 0, job_id)
+                pipe.lpush(self._key("queue"), job_id)
+                await pipe.execute()
+            del self._orphans[job_id]
+
+    async def stats(self) -> dict:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.llen(self._key("queue"))
+            pipe.llen(self._key("processing"))
+            pipe.zcard(self._key("delayed"))
+            pipe.llen(self._key("dead"))
+            queued, processing, delayed, dead = await pipe.execute()
+
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float | None:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        return {
+            "queued": queued,
+            "processing": processing,
+            "delayed": delayed,
+            "dead": dead,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.dead,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+        }
+
+    async def log_stats(self) -> None:
+        try:
+            logger.info("Очередь отправки постов: %s", await self.stats())
+        except Exception as e:
+            logger.error("Не удалось получить статистику очереди отправки: %s", e)
+
+
+config = load_config()
+
+outbox = Outbox(redis_client, config.outbox)
@@ -0,0 +1,37 @@
+import io
+import os
+
+
+class PhotoBuffer:
+    """Содержимое фото в памяти от скачивания до постановки в очередь.
+
+    Файл целиком лежит в `BytesIO` и ни разу не касается диска: из этого же
+    буфера читаются EXIF, пул обработки и очередь отправки. Память
+    ограничена PHOTO_MAX_FILE_SIZE_MB, который проверяется при скачивании.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.size = 0
+        self.phash: int | None = None
+        self._file = io.BytesIO()
+
+    @classmethod
+    def from_bytes(cls, filename: str, data: bytes) -> "PhotoBuffer":
+        buffer = cls(filename)
+        buffer.write(data)
+        return buffer
+
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.filename.lower())[1]
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def getvalue(self) -> bytes:
+        return self._file.getvalue()
+
+    def close(self) -> None:
+        self._file.close()
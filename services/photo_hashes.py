@@ -0,0 +1,126 @@
+from config.config import load_config
+from config.redis_connect import redis_client
+from services.logger import get_logger
+from services.schedule_cache import local_day, next_local_midnight
+
+logger = get_logger(__name__)
+
+# 64-битный dHash делится на 4 полосы по 16 бит. Если хэши отличаются не
+# больше чем в 3 битах, хотя бы одна полоса совпадает целиком, поэтому
+# кандидатов достаточно искать по точному совпадению полос.
+BANDS = 4
+BAND_BITS = 64 // BANDS
+MAX_DISTANCE = BANDS - 1
+
+
+def hash_bands(phash: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(phash >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+class PhotoHashIndex:
+    """Индекс перцептивных хэшей фото магазина за текущие сутки.
+
+    Для каждой полосы хэша хранится множество
+    `{prefix}:{store_id}:{day}:{band}:{value}` с полными хэшами, поэтому
+    поиск — это 4 SMEMBERS по маленьким множествам независимо от числа
+    загруженных фото. Отдельное множество `{prefix}:{store_id}:{day}:files`
+    хранит file_unique_id Telegram: повторно отправленный тот же файл
+    отклоняется еще до скачивания. Все ключи живут до локальной полуночи.
+
+    Фото записывается до постановки в очередь отправки (`entry` уходит в
+    задачу), чтобы повтор отклонялся и пока пост доставляется. Если задача
+    попадает в dead-letter, очередь вызывает `remove` и фото можно
+    отправить снова.
+    """
+
+    def __init__(self, redis, max_distance: int, prefix: str = "phash"):
+        self.redis = redis
+        self.max_distance = min(max_distance, MAX_DISTANCE)
+        self.prefix = prefix
+
+    def _base(self, store_id, day: str | None = None) -> str:
+        return f"{self.prefix}:{store_id}:{day or local_day()}"
+
+    def _band_keys(self, store_id, phash: int, day: str | None = None) -> list[str]:
+        base = self._base(store_id, day)
+        return [
+            f"{base}:{band}:{value:04x}" for band, value in enumerate(hash_bands(phash))
+        ]
+
+    async def seen_file(self, store_id, file_unique_id: str) -> bool:
+        try:
+            return bool(
+                await self.redis.sismember(
+                    f"{self._base(store_id)}:files", file_unique_id
+                )
+            )
+        except Exception as e:
+            logger.error("Ошибка проверки повторного файла в Redis: %s", e)
+            return False
+
+    async def find_duplicate(self, store_id, phash: int) -> int | None:
+        if self.max_distance < 0:
+            return None
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in self._band_keys(store_id, phash):
+                    pipe.smembers(key)
+                buckets = await pipe.execute()
+        except Exception as e:
+            logger.error("Ошибка поиска дубликата фото в Redis: %s", e)
+            return None
+
+        for bucket in buckets:
+            for raw in bucket:
+                candidate = int(raw)
+                if (candidate ^ phash).bit_count() <= self.max_distance:
+                    return candidate
+        return None
+
+    @staticmethod
+    def entry(store_id, phash: int | None, file_unique_id: str | None) -> dict:
+        return {
+            "store_id": store_id,
+            "day": local_day(),
+            "phash": phash,
+            "file_unique_id": file_unique_id,
+        }
+
+    async def add(self, entry: dict) -> None:
+        store_id, day = entry["store_id"], entry["day"]
+        expire_at = next_local_midnight()
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if entry["phash"] is not None:
+                    for key in self._band_keys(store_id, entry["phash"], day):
+                        pipe.sadd(key, entry["phash"])
+                        pipe.expireat(key, expire_at)
+                if entry["file_unique_id"]:
+                    files_key = f"{self._base(store_id, day)}:files"
+                    pipe.sadd(files_key, entry["file_unique_id"])
+                    pipe.expireat(files_key, expire_at)
+                await pipe.execute()
+        except Exception as e:
+            logger.error("Ошибка сохранения хэша фото в Redis: %s", e)
+
+    async def remove(self, entry: dict) -> None:
+        store_id, day = entry["store_id"], entry["day"]
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if entry["phash"] is not None:
+                    for key in self._band_keys(store_id, entry["phash"], day):
+                        pipe.srem(key, entry["phash"])
+                if entry["file_unique_id"]:
+                    pipe.srem(
+                        f"{self._base(store_id, day)}:files", entry["file_unique_id"]
+                    )
+                await pipe.execute()
+        except Exception as e:
+            logger.error("Ошибка удаления хэша фото из Redis: %s", e)
+
+
+config = load_config()
+
+photo_hashes = PhotoHashIndex(redis_client, config.photo.duplicate_distance)
@@ -0,0 +1,93 @@
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import pytz
+
+from config.redis_connect import redis_client
+from services.cache import MISSING, LRUCache
+from services.geofence import StoreGeoIndex
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+TIMEZONE = pytz.timezone("Asia/Bishkek")
+
+
+@dataclass
+class DaySchedule:
+    stores: list[dict]
+    store_names: frozenset[str] = field(init=False)
+    geo: StoreGeoIndex = field(init=False)
+
+    def __post_init__(self):
+        self.store_names = frozenset(store["name"] for store in self.stores)
+        self.geo = StoreGeoIndex(self.stores)
+
+
+def local_day() -> str:
+    return datetime.now(TIMEZONE).strftime("%Y-%m-%d")
+
+
+def next_local_midnight() -> datetime:
+    now = datetime.now(TIMEZONE)
+    tomorrow = (now + timedelta(days=1)).date()
+    return TIMEZONE.localize(datetime.combine(tomorrow, datetime.min.time()))
+
+
+class ScheduleCache:
+    """Расписание агента на текущие сутки (Asia/Bishkek), общее для воркеров.
+
+    Записи живут в Redis до локальной полуночи; процессный LRU хранит уже
+    разобранное расписание с множеством названий магазинов.
+    """
+
+    def __init__(self, redis, maxsize: int = 10000, prefix: str = "schedule"):
+        self.redis = redis
+        self.prefix = prefix
+        self.local = LRUCache(maxsize, ttl=24 * 3600)
+
+    def _key(self, phone_number: str, day: str) -> str:
+        return f"{self.prefix}:{phone_number}:{day}"
+
+    async def get(self, phone_number: str):
+        day = local_day()
+        value = self.local.get((phone_number, day))
+        if value is not MISSING:
+            return value
+
+        try:
+            raw = await self.redis.get(self._key(phone_number, day))
+        except Exception as e:
+            logger.error("Ошибка чтения расписания %s из Redis: %s", phone_number, e)
+            return MISSING
+
+        if raw is None:
+            return MISSING
+
+        value = DaySchedule(json.loads(raw))
+        self._set_local(phone_number, day, value)
+        return value
+
+    async def set(self, phone_number: str, stores: list[dict]) -> DaySchedule:
+        day = local_day()
+        value = DaySchedule(stores)
+        self._set_local(phone_number, day, value)
+
+        key = self._key(phone_number, day)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.set(key, json.dumps(stores, ensure_ascii=False))
+                pipe.expireat(key, next_local_midnight())
+                await pipe.execute()
+        except Exception as e:
+            logger.error("Ошибка записи расписания %s в Redis: %s", phone_number, e)
+
+        return value
+
+    def _set_local(self, phone_number: str, day: str, value: DaySchedule) -> None:
+        ttl = (next_local_midnight() - datetime.now(TIMEZONE)).total_seconds()
+        self.local.set((phone_number, day), value, ttl=ttl)
+
+
+schedule_cache = ScheduleCache(redis_client)
@@ -0,0 +1,137 @@
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from config.redis_connect import redis_client
+from services.cache import MISSING, LRUCache
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def normalize_store_name(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+class StoreIndex:
+    """Индекс «нормализованное название магазина → id» в Redis с версиями.
+
+    Текущая версия хранится в ключе `{prefix}:version`, записи — в хэше
+    `{prefix}:v{version}`. Фоновое обновление собирает новую версию целиком и
+    переключает указатель, так что читатели никогда не видят полупустой индекс.
+    """
+
+    def __init__(
+        self,
+        redis,
+        prefix: str = "stores",
+        version_ttl: float = 30,
+        old_version_ttl: int = 3600,
+        refresh_concurrency: int = 10,
+    ):
+        self.redis = redis
+        self.prefix = prefix
+        self.old_version_ttl = old_version_ttl
+        self.refresh_concurrency = refresh_concurrency
+        self.local = LRUCache(maxsize=10000, ttl=300)
+        self._version_cache = LRUCache(maxsize=1, ttl=version_ttl)
+
+    @property
+    def version_key(self) -> str:
+        return f"{self.prefix}:version"
+
+    def _hash_key(self, version: int) -> str:
+        return f"{self.prefix}:v{version}"
+
+    async def version(self) -> int:
+        version = self._version_cache.get("version")
+        if version is MISSING:
+            raw = await self.redis.get(self.version_key)
+            version = int(raw) if raw else 0
+            self._version_cache.set("version", version)
+        return version
+
+    async def get(self, name: str):
+        key = normalize_store_name(name)
+        version = await self.version()
+
+        value = self.local.get((version, key))
+        if value is not MISSING:
+            return value
+
+        raw = await self.redis.hget(self._hash_key(version), key)
+        if raw is None:
+            return MISSING
+
+        value = json.loads(raw)
+        self.local.set((version, key), value)
+        return value
+
+    async def add_many(self, stores: list[dict]) -> int:
+        entries = {
+            normalize_store_name(store["name"]): json.dumps(
+                {"id": store["id"], "name": store["name"]}, ensure_ascii=False
+            )
+            for store in stores
+            if store.get("name") and store.get("id") is not None
+        }
+        if not entries:
+            return 0
+
+        version = await self.version()
+        await self.redis.hset(self._hash_key(version), mapping=entries)
+        return len(entries)
+
+    async def refresh(
+        self, fetch: Callable[[str], Awaitable[dict | None]], lock_ttl: int = 300
+    ) -> None:
+        lock_key = f"{self.prefix}:refresh_lock"
+        if not await self.redis.set(lock_key, "1", nx=True, ex=lock_ttl):
+            logger.info("Обновление индекса магазинов уже выполняется другим воркером")
+            return
+
+        try:
+            version = await self.version()
+            current = await self.redis.hgetall(self._hash_key(version))
+            names = [json.loads(value)["name"] for value in current.values()]
+            semaphore = asyncio.Semaphore(self.refresh_concurrency)
+
+            async def resolve(name):
+                async with semaphore:
+                    return name, await fetch(name)
+
+            fresh = {}
+            for name, store in await asyncio.gather(*(resolve(n) for n in names)):
+                if store and store.get("id") is not None:
+                    fresh[normalize_store_name(name)] = json.dumps(
+                        {"id": store["id"], "name": name}, ensure_ascii=False
+                    )
+
+            # Записи, добавленные во время обновления, и магазины, которые не
+            # удалось переразрешить, переносятся в новую версию как есть.
+            latest = await self.redis.hgetall(self._hash_key(version))
+            entries = {key.decode(): value for key, value in latest.items()}
+            entries.update(fresh)
+
+            new_version = version + 1
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if entries:
+                    pipe.hset(self._hash_key(new_version), mapping=entries)
+                pipe.set(self.version_key, new_version)
+                pipe.expire(self._hash_key(version), self.old_version_ttl)
+                await pipe.execute()
+
+            self._version_cache.clear()
+            logger.info(
+                "Индекс магазинов обновлен: версия %s, обновлено %s из %s магазинов",
+                new_version,
+                len(fresh),
+                len(names),
+            )
+        except Exception as e:
+            logger.error("Ошибка при обновлении индекса магазинов: %s", e)
+        finally:
+            await self.redis.delete(lock_key)
+
+
+store_index = StoreIndex(redis_client)